@@ -0,0 +1,250 @@
+"""
+Seeded generator of synthetic contacts and notes for the benchmarks.
+
+Every record is derived from the seed and its id alone, so any record of a
+data set can be rebuilt without generating the ones before it, and the same
+seed gives the same data on every machine.
+
+Usage:
+    python -m benchmarks.generate --contacts 100000 --notes 10000 --out data/
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import string
+
+FIRST_NAMES = (
+    "Olena",
+    "Taras",
+    "Iryna",
+    "Andrii",
+    "Oksana",
+    "Dmytro",
+    "Natalia",
+    "Serhii",
+    "Yulia",
+    "Oleksandr",
+    "Kateryna",
+    "Mykola",
+    "Sofia",
+    "Bohdan",
+    "Maria",
+    "Ivan",
+    "Anna",
+    "Petro",
+    "Daria",
+    "Roman",
+    "James",
+    "Emma",
+    "Liam",
+    "Olivia",
+    "Noah",
+)
+LAST_NAMES = (
+    "Shevchenko",
+    "Kovalenko",
+    "Bondarenko",
+    "Tkachenko",
+    "Kravchenko",
+    "Oliynyk",
+    "Shevchuk",
+    "Polishchuk",
+    "Lysenko",
+    "Marchenko",
+    "Melnyk",
+    "Savchenko",
+    "Rudenko",
+    "Moroz",
+    "Smith",
+    "Brown",
+    "Taylor",
+    "Wilson",
+    "Clark",
+    "Walker",
+)
+STREETS = (
+    "Khreshchatyk",
+    "Sumska",
+    "Deribasivska",
+    "Rynok Square",
+    "Shevchenko Ave",
+    "Main Street",
+    "Station Road",
+    "High Street",
+    "Park Lane",
+    "Lesi Ukrainky Blvd",
+)
+DOMAINS = ("example.com", "mail.net", "post.org", "inbox.ua", "company.io")
+WORDS = (
+    "meeting call project budget report plan review draft idea travel ticket hotel "
+    "invoice payment client order delivery gift birthday party dinner lunch recipe "
+    "book movie music gym doctor appointment school homework garden repair car "
+    "insurance tax bank deadline release bug feature design sprint retro demo"
+).split()
+TAGS = (
+    "work",
+    "home",
+    "family",
+    "friends",
+    "finance",
+    "health",
+    "travel",
+    "shopping",
+    "ideas",
+    "urgent",
+    "later",
+    "books",
+    "music",
+    "sport",
+    "study",
+    "car",
+)
+DEFAULT_SEED = 7
+BIRTHDAY_SHARE = 0.8
+EMAIL_SHARE = 0.7
+ADDRESS_SHARE = 0.5
+FIRST_NOTE_DATE = datetime(2020, 1, 1)
+
+
+def _random(seed, record_id, kind):
+    return random.Random(f"{seed}:{kind}:{record_id}")
+
+
+def _suffix(number):
+    """
+    Spells a positive number with letters (1 is "A", 27 is "Aa"), so that
+    generated names stay unique and alphabetic.
+    """
+    letters = []
+    while number:
+        number, digit = divmod(number - 1, 26)
+        letters.append(string.ascii_lowercase[digit])
+    return "".join(reversed(letters)).capitalize()
+
+
+def make_contact(record_id, seed=DEFAULT_SEED):
+    """
+    Builds the contact with the given id.
+
+    Names are unique, phones are ten digits, and emails and birthdays pass
+    the validation of the address book.
+
+    Args:
+        record_id (int): Id of the contact, from 1.
+        seed (int, optional): Seed of the data set. Defaults to DEFAULT_SEED.
+
+    Returns:
+        dict: The contact in the format of Record.record_to_dict.
+    """
+    rng = _random(seed, record_id, "contact")
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    name = f"{first} {last} {_suffix(record_id)}"
+    birthday = email = address = None
+    if rng.random() < BIRTHDAY_SHARE:
+        day = datetime(1950, 1, 1) + timedelta(days=rng.randrange(365 * 55))
+        birthday = day.strftime("%d.%m.%Y")
+    if rng.random() < EMAIL_SHARE:
+        email = f"{first.lower()}.{last.lower()}{record_id}@{rng.choice(DOMAINS)}"
+    if rng.random() < ADDRESS_SHARE:
+        address = f"{rng.choice(STREETS)} {rng.randint(1, 200)}"
+    return {
+        "id": record_id,
+        "name": name,
+        "phone": f"{rng.randrange(10**10):010d}",
+        "birthday": birthday,
+        "email": email,
+        "address": address,
+    }
+
+
+def make_note(note_id, seed=DEFAULT_SEED):
+    """
+    Builds the note with the given id.
+
+    Words follow a skewed distribution like real text, so some terms are
+    common and most are rare.
+
+    Args:
+        note_id (int): Id of the note, from 1.
+        seed (int, optional): Seed of the data set. Defaults to DEFAULT_SEED.
+
+    Returns:
+        dict: The note in the format of Note.to_dict.
+    """
+    rng = _random(seed, note_id, "note")
+    words = rng.choices(
+        WORDS,
+        weights=[1 / rank for rank in range(1, len(WORDS) + 1)],
+        k=rng.randint(5, 40),
+    )
+    created = FIRST_NOTE_DATE + timedelta(seconds=rng.randrange(5 * 365 * 24 * 3600))
+    return {
+        "id": note_id,
+        "text": " ".join(words),
+        "tags": rng.sample(TAGS, rng.randint(0, 3)),
+        "creation_date": created.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+
+def generate_contacts(count, seed=DEFAULT_SEED):
+    """
+    Lazily yields count contacts in id order.
+    """
+    for record_id in range(1, count + 1):
+        yield make_contact(record_id, seed)
+
+
+def generate_notes(count, seed=DEFAULT_SEED):
+    """
+    Lazily yields count notes in id order.
+    """
+    for note_id in range(1, count + 1):
+        yield make_note(note_id, seed)
+
+
+def write_json(path, rows):
+    """
+    Streams rows into a JSON array file like the one JournalStorage reads.
+
+    Args:
+        path (str): Path of the file.
+        rows (iterable): Record dictionaries.
+    """
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("[")
+        for number, row in enumerate(rows):
+            file.write(",\n" if number else "\n")
+            file.write(json.dumps(row))
+        file.write("\n]\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic contacts and notes."
+    )
+    parser.add_argument("--contacts", type=int, default=1000, help="number of contacts")
+    parser.add_argument("--notes", type=int, default=1000, help="number of notes")
+    parser.add_argument(
+        "--seed", type=int, default=DEFAULT_SEED, help="seed of the data set"
+    )
+    parser.add_argument(
+        "--out", default=".", help="directory for address_book.json and notes.json"
+    )
+    options = parser.parse_args()
+    os.makedirs(options.out, exist_ok=True)
+    write_json(
+        os.path.join(options.out, "address_book.json"),
+        generate_contacts(options.contacts, options.seed),
+    )
+    write_json(
+        os.path.join(options.out, "notes.json"),
+        generate_notes(options.notes, options.seed),
+    )
+
+
+if __name__ == "__main__":
+    main()
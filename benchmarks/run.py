@@ -0,0 +1,406 @@
+"""
+Benchmarks of the hot paths of AddressBook and Notebook on synthetic data.
+
+For every size the data set is generated into a temporary directory, then
+loading, queries, edits and saving are timed call by call. Results hold
+ops/sec, p50/p99 latency and the peak memory traced by tracemalloc for
+every operation, and are written as JSON so runs can be compared.
+
+Usage:
+    python -m benchmarks.run --sizes 1000 10000 100000 --storage snapshot
+    python -m benchmarks.run --compare old.json new.json
+"""
+
+import argparse
+from contextlib import redirect_stdout
+from datetime import datetime
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+
+from benchmarks.generate import (
+    DEFAULT_SEED,
+    LAST_NAMES,
+    TAGS,
+    WORDS,
+    generate_contacts,
+    generate_notes,
+    make_contact,
+    write_json,
+)
+from src.classes import (
+    AddressBook,
+    CONTACT_SNAPSHOT_FIELDS,
+    CONTACT_SORTED_FIELDS,
+)
+from src.class_notebook import Notebook, NOTE_SNAPSHOT_FIELDS, NOTE_LIST_FIELDS
+from src.snapshot import SnapshotStorage, write_snapshot
+from src.sqlite_storage import SQLiteContactStorage, SQLiteNoteStorage
+from src.storage import JournalStorage
+
+DEFAULT_SIZES = (1000, 10000)
+CALLS = 1000
+MEMORY_CALLS = 10
+SQLITE_CHUNK = 10000
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+
+def open_storages(directory, kind):
+    """
+    Returns the contact and note storages of a data set directory.
+    """
+    if kind == "sqlite":
+        path = os.path.join(directory, "neoneo.db")
+        return SQLiteContactStorage(path), SQLiteNoteStorage(path)
+    if kind == "snapshot":
+        return (
+            SnapshotStorage(
+                os.path.join(directory, "address_book.snap"),
+                CONTACT_SNAPSHOT_FIELDS,
+                sorted_fields=CONTACT_SORTED_FIELDS,
+            ),
+            SnapshotStorage(
+                os.path.join(directory, "notes.snap"),
+                NOTE_SNAPSHOT_FIELDS,
+                list_fields=NOTE_LIST_FIELDS,
+            ),
+        )
+    return (
+        JournalStorage(os.path.join(directory, "address_book.json")),
+        JournalStorage(os.path.join(directory, "notes.json")),
+    )
+
+
+def write_data_set(directory, kind, size, seed):
+    """
+    Streams a generated data set of size contacts and size notes into storage.
+    """
+    contacts = generate_contacts(size, seed)
+    notes = generate_notes(size, seed)
+    if kind == "json":
+        write_json(os.path.join(directory, "address_book.json"), contacts)
+        write_json(os.path.join(directory, "notes.json"), notes)
+    elif kind == "snapshot":
+        write_snapshot(
+            os.path.join(directory, "address_book.snap"),
+            contacts,
+            CONTACT_SNAPSHOT_FIELDS,
+            sorted_fields=CONTACT_SORTED_FIELDS,
+        )
+        write_snapshot(
+            os.path.join(directory, "notes.snap"),
+            notes,
+            NOTE_SNAPSHOT_FIELDS,
+            list_fields=NOTE_LIST_FIELDS,
+        )
+    else:
+        for storage, rows in zip(open_storages(directory, kind), (contacts, notes)):
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == SQLITE_CHUNK:
+                    storage.put_many(chunk)
+                    chunk = []
+            storage.put_many(chunk)
+            storage.close()
+
+
+def percentile(ordered, share):
+    """
+    Returns the value below which the given share of the sorted values lies.
+    """
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def measure(function, arguments, memory_arguments=()):
+    """
+    Times one call of the function per argument and traces the peak memory
+    of the calls with memory_arguments.
+
+    Returns:
+        tuple: Latencies in seconds and the peak traced memory in bytes.
+    """
+    latencies = []
+    for argument in arguments:
+        start = perf_counter()
+        function(argument)
+        latencies.append(perf_counter() - start)
+    peak = None
+    if memory_arguments:
+        tracemalloc.start()
+        try:
+            for argument in memory_arguments:
+                function(argument)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return latencies, peak
+
+
+def summarize(operation, size, latencies, peak):
+    """
+    Turns the latencies of an operation into a result entry.
+    """
+    ordered = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "operation": operation,
+        "size": size,
+        "calls": len(latencies),
+        "ops_per_sec": len(latencies) / total if total else None,
+        "p50_ms": percentile(ordered, 0.5) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+        "peak_memory_bytes": peak,
+    }
+
+
+def benchmark_size(size, kind, seed, calls, trace_memory):
+    """
+    Runs every benchmark on one data set size.
+
+    Returns:
+        list: Result entries, one per operation.
+    """
+    rng = random.Random(seed)
+    memory_calls = MEMORY_CALLS if trace_memory else 0
+    results = []
+
+    def run(operation, function, arguments):
+        arguments = list(arguments)
+        split = (
+            len(arguments) - memory_calls
+            if memory_calls < len(arguments)
+            else len(arguments)
+        )
+        memory_arguments = arguments[split:] if trace_memory else ()
+        latencies, peak = measure(function, arguments[:split], memory_arguments)
+        results.append(summarize(operation, size, latencies, peak))
+        entry = results[-1]
+        print(
+            f"{size:>10} {operation:<16} {entry['ops_per_sec'] or 0:>12.1f} ops/s"
+            f" p50 {entry['p50_ms']:>9.3f} ms p99 {entry['p99_ms']:>9.3f} ms",
+            file=sys.stderr,
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_data_set(directory, kind, size, seed)
+        books = []
+
+        def load_contacts(_):
+            book = AddressBook(open_storages(directory, kind)[0])
+            book.load_contacts_from_file()
+            books.append(book)
+
+        def load_notes(_):
+            notebook = Notebook(open_storages(directory, kind)[1])
+            notebook.load_from_file()
+            books.append(notebook)
+
+        run("load_contacts", load_contacts, [None] * (1 + bool(trace_memory)))
+        book = books[0]
+        run("load_notes", load_notes, [None] * (1 + bool(trace_memory)))
+        notebook = books[-2 if trace_memory else -1]
+        del books[:]
+
+        count = calls + memory_calls
+        ids = [rng.randint(1, size) for _ in range(count)]
+        run(
+            "find",
+            book.find,
+            (make_contact(record_id, seed)["name"] for record_id in ids),
+        )
+
+        queries = []
+        for _ in range(count):
+            last = rng.choice(LAST_NAMES).lower()
+            start = rng.randrange(len(last) - 3)
+            if rng.random() < 0.5:
+                queries.append(last[start : start + 4])
+            else:
+                queries.append(
+                    make_contact(rng.randint(1, size), seed)["name"][:8] + "*"
+                )
+        run("search", lambda query: list(book.search(query, limit=50)), queries)
+
+        run(
+            "next_birthdays",
+            book.next_birthdays,
+            (
+                rng.choice((7, 30, 365))
+                for _ in range(max(count // 10, memory_calls + 1))
+            ),
+        )
+
+        def find_notes(query):
+            tags, text = query
+            notebook.find_notes(tags, text, match_all=len(tags) > 1, limit=10)
+
+        run(
+            "find_notes",
+            find_notes,
+            (
+                (
+                    rng.sample(TAGS, rng.randint(0, 2)),
+                    " ".join(rng.sample(WORDS, rng.randint(0, 2))),
+                )
+                for _ in range(count)
+            ),
+        )
+
+        run(
+            "modify_note",
+            lambda note_id: notebook.modify_note(
+                note_id, " ".join(rng.sample(WORDS, 8))
+            ),
+            (rng.randint(1, size) for _ in range(count)),
+        )
+        run(
+            "modify_tags",
+            lambda note_id: notebook.modify_tags(note_id, rng.sample(TAGS, 2)),
+            (rng.randint(1, size) for _ in range(count)),
+        )
+
+        deleted = rng.sample(range(1, size + 1), min(count, size // 2))
+        run(
+            "delete_record",
+            book.delete_record,
+            (make_contact(record_id, seed)["name"] for record_id in deleted),
+        )
+
+        run(
+            "save_contacts",
+            lambda _: book.save_contacts_to_file(),
+            [None] * (1 + bool(trace_memory)),
+        )
+        run(
+            "save_notes",
+            lambda _: notebook.save_to_file(),
+            [None] * (1 + bool(trace_memory)),
+        )
+        book.close()
+        notebook.close()
+    return results
+
+
+def git_commit():
+    """
+    Returns the current commit of the repository, or None outside of git.
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, current_path):
+    """
+    Prints the change of ops/sec and p99 latency between two result files.
+    """
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {
+            (entry["size"], entry["operation"]): entry
+            for entry in json.load(file)["results"]
+        }
+    with open(current_path, encoding="utf-8") as file:
+        current = json.load(file)["results"]
+    print(f"{'size':>10} {'operation':<16} {'ops/s':>10} {'p99':>10}")
+    for entry in current:
+        old = baseline.get((entry["size"], entry["operation"]))
+        if not old or not old["ops_per_sec"] or not entry["ops_per_sec"]:
+            continue
+        speed = entry["ops_per_sec"] / old["ops_per_sec"]
+        p99 = entry["p99_ms"] / old["p99_ms"] if old["p99_ms"] else float("nan")
+        print(
+            f"{entry['size']:>10} {entry['operation']:<16} {speed:>9.2f}x {p99:>9.2f}x"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark AddressBook and Notebook.")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="data set sizes"
+    )
+    parser.add_argument(
+        "--storage",
+        choices=["json", "sqlite", "snapshot"],
+        default="json",
+        help="storage to load from",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=DEFAULT_SEED, help="seed of the data sets"
+    )
+    parser.add_argument(
+        "--calls", type=int, default=CALLS, help="timed calls per query operation"
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the tracemalloc passes"
+    )
+    parser.add_argument(
+        "--output",
+        help="result file (default: benchmarks/results/<commit>-<storage>.json)",
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASELINE", "CURRENT"),
+        help="compare two result files and exit",
+    )
+    options = parser.parse_args()
+    if options.compare:
+        compare(*options.compare)
+        return
+
+    commit = git_commit()
+    started = datetime.now().isoformat(timespec="seconds")
+    results = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for size in options.sizes:
+            results.extend(
+                benchmark_size(
+                    size,
+                    options.storage,
+                    options.seed,
+                    options.calls,
+                    not options.no_memory,
+                )
+            )
+
+    output = options.output or os.path.join(
+        RESULTS_DIRECTORY,
+        f"{commit or started.replace(':', '-')}-{options.storage}.json",
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "meta": {
+                    "commit": commit,
+                    "started": started,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "storage": options.storage,
+                    "seed": options.seed,
+                    "calls": options.calls,
+                },
+                "results": results,
+            },
+            file,
+            indent=4,
+        )
+    print(f"Results written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
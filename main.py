@@ -1,227 +1,345 @@
-from src.classes import AddressBook
-from src.handlers import *
-from src.handler_notebook import *
+import argparse
+import asyncio
+import sys
+from time import perf_counter
+
+from src.classes import (
+    AddressBook,
+    ADDRESS_BOOK_FILE_PATH,
+    ADDRESS_BOOK_SNAPSHOT_PATH,
+    CONTACT_SNAPSHOT_FIELDS,
+    CONTACT_SORTED_FIELDS,
+)
+from src.class_notebook import (
+    NOTE_BODY_CACHE_BYTES,
+    NOTES_FILE_PATH,
+    NOTES_SNAPSHOT_PATH,
+    NOTE_SNAPSHOT_FIELDS,
+    NOTE_LIST_FIELDS,
+)
+from src.commands import execute_line, parse_input, run_command
+from src.handler_notebook import notebook
+from src.metrics import STATS_DUMP_INTERVAL, metrics
+from src.sqlite_storage import (
+    DATABASE_FILE_PATH,
+    SQLiteContactStorage,
+    SQLiteNoteStorage,
+)
+from src.server import DEFAULT_ADDRESS, CommandServer, run_client
+from src.snapshot import SnapshotStorage
+from src.storage import AUTOSAVE_DELAY, JournalStorage, WriteBehindStorage
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+BATCH_CHECKPOINT = 1000
+
+
+def parse_arguments():
+    """
+    Parses the command-line options of the application.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description="CLI Contact Book and Notes App")
+    parser.add_argument(
+        "--storage",
+        choices=["json", "sqlite", "snapshot"],
+        default="json",
+        help="keep data in journaled JSON files (default), in an SQLite database"
+        " or in memory-mapped binary snapshots",
+    )
+    parser.add_argument(
+        "--db",
+        default=DATABASE_FILE_PATH,
+        help=f"SQLite database file (default: {DATABASE_FILE_PATH})",
+    )
+    parser.add_argument(
+        "--note-cache",
+        type=float,
+        default=NOTE_BODY_CACHE_BYTES / 1024 / 1024,
+        metavar="MB",
+        help="with snapshot storage, memory for note texts read from disk"
+        f" (default: {NOTE_BODY_CACHE_BYTES // 1024 // 1024} MB)",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="run the commands in FILE (plain lines or JSON Lines, '-' for stdin)"
+        " instead of prompting",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=int,
+        default=BATCH_CHECKPOINT,
+        metavar="N",
+        help=f"in batch mode, write changes every N commands, 0 for only at the end"
+        f" (default: {BATCH_CHECKPOINT})",
+    )
+    parser.add_argument(
+        "--autosave",
+        type=float,
+        default=AUTOSAVE_DELAY,
+        metavar="SECONDS",
+        help="at the prompt, write changes in the background SECONDS after the first one,"
+        f" 0 to write them with every command (default: {AUTOSAVE_DELAY:g})",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        const=DEFAULT_ADDRESS,
+        metavar="ADDRESS",
+        help="keep the data in memory and serve commands on a Unix socket path or"
+        f" HOST:PORT (default: {DEFAULT_ADDRESS})",
+    )
+    parser.add_argument(
+        "--client",
+        nargs="?",
+        const=DEFAULT_ADDRESS,
+        metavar="ADDRESS",
+        help="send commands to a running server instead of opening the data"
+        f" (default: {DEFAULT_ADDRESS})",
+    )
+    parser.add_argument(
+        "--stats-file",
+        metavar="FILE",
+        help="dump command and storage statistics to FILE as JSON periodically and on exit",
+    )
+    parser.add_argument(
+        "--stats-interval",
+        type=float,
+        default=STATS_DUMP_INTERVAL,
+        metavar="SECONDS",
+        help=f"seconds between statistics dumps (default: {STATS_DUMP_INTERVAL:g})",
+    )
+    return parser.parse_args()
+
+
+def open_storages(options):
+    """
+    Creates the storages for contacts and notes chosen on the command line.
 
-blue, reset, green, red, yellow = "\033[94m", "\033[0m", "\033[92m", "\033[91m", "\033[93m"
+    At the prompt they are wrapped to write in the background unless
+    --autosave is 0; batch mode and the server group writes themselves.
 
+    Args:
+        options (argparse.Namespace): The parsed command-line options.
 
-def parse_input(user_input):
+    Returns:
+        tuple: Storage for the address book and storage for the notebook.
     """
-        Parses user input and extracts the command and arguments.
+    storages = create_storages(options)
+    if options.autosave > 0 and not options.batch and not options.serve:
+        return tuple(
+            WriteBehindStorage(storage, options.autosave) for storage in storages
+        )
+    return storages
 
-        Args:
-            user_input (str): The input string provided by the user.
 
-        Returns:
-            tuple: A tuple containing the command (lowercased) and a list of arguments.
-        """
-    if not user_input.strip():
-        return "", []
-    cmd, *args = user_input.split()
-    return cmd.strip().lower(), *args
+def create_storages(options):
+    """
+    Creates the storages of the kind chosen with --storage.
+    """
+    if options.storage == "sqlite":
+        return (
+            SQLiteContactStorage(options.db, seed_path=ADDRESS_BOOK_FILE_PATH),
+            SQLiteNoteStorage(options.db, seed_path=NOTES_FILE_PATH),
+        )
+    if options.storage == "snapshot":
+        return (
+            SnapshotStorage(
+                ADDRESS_BOOK_SNAPSHOT_PATH,
+                CONTACT_SNAPSHOT_FIELDS,
+                sorted_fields=CONTACT_SORTED_FIELDS,
+                seed_path=ADDRESS_BOOK_FILE_PATH,
+            ),
+            SnapshotStorage(
+                NOTES_SNAPSHOT_PATH,
+                NOTE_SNAPSHOT_FIELDS,
+                list_fields=NOTE_LIST_FIELDS,
+                seed_path=NOTES_FILE_PATH,
+            ),
+        )
+    return JournalStorage(ADDRESS_BOOK_FILE_PATH), JournalStorage(NOTES_FILE_PATH)
 
 
 def main():
     """
-        Entry point for the address book and notes application.
-
-        This function initializes the address book and note storage,
-        loads existing data if available, and prompts the user for commands.
-
-        Commands:
-        - 'close': Exits the application.
-        - 'help': Displays a list of available commands and their descriptions.
-        - 'add-contact': Adds a new contact to the address book.
-        - 'change-phone': Changes the phone number of a contact.
-        - 'show-phone': Displays the phone number of a contact.
-        - 'add-birthday': Adds a birthday to a contact's record.
-        - 'show-birthday': Displays the birthday of a contact.
-        - 'next_birthdays': Displays upcoming birthdays.
-        - 'add-address': Adds an address to a contact's record.
-        - 'change-address': Changes the address of a contact.
-        - 'show-address': Displays the address of a contact.
-        - 'delete-address': Deletes the address of a contact.
-        - 'add-email': Adds an email address to a contact's record.
-        - 'change-email': Changes the email address of a contact.
-        - 'show-email': Displays the email address of a contact.
-        - 'delete-email': Deletes the email address of a contact.
-        - 'search': Searches for a contact by name.
-        - 'show-contacts': Displays all contacts in the address book.
-        - 'delete': Deletes a contact by name.
-        - 'nadd': Adds a new note with optional tags.
-        - 'nfind': Finds notes based on text and/or tags.
-        - 'nedit': Edits an existing note's text and/or tags.
-        - 'ndel': Deletes a note by ID.
-        - 'note': Finds a note by ID.
-        """
-
-    contacts = AddressBook()
-    print(f"{yellow}Welcome back Agent.\nI'm glad to see you alive.{reset}\n")
+    Entry point for the address book and notes application.
+
+    This function initializes the address book and note storage,
+    loads existing data if available, and prompts the user for commands.
+
+    Commands:
+    - 'close': Exits the application.
+    - 'help': Displays a list of available commands and their descriptions.
+    - 'add-contact': Adds a new contact to the address book.
+    - 'change-phone': Changes the phone number of a contact.
+    - 'show-phone': Displays the phone number of a contact.
+    - 'add-birthday': Adds a birthday to a contact's record.
+    - 'show-birthday': Displays the birthday of a contact.
+    - 'next_birthdays': Displays upcoming birthdays.
+    - 'add-address': Adds an address to a contact's record.
+    - 'change-address': Changes the address of a contact.
+    - 'show-address': Displays the address of a contact.
+    - 'delete-address': Deletes the address of a contact.
+    - 'add-email': Adds an email address to a contact's record.
+    - 'change-email': Changes the email address of a contact.
+    - 'show-email': Displays the email address of a contact.
+    - 'delete-email': Deletes the email address of a contact.
+    - 'search': Searches for a contact by name.
+    - 'fuzzy-search': Searches for contacts by a misspelled name.
+    - 'query': Finds contacts by conditions on their fields.
+    - 'dedupe': Finds and merges duplicate contacts.
+    - 'find-phone': Finds contacts by phone number or its first digits.
+    - 'show-contacts': Displays all contacts in the address book.
+    - 'delete': Deletes a contact by name.
+    - 'nadd': Adds a new note with optional tags.
+    - 'nfind': Finds notes based on text and/or tags.
+    - 'nedit': Edits an existing note's text and/or tags.
+    - 'ndel': Deletes a note by ID.
+    - 'note': Finds a note by ID.
+    - 'stats': Shows command latencies and storage I/O.
+    - 'profile': Runs a command under cProfile or tracemalloc.
+    """
+
+    options = parse_arguments()
+    if options.client:
+        try:
+            failed = run_client(options.client)
+        except OSError as error:
+            print(f"{red}Can't reach the server at {options.client}: {error}{reset}")
+            sys.exit(2)
+        sys.exit(1 if failed else 0)
+
+    if options.stats_file:
+        metrics.start_dumping(options.stats_file, options.stats_interval)
+    contacts_storage, notes_storage = open_storages(options)
+    contacts = AddressBook(contacts_storage)
+    notebook.use_storage(notes_storage)
+    notebook.body_cache_size = int(options.note_cache * 1024 * 1024)
+    log = sys.stderr if options.batch or options.serve else sys.stdout
+    if not options.batch and not options.serve:
+        print(f"{yellow}Welcome back Agent.\nI'm glad to see you alive.{reset}\n")
 
     try:
-        notebook.load_from_file("notes.json")
-        contacts.load_contacts_from_file()
+        notebook.load_from_file()
+        loaded, elapsed = contacts.load_contacts_from_file()
+        print(f"{blue}Loaded {loaded} contacts in {elapsed:.3f}s.{reset}", file=log)
     except FileNotFoundError:
-        print(f"{blue}DB is empty. Starting with an empty DB.{reset}")
+        print(f"{blue}DB is empty. Starting with an empty DB.{reset}", file=log)
+
+    if options.batch:
+        failed = run_batch(options.batch, contacts, options.checkpoint)
+        notebook.close()
+        contacts.close()
+        metrics.stop_dumping()
+        sys.exit(1 if failed else 0)
+
+    if options.serve:
+        asyncio.run(CommandServer(contacts, notebook).serve(options.serve))
+        notebook.close()
+        contacts.close()
+        metrics.stop_dumping()
+        return
 
     while True:
-        user_input = input(f"{blue}Enter a command: {reset}")
+        try:
+            user_input = input(f"{blue}Enter a command: {reset}")
+        except (EOFError, KeyboardInterrupt):
+            print()
+            close_storages(contacts)
+            exit()
         command, *args = parse_input(user_input)
-
-        if command in "close":
-            print(f"{yellow}Bye!\nI hope to see you alive next time.{reset}")
+        running, _ = run_command(command, args, contacts)
+        if not running:
+            close_storages(contacts)
             exit()
 
-        elif command == "help":
-            help_command()
-
-        elif command in [
-            "add-contact",
-            "change-phone",
-            "show-phone",
-            "add-birthday",
-            "show-birthday",
-            "next_birthdays",
-            "add-address",
-            "change-address",
-            "show-address",
-            "delete-address",
-            "add-email",
-            "change-email",
-            "show-email",
-            "delete-email",
-            "search",
-        ]:
-            response = globals()[command.replace("-", "_")](args, contacts)
-            print(response)
-
-        elif command == "show-contacts":
-            print(all_contacts(contacts))
-
-        elif command == "delete":
-            print(
-                contacts.delete_record(" ".join(args))
-                if args
-                else f"{red}The command is bad. Give me a name{reset}\n"
-            )
-
-        elif command == "nadd":
-            note_text = " ".join(args)
-            if note_text:
-                tags = [
-                    tag.strip()
-                    for tag in input(
-                        f"{blue}Enter tags separated by commas (optional): {reset}"
-                    ).split(",")
-                    if tag.strip()
-                ]
-                add_note(note_text, tags)
-                print(f"{green}Note was successfully created.{reset}")
-            else:
-                print(
-                    f"{red}No text entered. Note was not created. Give me a text for note.{reset}\n"
-                )
-
-        elif command == "nfind":
-            search_args = " ".join(args)
-            tags = [arg for arg in search_args.split() if arg.startswith("#")]
-            search_text = " ".join(
-                arg for arg in search_args.split() if not arg.startswith("#")
-            )
-            find_notes(tags=tags, search_text=search_text)
-
-        elif command == "nedit":
-            if not args:
-                print(f"{red}Enter note ID(a positive integer).{reset}\n")
-                continue
-
-            try:
-                note_id = int(args[0])
-
-                note = notebook.find_note_by_id(note_id)
-                if note is None:
-                    print(f"{red}There is no notates with id {note_id}.{reset}\n")
-                    continue
-
-            except:
-                print(f"{red}Invalid input. Give me id(a positive integer).{reset}\n")
-                continue
-
-            new_text = input(f"{blue}Enter new text for the note: {reset}")
-            tags = [
-                tag.strip()
-                for tag in input(
-                    f"{blue}Enter tags separated by commas (optional): {reset}"
-                ).split(",")
-                if tag.strip()
-            ]
-            modify_note(note_id, new_text, tags)
-
-        elif command == "ndel":
-            if not args:
-                print(
-                    f"{red}No note ID provided. Please enter a note ID(a positive integer).{reset}\n"
-                )
-            else:
-                delete_note(*args)
-
-        elif command == "note":
-            if not args:
-                print(
-                    f"{red}No note ID provided. Please enter a note ID(a positive integer).{reset}\n"
-                )
-            else:
-                find_note_by_id(*args)
-
-        elif not command:
-            print(f"{red}No command.{reset}")
-
-        else:
-            print(f"{red}Invalid command.{reset}")
-
-
-command_descriptions = {
-    "add-contact": "Add a new contact.",
-    "change-phone": "Change phone number for a contact.",
-    "show-phone": "Show phone number for a contact.",
-    "show-contacts": "Show all contacts.",
-    "add-birthday": "Add birthday for a contact.",
-    "show-birthday": "Show birthday for a contact.",
-    "next_birthdays": "Show upcoming birthdays.",
-    "add-address": "Add address for a contact.",
-    "change-address": "Change address for a contact.",
-    "show-address": "Show address for a contact.",
-    "delete": "Delete a contact.",
-    "delete-address": "Delete address for a contact.",
-    "search": "Search contacts by name.",
-    "add-email": "Add email for a contact.",
-    "change-email": "Change email for a contact.",
-    "show-email": "Show email for a contact.",
-    "delete-email": "Delete email for a contact.",
-    "nadd": "Add a new note.",
-    "nfind": "Find notes by tag or text.",
-    "nedit": "Edit an existing note.",
-    "ndel": "Delete a note.",
-    "note": "Find a note by ID.",
-    "help": "Show available commands and their descriptions.",
-    "close": "Close the program."
-}
-
-
-def help_command():
-    """
-    Displays a list of available commands and their descriptions.
-
-    Usage:
-        Call this function to print the available commands and their descriptions.
 
-    Example:
-        help_command()
+def run_batch(path, contacts, checkpoint=BATCH_CHECKPOINT):
+    """
+    Runs a script of commands without prompting.
+
+    Every line is a command as it would be typed at the prompt, or a JSON
+    object like {"command": "nadd", "args": ["Buy", "milk"], "input": ["home"]}
+    whose input answers the prompts of the command. Prompts of plain lines
+    are answered by the lines that follow. Blank lines and lines starting
+    with '#' are skipped.
+
+    Changes are written once every checkpoint commands, each group in one
+    transaction, instead of after every command. Command output goes to
+    stdout as usual; a status line per command and a summary go to stderr.
+
+    Args:
+        path (str): Path of the script, or '-' for stdin.
+        contacts (AddressBook): The address book.
+        checkpoint (int, optional): Commands per write, 0 for one write at the end.
+            Defaults to BATCH_CHECKPOINT.
+
+    Returns:
+        int: Number of failed commands.
+    """
+    file = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    lines = enumerate(file, start=1)
+    ran = failed = 0
+    start = perf_counter()
+    running = True
+    try:
+        while running:
+            with contacts.transaction(), notebook.transaction():
+                for number, line in lines:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    command_start = perf_counter()
+                    command, output, succeeded, running = execute_line(
+                        line, contacts, lines
+                    )
+                    sys.stdout.write(output)
+                    ran += 1
+                    status = f"{green}ok{reset}"
+                    if not succeeded:
+                        failed += 1
+                        status = f"{red}error{reset}"
+                    print(
+                        f"{number}: {status} {command or '-'} "
+                        f"({(perf_counter() - command_start) * 1000:.1f} ms)",
+                        file=sys.stderr,
+                    )
+                    if not running or (checkpoint and ran % checkpoint == 0):
+                        break
+                else:
+                    running = False
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    elapsed = perf_counter() - start
+    print(
+        f"{blue}Ran {ran} commands ({failed} failed) in {elapsed:.3f}s, "
+        f"{ran / elapsed if elapsed else 0:.0f} commands/s.{reset}",
+        file=sys.stderr,
+    )
+    return failed
+
+
+def close_storages(contacts):
+    """
+    Flushes the notebook and the address book and says goodbye.
 
+    Args:
+        contacts (AddressBook): The address book.
     """
-    print("Available commands:")
-    for command, description in command_descriptions.items():
-        print(f"{green}{(command + ':'):<15}{reset} {description}")
+    notebook.close()
+    contacts.close()
+    metrics.stop_dumping()
+    print(f"{yellow}Bye!\nI hope to see you alive next time.{reset}")
 
 
 if __name__ == "__main__":
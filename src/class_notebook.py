@@ -1,7 +1,29 @@
+from bisect import bisect_left, insort
+from contextlib import contextmanager
 from datetime import datetime
-import json
-
-blue, reset, green, red, yellow = "\033[94m", "\033[0m", "\033[92m", "\033[91m", "\033[93m"
+from itertools import islice
+
+from src.indexes import RangeIndex
+from src.metrics import metrics
+from src.snapshot import FieldCache, LazyRecords
+from src.storage import JournalStorage
+from src.text_index import TextIndex
+
+NOTES_FILE_PATH = "notes.json"
+NOTES_SNAPSHOT_PATH = "notes.snap"
+NOTE_SNAPSHOT_FIELDS = ("text", "tags", "creation_date")
+NOTE_LIST_FIELDS = ("tags",)
+NOTE_METADATA_FIELDS = ("tags", "creation_date")
+NOTE_BODY_CACHE_BYTES = 16 * 1024 * 1024
+NOTE_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
 
 
 class Note:
@@ -23,12 +45,17 @@ class Note:
 
     _last_id = 0
 
-    def __init__(self, text, tags=None):
+    def __init__(self, text, tags=None, note_id=None):
         """
         Initialize a Note object.
+
+        Without an id, the note is numbered by a counter shared by all notes;
+        a Notebook passes the id from its own allocator.
         """
-        Note._last_id += 1
-        self.id = Note._last_id
+        if note_id is None:
+            Note._last_id += 1
+            note_id = Note._last_id
+        self.id = note_id
         self.text = text
         self.tags = set(tags) if tags else set()
         self.creation_date = datetime.today()
@@ -43,9 +70,7 @@ class Note:
         """
         Set the tags for the note.
         """
-
-        for tag in tags:
-            self.tags = set(tags)
+        self.tags = set(tags)
 
     def to_dict(self):
         """
@@ -55,7 +80,7 @@ class Note:
             "id": self.id,
             "text": self.text,
             "tags": list(self.tags),
-            "creation_date": self.creation_date.strftime("%Y-%m-%d %H:%M:%S"),
+            "creation_date": self.creation_date.strftime(NOTE_DATE_FORMAT),
         }
 
     @staticmethod
@@ -63,11 +88,8 @@ class Note:
         """
         Create a note object from a dictionary.
         """
-        note = Note(data["text"], data["tags"])
-        note.id = data["id"]
-        note.creation_date = datetime.strptime(
-            data["creation_date"], "%Y-%m-%d %H:%M:%S"
-        )
+        note = Note(data["text"], data["tags"], data["id"])
+        note.creation_date = datetime.strptime(data["creation_date"], NOTE_DATE_FORMAT)
         return note
 
     def __repr__(self):
@@ -77,111 +99,267 @@ class Note:
         return f'Note(id={self.id}, text="{self.text}", tags={self.tags}, creation_date={self.creation_date})'
 
 
+class LazyNote(Note):
+    """
+    Note built from the metadata of a snapshot row, whose text is read on use.
+
+    The text comes from a cache of note bodies until it is modified; then it
+    is kept in the note like in any other.
+
+    Args:
+        data (dict): The id, tags and creation date of the note.
+        bodies (FieldCache): Cache that reads note texts from the snapshot.
+    """
+
+    def __init__(self, data, bodies):
+        self.id = data["id"]
+        self.tags = set(data["tags"])
+        self.creation_date = datetime.strptime(data["creation_date"], NOTE_DATE_FORMAT)
+        self._bodies = bodies
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            return self._bodies.get(self.id)
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        self._text = text
+
+
 class Notebook:
     """
     Represents a collection of notes.
 
+    Notes are kept in a mapping from id to note, which a lazy storage backs
+    with its snapshot, so only the notes that are read get built. New notes
+    are numbered after the highest id the storage ever held, so the id of a
+    deleted note is never given to another one.
+
+    Notes served from a snapshot only hold their id, tags and creation date;
+    their text is read when it is printed, searched or modified, and the
+    most recently used texts are kept in a cache of body_cache_size bytes.
+
     Attributes:
-        notes (list): A list of Note objects.
+        notes (list): A list of Note objects in id order.
+        storage (StorageBackend): Storage that persists every change of the notes.
+        body_cache_size (int): Memory in bytes for cached note texts of a snapshot.
 
     Methods:
         add_note(text, tags): Adds a new note to the notebook.
-        find_notes(tags, text): Finds notes based on tags and text content.
+        find_notes(tags, text, match_all, limit, since, until): Finds notes based on tags,
+            text content and creation date.
         _find_note_by_id(note_id): Finds a note by its ID (internal method).
         modify_note(note_id, new_text): Modifies the text content of a note.
         modify_tags(note_id, new_tags): Modifies the tags of a note.
         delete_note(note_id): Deletes a note by its ID.
         find_note_by_id(note_id): Finds a note by its ID.
+        transaction(): Groups changes into one atomic write that is undone on error.
+        checkpoint(): Writes the changes of the running transaction and keeps it open.
+        build_indexes(): Builds the tag, text and date indexes and applies deferred updates.
         save_to_file(file_name): Saves the notebook to a JSON file.
         load_from_file(file_name): Loads notes from a JSON file into the notebook.
+        use_storage(storage): Switches the notebook to another storage.
+        close(): Flushes pending changes to disk.
     """
-    def __init__(self):
+
+    def __init__(self, storage=None, body_cache_size=NOTE_BODY_CACHE_BYTES):
         """
         Initialize a Notebook object.
+
+        Args:
+            storage (StorageBackend, optional): Storage for the notes. Defaults to
+                a journal next to NOTES_FILE_PATH.
+            body_cache_size (int, optional): Memory in bytes for cached note
+                texts of a snapshot. Defaults to NOTE_BODY_CACHE_BYTES.
+        """
+        self.storage = storage or JournalStorage(NOTES_FILE_PATH)
+        self.body_cache_size = body_cache_size
+        self._notes_by_id = {}
+        self._tag_index = {}
+        self._text_index = TextIndex()
+        self._date_index = RangeIndex()
+        self._tags_indexed = True
+        self._text_indexed = True
+        self._dates_indexed = True
+        self._before = None
+        self._dirty = None
+        self._last_id = 0
+
+    @property
+    def notes(self):
+        """
+        All notes in id order.
         """
-        self.notes = []
+        return list(self._notes_by_id.values())
 
     def add_note(self, text, tags=None):
         """
         Adds a new note to the notebook.
         """
-        self.notes.append(Note(text, tags))
-        self.save_to_file("notes.json")
+        self._last_id += 1
+        note = Note(text, tags, self._last_id)
+        self._capture(note.id)
+        self._notes_by_id[note.id] = note
+        self._index_note(note)
+        self._persist(note.id)
 
-    def find_notes(self, tags=None, text=None):
-        """
-        Finds notes based on tags and text content.
+    def find_notes(
+        self, tags=None, text=None, match_all=False, limit=None, since=None, until=None
+    ):
         """
-        found_notes = self.notes
+        Finds notes based on tags, text content and creation date.
+
+        Tags are answered from the tag index: a note matches if it has any of
+        the tags, or all of them when match_all is set. Text is a full-text
+        query (words, prefixes like 'bon*' and "quoted phrases") answered
+        from the text index, and its results are ranked by relevance.
+        Without text, notes are returned in id order.
+
+        With since or until, the notes created in that range are read from
+        the date index and returned in date order, filtered by the tags and
+        the text; a limit keeps the most recent ones.
+
+        Only the index a query needs is built, so searching by tags or dates
+        never reads the text of notes served from a snapshot.
 
+        Args:
+            since (datetime, optional): Earliest creation date, inclusive.
+            until (datetime, optional): Latest creation date, exclusive.
+        """
+        note_ids = None
         if tags:
-            found_notes = [
-                note for note in found_notes if any(tag in note.tags for tag in tags)
-            ]
+            postings = [self._tag_ids(tag) for tag in set(tags)]
+            if match_all:
+                postings.sort(key=len)
+                note_ids = set(postings[0]).intersection(*postings[1:])
+            else:
+                note_ids = set().union(*postings)
+            metrics.scanned(sum(map(len, postings)))
+
+        if since is not None or until is not None:
+            return self._find_in_range(note_ids, text, limit, since, until)
 
         if text:
-            found_notes = [note for note in found_notes if text in note.text]
+            self._build_text_index()
+            ranked_ids = self._text_index.search(text, limit, note_ids)
+            return [self._notes_by_id[note_id] for note_id in ranked_ids]
+
+        if note_ids is None:
+            found_notes = list(islice(self._notes_by_id.values(), limit or None))
+        else:
+            found_notes = [self._notes_by_id[note_id] for note_id in sorted(note_ids)]
+        metrics.scanned(len(found_notes))
+        return found_notes[:limit] if limit else found_notes
+
+    def _tag_ids(self, tag):
+        """
+        Returns the ids of the notes with a tag (internal method).
 
-        return found_notes
+        Until the tag index is built, notes that are unchanged since the
+        snapshot was opened are looked up in its tag table if it has one.
+        A snapshot without one has the tag index built instead.
+        """
+        if not self._tags_indexed:
+            reader = self._notes_by_id.reader
+            if "tags" in reader.sorted_fields:
+                found = self._notes_by_id.unchanged(reader.find("tags", tag))
+                return self._tag_index.get(tag, []) + sorted(found)
+            self._build_tag_index()
+        return self._tag_index.get(tag, [])
+
+    def _find_in_range(self, note_ids, text, limit, since, until):
+        """
+        Returns the notes created in a date range in date order (internal method).
+        """
+        self._build_date_index()
+        entries = self._date_index.between(
+            since and since.strftime(NOTE_DATE_FORMAT),
+            until and until.strftime(NOTE_DATE_FORMAT),
+        )
+        metrics.scanned(len(entries))
+        found_ids = [note_id for _, note_id in entries]
+        if note_ids is not None:
+            found_ids = [note_id for note_id in found_ids if note_id in note_ids]
+        if text:
+            self._build_text_index()
+            matching = set(self._text_index.search(text, None, set(found_ids)))
+            found_ids = [note_id for note_id in found_ids if note_id in matching]
+        if limit:
+            found_ids = found_ids[-limit:]
+        return [self._notes_by_id[note_id] for note_id in found_ids]
 
     def _find_note_by_id(self, note_id):
         """
         Finds a note by its ID (internal method).
         """
-        for note in self.notes:
-            if note.id == note_id:
-                return note
-        return None
+        return self._notes_by_id.get(note_id)
 
     def modify_note(self, note_id, new_text):
         """
         Modifies the text content of a note.
         """
-        for note in self.notes:
-            if note.id == note_id:
-                if new_text == "clear":
-                    new_text = ""
-
-                note.modify(new_text)
-                print(
-                    f"{green}Text of the Note with ID {note_id} has been modified.{reset}"
-                )
-                self.save_to_file("notes.json")
-                break
+        note = self._find_note_by_id(note_id)
+        if note:
+            if new_text == "clear":
+                new_text = ""
+
+            self._capture(note_id)
+            in_tag_index = self._in_tag_index(note.id)
+            if self._in_text_index(note.id):
+                self._text_index.remove(note.id, note.text)
+            note.modify(new_text)
+            self._notes_by_id[note.id] = note
+            self._text_index.add(note.id, note.text)
+            if not in_tag_index:
+                self._index_tags(note)
+            self._index_date(note)
+            print(
+                f"{green}Text of the Note with ID {note_id} has been modified.{reset}"
+            )
+            self._persist(note_id)
 
     def modify_tags(self, note_id, new_tags):
         """
         Modifies the tags of a note.
         """
-        for note in self.notes:
-            if note.id == note_id:
-                if new_tags == ["clear"]:
-                    note.set_tags(set())
-                    print(
-                        f"{green}All tags of the Note with ID {note_id} have been cleared.{reset}"
-                    )
-                else:
-                    note.set_tags(new_tags)
-                    print(
-                        f"{green}Tags of the Note with ID {note_id} has been modified.{reset}\n"
-                    )
-
-        self.save_to_file("notes.json")
+        note = self._find_note_by_id(note_id)
+        if note:
+            self._capture(note_id)
+            in_text_index = self._in_text_index(note.id)
+            if self._in_tag_index(note.id):
+                self._unindex_tags(note)
+            if new_tags == ["clear"]:
+                note.set_tags(set())
+                print(
+                    f"{green}All tags of the Note with ID {note_id} have been cleared.{reset}"
+                )
+            else:
+                note.set_tags(new_tags)
+                print(
+                    f"{green}Tags of the Note with ID {note_id} has been modified.{reset}\n"
+                )
+            self._notes_by_id[note.id] = note
+            self._index_tags(note)
+            if not in_text_index:
+                self._text_index.add(note.id, note.text)
+            self._index_date(note)
+            self._persist(note_id)
 
     def delete_note(self, note_id):
         """
         Deletes a note by its ID.
         """
-        note_to_delete = None
-        for note in self.notes:
-            if note.id == note_id:
-                note_to_delete = note
-                break
+        note_to_delete = self._find_note_by_id(note_id)
 
         if note_to_delete:
-            self.notes.remove(note_to_delete)
+            self._capture(note_id)
+            self._unindex_note(note_to_delete)
+            del self._notes_by_id[note_id]
             print(f"{green}Note with ID {note_id} has been deleted.{reset}")
-            self.save_to_file("notes.json")
+            self._persist(note_id)
         else:
             print(f"{red}No notes found with ID {note_id}.{reset}\n")
 
@@ -189,23 +367,258 @@ class Notebook:
         """
         Finds a note by its ID.
         """
-        for note in self.notes:
-            if note.id == note_id:
-                return note
-        return None
+        return self._find_note_by_id(note_id)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups changes into one atomic write that is undone on error.
+
+        Changed and deleted notes are written to the storage in one batch when
+        the block ends. If it raises, every note it changed is restored. A
+        nested transaction joins the outer one.
+        """
+        if self._dirty is not None:
+            yield self
+            return
+        self._before = {}
+        self._dirty = set()
+        try:
+            yield self
+            self._write_dirty()
+        except BaseException:
+            self._rollback()
+            raise
+        finally:
+            self._before = None
+            self._dirty = None
+
+    def checkpoint(self):
+        """
+        Writes the changes of the running transaction so far and keeps it open.
+
+        If the write fails the changes stay marked dirty and are written by the
+        next checkpoint or when the transaction ends. Outside a transaction it
+        does nothing.
+        """
+        if self._dirty is None:
+            return
+        self._write_dirty()
+        self._before = {}
+        self._dirty = set()
+
+    def _write_dirty(self):
+        """
+        Writes the notes marked dirty by the running transaction in one batch (internal method).
+        """
+        changes = []
+        for note_id in sorted(self._dirty):
+            note = self._find_note_by_id(note_id)
+            changes.append((note_id, note.to_dict() if note else None))
+        if changes:
+            self.storage.apply(changes)
+
+    def save_to_file(self, file_name=None):
+        """
+        Saves all notes to the storage, replacing what it held.
+
+        With a file name, the notebook switches to a journal next to that JSON
+        file first.
+        """
+        if file_name:
+            self._use_file(file_name)
+        self.storage.save([note.to_dict() for note in self.notes])
+
+    def load_from_file(self, file_name=None):
+        """
+        Loads all notes from the storage.
+
+        With a file name, the notebook switches to a journal next to that JSON
+        file first. A lazy storage only maps its snapshot: notes are built when
+        they are read and the tag and text indexes on the first search.
+        """
+        if file_name:
+            self._use_file(file_name)
+        self._notes_by_id = {}
+        self._tag_index = {}
+        self._text_index = TextIndex()
+        self._date_index = RangeIndex()
+        self._tags_indexed = True
+        self._text_indexed = True
+        self._dates_indexed = True
+        self._last_id = 0
+        if self.storage.lazy:
+            reader, changes = self.storage.open_snapshot()
+            bodies = FieldCache(reader, "text", self.body_cache_size)
+            self._notes_by_id = LazyRecords(
+                reader, lambda data: LazyNote(data, bodies), NOTE_METADATA_FIELDS
+            )
+            self._tags_indexed = False
+            self._text_indexed = False
+            self._dates_indexed = False
+            for note_id, note_data in changes.items():
+                if note_data is not None:
+                    self._index_note(Note.from_dict(note_data))
+                elif note_id in self._notes_by_id:
+                    del self._notes_by_id[note_id]
+        else:
+            for note_data in self.storage.load():
+                note = Note.from_dict(note_data)
+                self._index_note(note)
+                self._last_id = max(self._last_id, note.id)
+        self._last_id = max(self._last_id, self.storage.last_id())
+
+    def close(self):
+        """
+        Flushes pending changes to disk.
+        """
+        self.storage.close()
+
+    def use_storage(self, storage):
+        """
+        Switches the notebook to another storage.
+        """
+        self.storage.close()
+        self.storage = storage
+
+    def _use_file(self, file_name):
+        """
+        Switches the storage to a journal next to another JSON file (internal method).
+        """
+        if getattr(self.storage, "snapshot_path", None) != file_name:
+            self.use_storage(JournalStorage(file_name))
+
+    def _persist(self, note_id):
+        """
+        Writes a changed or deleted note, or marks it dirty inside a transaction (internal method).
+        """
+        if self._dirty is not None:
+            self._dirty.add(note_id)
+            return
+        note = self._find_note_by_id(note_id)
+        if note:
+            self.storage.put(note.to_dict())
+        else:
+            self.storage.delete(note_id)
+
+    def _capture(self, note_id):
+        """
+        Keeps a copy of a note the first time a transaction changes it (internal method).
+        """
+        if self._before is not None and note_id not in self._before:
+            note = self._find_note_by_id(note_id)
+            self._before[note_id] = note.to_dict() if note else None
+
+    def _rollback(self):
+        """
+        Restores every note changed by the running transaction (internal method).
+        """
+        for note_id, note_data in self._before.items():
+            note = self._find_note_by_id(note_id)
+            if note:
+                self._unindex_note(note)
+                del self._notes_by_id[note_id]
+            if note_data is not None:
+                self._index_note(Note.from_dict(note_data))
+
+    def _unindex_note(self, note):
+        """
+        Removes a note from the tag, the text and the date index if it is there (internal method).
+        """
+        if self._in_tag_index(note.id):
+            self._unindex_tags(note)
+        if self._in_text_index(note.id):
+            self._text_index.remove(note.id, note.text)
+        self._date_index.remove(note.id)
+
+    def _in_tag_index(self, note_id):
+        """
+        Tells whether a note is in the tag index (internal method).
+        """
+        return self._tags_indexed or self._notes_by_id.is_changed(note_id)
+
+    def _in_text_index(self, note_id):
+        """
+        Tells whether a note is in the text index (internal method).
+        """
+        return self._text_indexed or self._notes_by_id.is_changed(note_id)
+
+    def build_indexes(self):
+        """
+        Builds the tag, text and date indexes and applies deferred updates.
+
+        Searches then only read the indexes, so they can run from several
+        threads at once as long as nothing is changed meanwhile.
+        """
+        self._build_tag_index()
+        self._build_text_index()
+        self._build_date_index()
+        self._text_index.merge()
+        self._date_index.merge()
+
+    def _build_tag_index(self):
+        """
+        Indexes the tags of the notes still served from the snapshot, on first need (internal method).
+        """
+        if self._tags_indexed:
+            return
+        for note_id, tags in self._notes_by_id.snapshot_field("tags"):
+            for tag in tags:
+                insort(self._tag_index.setdefault(tag, []), note_id)
+        self._tags_indexed = True
+
+    def _build_text_index(self):
+        """
+        Indexes the text of the notes still served from the snapshot, on first need (internal method).
+
+        The texts are streamed from the snapshot without being cached.
+        """
+        if self._text_indexed:
+            return
+        for note_id, text in self._notes_by_id.snapshot_field("text"):
+            self._text_index.add(note_id, text)
+        self._text_indexed = True
+
+    def _build_date_index(self):
+        """
+        Indexes the creation dates of the notes still served from the snapshot, on first need (internal method).
+
+        Dates are kept as written, which sorts in date order, so none is parsed.
+        """
+        if self._dates_indexed:
+            return
+        for note_id, creation_date in self._notes_by_id.snapshot_field("creation_date"):
+            self._date_index.add(note_id, creation_date)
+        self._dates_indexed = True
+
+    def _index_note(self, note):
+        """
+        Adds a new note to the id map, the tag, the text and the date index (internal method).
+        """
+        self._notes_by_id[note.id] = note
+        self._index_tags(note)
+        self._text_index.add(note.id, note.text)
+        self._index_date(note)
+
+    def _index_date(self, note):
+        """
+        Adds the note to the date index, or keeps it there (internal method).
+        """
+        self._date_index.add(note.id, note.creation_date.strftime(NOTE_DATE_FORMAT))
 
-    def save_to_file(self, file_name):
+    def _index_tags(self, note):
         """
-        Saves the notebook to a JSON file.
+        Adds the note id to the sorted postings of each of its tags (internal method).
         """
-        with open(file_name, "w") as file:
-            notes_dict = [note.to_dict() for note in self.notes]
-            json.dump(notes_dict, file, indent=4)
+        for tag in note.tags:
+            insort(self._tag_index.setdefault(tag, []), note.id)
 
-    def load_from_file(self, file_name):
+    def _unindex_tags(self, note):
         """
-        Loads notes from a JSON file into the notebook.
+        Removes the note id from the postings of each of its tags (internal method).
         """
-        with open(file_name, "r") as file:
-            notes_dict = json.load(file)
-            self.notes = [Note.from_dict(note_data) for note_data in notes_dict]
+        for tag in note.tags:
+            postings = self._tag_index[tag]
+            del postings[bisect_left(postings, note.id)]
+            if not postings:
+                del self._tag_index[tag]
@@ -1,13 +1,57 @@
-import json
 from collections import UserDict, defaultdict
+from contextlib import contextmanager
+from heapq import merge
+from itertools import islice
 import re
 from datetime import timedelta, datetime, date
 import calendar
+from time import perf_counter
 
+from src.error_handler import failed
+from src.metrics import metrics
+from src.indexes import (
+    FuzzyIndex,
+    KeyIndex,
+    NGramIndex,
+    PrefixTrie,
+    RangeIndex,
+)
+from src.snapshot import LazyRecords
+from src.storage import JournalStorage
 
-ADDRESS_BOOK_FILE_PATH = "address_book.json"
 
-blue, reset, green, red, yellow = "\033[94m", "\033[0m", "\033[92m", "\033[91m", "\033[93m"
+ADDRESS_BOOK_FILE_PATH = "address_book.json"
+ADDRESS_BOOK_SNAPSHOT_PATH = "address_book.snap"
+# Fields of a contact in a binary snapshot, and the name and phone lookups it keeps sorted.
+CONTACT_SNAPSHOT_FIELDS = ("name", "phone", "birthday", "email", "address")
+CONTACT_SORTED_FIELDS = ("name", "name:casefold", "phone")
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+PHONE_DIGITS = 10
+PHONE_PATTERN = re.compile(r"\d{10}")
+PHONE_PREFIX_PATTERN = re.compile(r"\d{1,10}")
+# Same addresses as ([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@..., where [.-_] is the
+# range from '.' to '_', but without the nested quantifiers that backtrack.
+EMAIL_PATTERN = re.compile(
+    r"[A-Za-z0-9]+(?:[./:;<=>?@\[\\\]^_][A-Za-z0-9]+)*@[A-Za-z0-9-]+(?:\.[A-Z|a-z]{2,})+"
+)
+BIRTHDAY_PATTERN = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+PHONE_ERROR = f"{red}Phone number must contain 10 digits.{reset}\n"
+PHONE_PREFIX_ERROR = (
+    f"{red}Give me a phone number or its first digits, up to 10 digits.{reset}\n"
+)
+EMAIL_ERROR = (
+    f"{red}Email must be in format (username)@(domainname).(top-leveldomain).{reset}\n"
+)
+BIRTHDAY_ERROR = f"{red}The date format is not 'DD.MM.YYYY'{reset}\n"
 
 
 class Field:
@@ -17,12 +61,69 @@ class Field:
     Attributes:
         value: The value associated with the field.
     """
+
+    __slots__ = ("value",)
+
     def __init__(self, value):
         self.value = value
 
     def __str__(self):
         return str(self.value)
 
+    @classmethod
+    def validate(cls, value):
+        """
+        Checks a raw value and returns it in the form the field keeps.
+
+        Args:
+            value: The raw value.
+
+        Returns:
+            The validated value.
+
+        Raises:
+            ValueError: If the value is not valid for the field.
+        """
+        return value
+
+    @classmethod
+    def validate_column(cls, values):
+        """
+        Validates a whole column of raw values in one pass.
+
+        Empty values are skipped, as optional fields may be missing.
+
+        Args:
+            values (iterable): Raw values, one per row.
+
+        Returns:
+            dict: Maps the index of every invalid row to its error message.
+        """
+        validate = cls.validate
+        errors = {}
+        for row, value in enumerate(values):
+            if value:
+                try:
+                    validate(value)
+                except ValueError as error:
+                    errors[row] = str(error)
+        return errors
+
+    @classmethod
+    def from_trusted(cls, value):
+        """
+        Builds a field from a value that was already validated, without checking it again.
+
+        Args:
+            value: The validated value.
+
+        Returns:
+            Field: The field object.
+        """
+        field = cls.__new__(cls)
+        field.value = value
+        return field
+
 
 class Name(Field):
     """
@@ -31,21 +132,34 @@ class Name(Field):
     Args:
         value (str): The name value.
     """
+
+    __slots__ = ()
+
     def __init__(self, value):
         super().__init__(value)
 
 
 class Phone(Field):
     """
-   Represents a phone number.
+    Represents a phone number.
+
+    Args:
+        value (str): The phone number value (must contain 10 digits).
+    """
+
+    __slots__ = ()
 
-   Args:
-       value (str): The phone number value (must contain 10 digits).
-   """
     def __init__(self, value):
-        if not re.fullmatch(r"\d{10}", value):
-            raise ValueError(f"{red}Phone number must contain 10 digits.{reset}\n")
-        super().__init__(value)
+        super().__init__(self.validate(value))
+
+    @classmethod
+    def validate(cls, value):
+        """
+        Checks that the phone number consists of exactly 10 digits.
+        """
+        if not PHONE_PATTERN.fullmatch(value):
+            raise ValueError(PHONE_ERROR)
+        return value
 
 
 class Birthday(Field):
@@ -54,13 +168,49 @@ class Birthday(Field):
 
     Args:
         birthday (str): The birthday value in 'DD.MM.YYYY' format.
+
+    Attributes:
+        date (date): The parsed birthday.
     """
+
+    __slots__ = ("date",)
+
     def __init__(self, birthday):
+        self.date = self.validate(birthday)
+        super().__init__(birthday)
+
+    @classmethod
+    def validate(cls, value):
+        """
+        Parses a 'DD.MM.YYYY' birthday without going through strptime.
+
+        Returns:
+            date: The parsed birthday.
+        """
+        match = BIRTHDAY_PATTERN.fullmatch(value)
+        if not match:
+            raise ValueError(BIRTHDAY_ERROR)
+        day, month, year = map(int, match.groups())
         try:
-            datetime.strptime(birthday, "%d.%m.%Y")
+            return date(year, month, day)
         except ValueError:
-            raise ValueError(f"{red}The date format is not 'DD.MM.YYYY'{reset}\n")
-        super().__init__(birthday)
+            raise ValueError(BIRTHDAY_ERROR)
+
+    @classmethod
+    def from_ordinal(cls, ordinal):
+        """
+        Builds a birthday from a proleptic Gregorian ordinal without validating it again.
+
+        Args:
+            ordinal (int): The ordinal of the date, as returned by date.toordinal().
+
+        Returns:
+            Birthday: The birthday object.
+        """
+        birthday = cls.__new__(cls)
+        birthday.date = date.fromordinal(ordinal)
+        birthday.value = f"{birthday.date.day:02d}.{birthday.date.month:02d}.{birthday.date.year:04d}"
+        return birthday
 
 
 class Address(Field):
@@ -70,6 +220,9 @@ class Address(Field):
     Args:
         value (str): The address value.
     """
+
+    __slots__ = ()
+
     def __init__(self, value):
         super().__init__(value)
 
@@ -81,25 +234,59 @@ class Email(Field):
     Args:
         value (str): The email address value (must be in format 'username@domain.top-leveldomain').
     """
+
+    __slots__ = ()
+
     def __init__(self, value):
-        regex = re.compile(
-            r"([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(\.[A-Z|a-z]{2,})+"
-        )
-        if not re.fullmatch(regex, value):
-            raise ValueError(
-                f"{red}Email must be in format (username)@(domainname).(top-leveldomain).{reset}\n"
-            )
-        super().__init__(value)
+        super().__init__(self.validate(value))
+
+    @classmethod
+    def validate(cls, value):
+        """
+        Checks the email address against the precompiled pattern.
+        """
+        if not EMAIL_PATTERN.fullmatch(value):
+            raise ValueError(EMAIL_ERROR)
+        return value
+
+
+def validate_records(rows):
+    """
+    Validates the phone, email and birthday columns of many records at once.
+
+    Args:
+        rows (list): Record dictionaries as produced by Record.record_to_dict.
+
+    Returns:
+        dict: Maps the index of every invalid row to a dictionary of field name
+            and error message.
+    """
+    errors = {}
+    for field, field_class in (
+        ("phone", Phone),
+        ("email", Email),
+        ("birthday", Birthday),
+    ):
+        column = [row.get(field) for row in rows]
+        for row, message in field_class.validate_column(column).items():
+            errors.setdefault(row, {})[field] = message
+    return errors
 
 
 class Record:
     """
     Represents a contact record with associated information such as name, phone number, birthday, address, and email.
 
+    To keep large books small in memory, a record stores plain values in slots:
+    the phone as an integer, the birthday as a date ordinal and the other
+    fields as strings. The field objects below are validated when they are
+    assigned and rebuilt on demand when they are read.
+
     Attributes:
         id (int): Unique identifier for the record.
         name (Name): Name object representing the contact's name.
         phone (Phone): Phone object representing the contact's phone number.
+        phone_number (int): The phone number as an integer, for indexes.
         email (Email): Email object representing the contact's email address.
         birthday (Birthday): Birthday object representing the contact's birthday.
         address (Address): Address object representing the contact's address.
@@ -125,6 +312,8 @@ class Record:
 
     """
 
+    __slots__ = ("id", "_name", "_phone", "_email", "_birthday", "_address")
+
     _last_id = 0
 
     def __init__(self, name, phone=None, birthday=None, address=None, email=None):
@@ -146,7 +335,71 @@ class Record:
         self.birthday = Birthday(birthday) if birthday else None
         self.address = Address(address) if address else None
 
-# Phone block
+    @property
+    def name(self):
+        return Name.from_trusted(self._name)
+
+    @name.setter
+    def name(self, name):
+        self._name = name.value
+
+    @property
+    def phone(self):
+        if self._phone is None:
+            return None
+        return Phone.from_trusted(f"{self._phone:010d}")
+
+    @phone.setter
+    def phone(self, phone):
+        self._phone = int(phone.value) if phone else None
+
+    @property
+    def phone_number(self):
+        """
+        The phone as the integer kept in the slot, or None, for indexes that
+        compare numbers without building a Phone.
+        """
+        return self._phone
+
+    @property
+    def email(self):
+        return Email.from_trusted(self._email) if self._email is not None else None
+
+    @email.setter
+    def email(self, email):
+        self._email = email.value if email else None
+
+    @property
+    def birthday(self):
+        if self._birthday is None:
+            return None
+        return Birthday.from_ordinal(self._birthday)
+
+    @birthday.setter
+    def birthday(self, birthday):
+        self._birthday = birthday.date.toordinal() if birthday else None
+
+    @property
+    def birthday_key(self):
+        """
+        The birthday as (month, day), or None, for the index of upcoming birthdays.
+        """
+        if self._birthday is None:
+            return None
+        birthday = date.fromordinal(self._birthday)
+        return birthday.month, birthday.day
+
+    @property
+    def address(self):
+        return (
+            Address.from_trusted(self._address) if self._address is not None else None
+        )
+
+    @address.setter
+    def address(self, address):
+        self._address = address.value if address else None
+
+    # Phone block
     def add_phone(self, phone):
         """
         Adds a phone number to the record.
@@ -173,19 +426,19 @@ class Record:
 
     def find_phone(self, phone):
         """
-          Searches for a phone number within the record.
+        Searches for a phone number within the record.
 
-          Args:
-              phone (str): Phone number to search for.
+        Args:
+            phone (str): Phone number to search for.
 
-          Returns:
-              Phone: Phone object if found, None otherwise.
-          """
+        Returns:
+            Phone: Phone object if found, None otherwise.
+        """
         if self.phone and self.phone.value == phone:
             return self.phone
         return None
 
-# Birthday block
+    # Birthday block
     def add_birthday(self, birthday):
         """
         Adds a birthday to the record.
@@ -204,7 +457,7 @@ class Record:
         else:
             print(f"{red}Birthday not set.{reset}\n")
 
-# Address block
+    # Address block
     def add_address(self, address):
         """
         Adds an address to the record.
@@ -247,7 +500,7 @@ class Record:
         """
         self.address = None
 
-# Email block
+    # Email block
     def add_email(self, email):
         """
         Adds an email address to the record.
@@ -288,7 +541,7 @@ class Record:
         """
         self.email = None
 
-# Dictionary methods
+    # Dictionary methods
 
     def record_to_dict(self):
         """
@@ -311,25 +564,45 @@ class Record:
         """
         Creates a Record object from a dictionary.
 
+        A stored record skips the field objects: its values are checked with
+        the precompiled validators and go straight into the slots, and its id
+        is kept without touching the id counter; the AddressBook moves the
+        counter past the ids it holds. A dictionary without an id becomes a
+        new record.
+
         Args:
             data (dict): Dictionary containing record data.
 
         Returns:
             Record: Record object created from the provided dictionary.
+
+        Raises:
+            ValueError: If the phone, email or birthday is not valid.
         """
-        return cls(
-            name=data.get("name"),
-            phone=data.get("phone"),
-            birthday=data.get("birthday"),
-            email=data.get("email"),
-            address=data.get("address"),
-        )
+        if data.get("id") is None:
+            return cls(
+                name=data.get("name"),
+                phone=data.get("phone"),
+                birthday=data.get("birthday"),
+                email=data.get("email"),
+                address=data.get("address"),
+            )
+        record = cls.__new__(cls)
+        record.id = data["id"]
+        record._name = data["name"]
+        phone, birthday = data.get("phone"), data.get("birthday")
+        email, address = data.get("email"), data.get("address")
+        record._phone = int(Phone.validate(phone)) if phone else None
+        record._email = Email.validate(email) if email else None
+        record._birthday = Birthday.validate(birthday).toordinal() if birthday else None
+        record._address = Address.validate(address) if address else None
+        return record
 
     def __str__(self):
         address = f"{self.address.value if self.address else '':^20}"
         birthday = f"{self.birthday.value if self.birthday else '':^20}"
         email = f"{self.email.value if self.email else '':^20}"
-        phone = f"{self.phone.value:^20}"
+        phone = f"{self.phone.value if self.phone else '':^20}"
         separator = f"|{(('-'*22)+'+')*5}-------|"
         contact_info = f"| {yellow}{self.name.value:<20}{reset} | {phone} | {email} | {birthday} | {address} | {self.id:^5} |"
         return f"{contact_info}\n{separator}"
@@ -339,120 +612,659 @@ class AddressBook(UserDict):
     """
     Represents an address book to manage contacts.
 
+    Attributes:
+        storage (StorageBackend): Storage that persists every change of the book.
+
     Methods:
         add_record: Adds a record to the address book.
+        add_records: Adds many records to the address book at once.
         search: Searches for records containing a given query in the name.
+        fuzzy_search: Searches for records whose name is a few typos away from a query.
         find: Finds a record by name.
+        find_all: Finds all records with a name.
+        find_by_phone: Finds records by phone number or by its first digits.
+        candidate_ids: Returns the ids an index gives for a query condition.
         delete_record: Deletes a record by name.
+        remove_record: Deletes a record by id.
+        get_for_update: Returns a record that is about to be changed in place.
+        transaction: Groups changes into one atomic write that is undone on error.
+        checkpoint: Writes the changes of the running transaction so far.
         save_contacts_to_file: Saves contacts to a file in JSON format.
         load_contacts_from_file: Loads contacts from a JSON file.
+        close: Flushes pending changes to disk.
+        build_indexes: Builds all indexes and applies deferred updates.
         next_birthdays: Finds upcoming birthdays within a specified number of days.
 
     """
 
+    def __init__(self, storage=None):
+        """
+        Initializes an empty address book.
+
+        Args:
+            storage (StorageBackend, optional): Storage for the book. Defaults to
+                a journal next to ADDRESS_BOOK_FILE_PATH.
+        """
+        super().__init__()
+        self.storage = storage or JournalStorage(ADDRESS_BOOK_FILE_PATH)
+        self._names = KeyIndex(lambda record: record.name.value)
+        self._folded_names = KeyIndex(lambda record: record.name.value.casefold())
+        self._name_prefixes = PrefixTrie(lambda record: record.name.value.casefold())
+        self._name_grams = NGramIndex(lambda record: record.name.value.casefold())
+        self._name_words = None
+        self._birthdays = RangeIndex()
+        self._phones = KeyIndex(lambda record: record.phone_number)
+        self._phone_ranges = RangeIndex()
+        self._indexed = True
+        self._before = None
+        self._dirty = None
+
+    def __getitem__(self, record_id):
+        return self.data[record_id]
+
+    def get_for_update(self, record_id):
+        """
+        Returns a record that is about to be changed in place.
+
+        Inside a transaction the record is copied first, so the change can be
+        undone. Reads don't need this and use book[record_id].
+
+        Args:
+            record_id (int): The id of the record.
+
+        Returns:
+            Record: The record.
+
+        Raises:
+            KeyError: If there is no record with the id.
+        """
+        self._capture(record_id)
+        return self.data[record_id]
+
     def add_record(self, record):
         """
         Adds a record to the address book.
 
+        Handlers also call this after editing a record, so only that record is
+        re-indexed and appended to the journal.
+
         Args:
             record (Record): Record object to add to the address book.
         """
+        self._capture(record.id)
+        self._seen(record.id)
         self.data[record.id] = record
-        self.save_contacts_to_file()
+        self._index_record(record)
+        if self._dirty is None:
+            self.storage.put(record.record_to_dict())
+        else:
+            self._dirty.add(record.id)
 
-    def search(self, query):
+    def add_records(self, records):
+        """
+        Adds many records to the address book with a single journal write.
+
+        Args:
+            records (list): Record objects to add to the address book.
+        """
+        for record in records:
+            self._capture(record.id)
+            self._seen(record.id)
+            self.data[record.id] = record
+            self._index_record(record)
+        if self._dirty is None:
+            self.storage.put_many([record.record_to_dict() for record in records])
+        else:
+            self._dirty.update(record.id for record in records)
+
+    def search(self, query, limit=None, offset=0):
         """
         Searches for records containing a given query in the name.
 
+        The search ignores case. A query ending with '*' matches names that
+        start with the rest of it, and the results come in alphabetical
+        order. Other queries match anywhere in the name, and the results come
+        in id order. An empty query matches every record.
+
         Args:
             query (str): Query string to search for in the names.
+            limit (int, optional): Maximum number of records to return. Defaults to all.
+            offset (int, optional): Number of matching records to skip. Defaults to 0.
 
         Returns:
-            list: List of records matching the query.
+            iterator: Lazy iterator over the matching records.
         """
-        result = []
-        query = query.lower()
-        for record in self.data.values():
-            if query in record.name.value.lower():
-                result.append(str(record))
-        return result if result else None
+        self._build_indexes()
+        query = query.casefold()
+        if query.endswith("*"):
+            record_ids = self._name_prefixes.iter_prefix(query[:-1])
+        elif query:
+            record_ids = self._name_grams.iter_substring(query)
+        else:
+            record_ids = iter(list(self.data))
+        stop = offset + limit if limit is not None else None
+        return (
+            self[record_id]
+            for record_id in islice(metrics.counted(record_ids), offset, stop)
+        )
 
-    def find(self, name):
+    def fuzzy_search(self, query, max_distance=None, limit=None):
         """
-       Finds a record by name.
+        Searches for records whose name is a few typos away from a query.
 
-       Args:
-           name (str): Name of the contact to find.
+        Every word of the query has to be close to a word of the name, in any
+        order and ignoring case. The records come with the fewest edits first,
+        then in id order.
 
-       Returns:
-           Record: Record object if found, None otherwise.
-       """
-        for record in self.data.values():
-            if record.name.value == name:
-                return record
+        Args:
+            query (str): The name, possibly misspelled.
+            max_distance (int, optional): Edits allowed per word. Defaults to
+                one for short words and two for words of six or more characters.
+            limit (int, optional): Maximum number of records to return. Defaults to all.
+
+        Returns:
+            list: Tuples (distance, record) of the matching records.
+        """
+        self._build_name_words()
+        matches = self._name_words.search(query.casefold(), max_distance)
+        return [(distance, self[record_id]) for distance, record_id in matches[:limit]]
+
+    def find(self, name, for_update=False):
+        """
+        Finds a record by name.
+
+        Args:
+            name (str): Name of the contact to find.
+            for_update (bool, optional): Whether the record is about to be
+                changed in place, see get_for_update. Defaults to False.
+
+        Returns:
+            Record: Record object if found, None otherwise.
+
+        Raises:
+            ValueError: If several contacts have this name.
+        """
+        ids = self._name_ids(name)
+        if len(ids) > 1:
+            raise ValueError(self._ambiguous_name(name, ids))
+        if not ids:
+            return None
+        record_id = ids.pop()
+        return self.get_for_update(record_id) if for_update else self[record_id]
+
+    def find_all(self, name, ignore_case=False):
+        """
+        Finds all records with a name.
+
+        Args:
+            name (str): Name of the contacts to find.
+            ignore_case (bool, optional): Compare names case-insensitively. Defaults to False.
+
+        Returns:
+            list: Records with the name, ordered by id.
+        """
+        ids = self._name_ids(name, ignore_case)
+        return [self[record_id] for record_id in sorted(ids)]
+
+    def find_by_phone(self, digits, limit=None, offset=0):
+        """
+        Finds records by phone number, or by its first digits.
+
+        A full number is looked up in the phone map and its records come in
+        id order. Fewer digits select the range of numbers that start with
+        them from the sorted phone index, and the records come in phone order.
+
+        Args:
+            digits (str): The phone number or its first digits.
+            limit (int, optional): Maximum number of records to return. Defaults to all.
+            offset (int, optional): Number of matching records to skip. Defaults to 0.
+
+        Returns:
+            iterator: Lazy iterator over the matching records.
+
+        Raises:
+            ValueError: If digits is not 1 to 10 digits.
+        """
+        if not PHONE_PREFIX_PATTERN.fullmatch(digits):
+            raise ValueError(PHONE_PREFIX_ERROR)
+        if len(digits) == PHONE_DIGITS:
+            record_ids = iter(sorted(self._phone_ids(digits)))
+        else:
+            record_ids = self._phone_prefix_ids(digits)
+        stop = offset + limit if limit is not None else None
+        return (
+            self[record_id]
+            for record_id in islice(metrics.counted(record_ids), offset, stop)
+        )
+
+    def candidate_ids(self, field, operator, value):
+        """
+        Returns the ids an index gives for a condition of the query command.
+
+        Names are found by the exact, prefix and substring indexes, phones by
+        the phone map and prefix index, and birthdays, days and months by the
+        birthday index. The ids may include records that fail the condition,
+        e.g. a birthday of another year, but never miss one that passes it.
+
+        Args:
+            field (str): The field of the condition, e.g. "name" or "month".
+            operator (str): The operator, e.g. "=" or "starts".
+            value: The parsed value: a casefolded text, a number or a date.
+
+        Returns:
+            iterator: Lazy iterator over candidate ids, or None if no index
+                answers the condition.
+        """
+        if field == "id" and operator == "=":
+            return iter([value] if value in self.data else [])
+        if field == "name" and operator == "=":
+            return iter(sorted(self._name_ids(value, ignore_case=True)))
+        if (
+            field == "phone"
+            and operator in ("=", "starts")
+            and PHONE_PREFIX_PATTERN.fullmatch(value)
+        ):
+            if operator == "=":
+                return (
+                    iter(sorted(self._phone_ids(value)))
+                    if len(value) == PHONE_DIGITS
+                    else iter([])
+                )
+            return self._phone_prefix_ids(value)
+        if field == "name" and operator in ("starts", "contains"):
+            self._build_indexes()
+            if operator == "starts":
+                return self._name_prefixes.iter_prefix(value)
+            return self._name_grams.iter_substring(value)
+        windows = self._birthday_windows(field, operator, value)
+        if windows is None:
+            return None
+        self._build_indexes()
+        return (
+            record_id
+            for low, high in windows
+            for _, record_id in self._birthdays.between(low, high)
+        )
+
+    @staticmethod
+    def _birthday_windows(field, operator, value):
+        """
+        Returns the (month, day) ranges of the birthdays a condition can match, or None.
+
+        A month gives one range, a day one range in every month. A range runs
+        from its first day up to the day after its last one, as
+        RangeIndex.between takes it.
+        """
+        if field == "birthday" and operator == "=":
+            return [((value.month, value.day), (value.month, value.day + 1))]
+        if field not in ("month", "day"):
+            return None
+        top = 12 if field == "month" else 31
+        if not 1 <= value <= top:
+            return None
+        first, last = {
+            "=": (value, value),
+            "<": (1, value - 1),
+            "<=": (1, value),
+            ">": (value + 1, top),
+            ">=": (value, top),
+        }.get(operator, (None, None))
+        if first is None or first > last:
+            return None
+        if field == "month":
+            return [((first, 1), (last + 1, 1))]
+        return [((month, first), (month, last + 1)) for month in range(1, 13)]
 
     def delete_record(self, name):
         """
         Deletes a record by name.
 
+        An exact match of the name wins over a case-insensitive one. Nothing is
+        deleted if the name matches several contacts.
+
         Args:
             name (str): Name of the contact to delete.
 
         Returns:
             str: Confirmation message indicating success or failure of deletion.
         """
-        to_delete_id = None
-        for record_id, record in self.data.items():
-            if record.name.value.lower() == name.lower():
-                to_delete_id = record_id
-                break
-        if to_delete_id:
-            del self.data[to_delete_id]
-            self.save_contacts_to_file()
+        ids = self._name_ids(name) or self._name_ids(name, ignore_case=True)
+        if len(ids) > 1:
+            return failed(self._ambiguous_name(name, ids))
+        if ids:
+            self.remove_record(ids.pop())
             return (
                 f"{green}Contact with the name {name} was successfully deleted.{reset}"
             )
         else:
-            return f"{red}Contact with the name {name} was not found.{reset}\n"
+            return failed(f"{red}Contact with the name {name} was not found.{reset}\n")
+
+    def remove_record(self, record_id):
+        """
+        Deletes a record by id.
+
+        Args:
+            record_id (int): The id of the record.
+
+        Raises:
+            KeyError: If there is no record with the id.
+        """
+        self._capture(record_id)
+        del self.data[record_id]
+        self._unindex_record(record_id)
+        if self._dirty is None:
+            self.storage.delete(record_id)
+        else:
+            self._dirty.add(record_id)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups changes into one atomic write that is undone on error.
+
+        Changed and deleted records are only marked dirty inside the block and
+        written to the storage in one batch when it ends. If the block raises,
+        every record it touched is restored from the copy taken when it was
+        first read. A nested transaction joins the outer one.
+
+        Yields:
+            AddressBook: The address book itself.
+        """
+        if self._dirty is not None:
+            yield self
+            return
+        self._before = {}
+        self._dirty = set()
+        try:
+            yield self
+            self._write_dirty()
+        except BaseException:
+            self._rollback()
+            raise
+        finally:
+            self._before = None
+            self._dirty = None
+
+    def checkpoint(self):
+        """
+        Writes the changes of the running transaction so far and keeps it open.
+
+        Streaming operations call it after every chunk, so a transaction
+        doesn't hold copies of all their records. An error after a checkpoint
+        only undoes the changes made since. If the write fails the changes stay
+        marked dirty and are written by the next checkpoint or when the
+        transaction ends. Outside a transaction it does nothing.
+        """
+        if self._dirty is None:
+            return
+        self._write_dirty()
+        self._before = {}
+        self._dirty = set()
+
+    def _write_dirty(self):
+        """
+        Writes the records marked dirty by the running transaction in one batch.
+        """
+        changes = [
+            (record_id, self.data[record_id].record_to_dict())
+            if record_id in self.data
+            else (record_id, None)
+            for record_id in sorted(self._dirty)
+        ]
+        if changes:
+            self.storage.apply(changes)
+
+    def _seen(self, record_id):
+        """
+        Moves the id counter of new records past an id the book holds.
+        """
+        if record_id > Record._last_id:
+            Record._last_id = record_id
+
+    def _capture(self, record_id):
+        """
+        Keeps a copy of a record the first time a transaction touches it.
+        """
+        if self._before is not None and record_id not in self._before:
+            record = self.data.get(record_id)
+            self._before[record_id] = record.record_to_dict() if record else None
+
+    def _rollback(self):
+        """
+        Restores every record touched by the running transaction.
+        """
+        for record_id, data in self._before.items():
+            if data is None:
+                if record_id in self.data:
+                    del self.data[record_id]
+                    self._unindex_record(record_id)
+            else:
+                record = Record.record_from_dict(data)
+                self.data[record_id] = record
+                self._index_record(record)
+
+    def _name_ids(self, name, ignore_case=False):
+        """
+        Returns the ids of the records with a name.
+
+        Until the indexes are built, records that are unchanged since the
+        snapshot was opened are looked up in its sorted name tables.
+        """
+        if ignore_case:
+            ids = self._folded_names.get(name.casefold())
+        else:
+            ids = self._names.get(name)
+        if not self._indexed:
+            spec = "name:casefold" if ignore_case else "name"
+            ids |= self.data.unchanged(self.data.reader.find(spec, name))
+        metrics.scanned(len(ids))
+        return ids
+
+    def _phone_ids(self, phone):
+        """
+        Returns the ids of the records with a phone number.
+        """
+        in_snapshot = self._phones_in_snapshot()
+        ids = self._phones.get(int(phone))
+        if in_snapshot:
+            ids |= self.data.unchanged(self.data.reader.find("phone", phone))
+        metrics.scanned(len(ids))
+        return ids
+
+    def _phone_prefix_ids(self, digits):
+        """
+        Lazily yields the ids of the records whose phone starts with the digits, in phone order.
+        """
+        in_snapshot = self._phones_in_snapshot()
+        scale = 10 ** (PHONE_DIGITS - len(digits))
+        low = int(digits) * scale
+        entries = self._phone_ranges.between(low, low + scale)
+        if in_snapshot:
+            snapshot_entries = (
+                (int(phone), record_id)
+                for phone, record_id in self.data.reader.iter_prefix("phone", digits)
+                if self.data.unchanged((record_id,))
+            )
+            entries = merge(entries, snapshot_entries)
+        return (record_id for _, record_id in entries)
+
+    def _phones_in_snapshot(self):
+        """
+        Tells whether phone lookups also have to search the snapshot.
+
+        Until the indexes are built, the records that are unchanged since the
+        snapshot was opened are found in its sorted phone table. A snapshot
+        written without one has the indexes built instead.
+        """
+        if self._indexed:
+            return False
+        if "phone" in self.data.reader.sorted_fields:
+            return True
+        self._build_indexes()
+        return False
+
+    def build_indexes(self):
+        """
+        Builds all indexes and applies deferred updates.
+
+        Queries then only read the indexes, so they can run from several
+        threads at once as long as nothing is changed meanwhile.
+        """
+        self._build_indexes()
+        self._build_name_words()
+        self._birthdays.merge()
+        self._phone_ranges.merge()
+
+    def _build_indexes(self):
+        """
+        Indexes the records still served from the snapshot, on first need.
+        """
+        if self._indexed:
+            return
+        for record in self.data.snapshot_values():
+            self._index_record(record)
+        self._indexed = True
+
+    def _build_name_words(self):
+        """
+        Builds the fuzzy index of name words on first need.
+
+        It is the most expensive index to build, so loading the book skips it
+        until a fuzzy search; from then on it is kept up to date.
+        """
+        if self._name_words is not None:
+            return
+        self._build_indexes()
+        name_words = FuzzyIndex(lambda record: record.name.value.casefold())
+        for record in self.data.values():
+            name_words.add(record)
+        self._name_words = name_words
+
+    def _index_record(self, record):
+        """
+        Adds a record to all indexes, replacing its previous entries.
+        """
+        self._names.add(record)
+        self._folded_names.add(record)
+        self._name_prefixes.add(record)
+        self._name_grams.add(record)
+        if self._name_words is not None:
+            self._name_words.add(record)
+        self._birthdays.add(record.id, record.birthday_key)
+        self._phones.add(record)
+        self._phone_ranges.add(record.id, record.phone_number)
+
+    def _unindex_record(self, record_id):
+        """
+        Removes a record from all indexes.
+        """
+        self._names.remove(record_id)
+        self._folded_names.remove(record_id)
+        self._name_prefixes.remove(record_id)
+        self._name_grams.remove(record_id)
+        if self._name_words is not None:
+            self._name_words.remove(record_id)
+        self._birthdays.remove(record_id)
+        self._phones.remove(record_id)
+        self._phone_ranges.remove(record_id)
+
+    @staticmethod
+    def _ambiguous_name(name, ids):
+        """
+        Returns the message for a name shared by several contacts.
+        """
+        id_list = ", ".join(str(record_id) for record_id in sorted(ids))
+        return f"{red}There are {len(ids)} contacts with the name {yellow}{name}{red} (ids {id_list}).{reset}\n"
 
     def save_contacts_to_file(self):
         """
-        Saves contacts to a file in JSON format.
+        Saves all contacts to the storage, replacing what it held.
         """
-        with open(ADDRESS_BOOK_FILE_PATH, "w") as file:
-            address_book_dict = [rec[1].record_to_dict() for rec in self.data.items()]
-            json.dump(address_book_dict, file, indent=4)
+        address_book_dict = [rec[1].record_to_dict() for rec in self.data.items()]
+        self.storage.save(address_book_dict)
 
     def load_contacts_from_file(self):
         """
-        Loads contacts from a JSON file.
+        Loads contacts from the storage.
+
+        The book is built in a single pass without writing anything back to
+        the file, and records keep their stored ids. A lazy storage only maps
+        its snapshot and replays the journal on top: records are built when
+        they are accessed and the indexes when a query first needs them.
+
+        Returns:
+            tuple: Number of loaded records and the load time in seconds.
         """
-        with open(ADDRESS_BOOK_FILE_PATH, "r") as file:
-            upload_data = json.load(file)
-            for data in upload_data:
-                record = Record.record_from_dict(data)
-                self.add_record(record)
+        start = perf_counter()
+        if self.storage.lazy:
+            reader, changes = self.storage.open_snapshot()
+            self.data = LazyRecords(reader, Record.record_from_dict)
+            self._indexed = False
+            self._seen(self.storage.last_id())
+            for record_id, data in changes.items():
+                if data is not None:
+                    record = Record.record_from_dict(data)
+                    self.data[record.id] = record
+                    self._index_record(record)
+                elif record_id in self.data:
+                    del self.data[record_id]
+                    self._unindex_record(record_id)
+            return len(self.data), perf_counter() - start
+        upload_data = self.storage.load()
+        records = {}
+        for data in upload_data:
+            record = Record.record_from_dict(data)
+            records[record.id] = record
+        self._seen(max(records, default=0))
+        self._seen(self.storage.last_id())
+        self.data.update(records)
+        for record in records.values():
+            self._index_record(record)
+        return len(records), perf_counter() - start
+
+    def close(self):
+        """
+        Flushes pending changes to disk.
+        """
+        self.storage.close()
 
     # Birthday methods
     def next_birthdays(self, days=7):
         """
         Finds upcoming birthdays within a specified number of days.
 
+        The window is read from the birthday index one calendar year at a time,
+        so it may cross New Year. Birthdays on 29 February are celebrated on
+        28 February in common years.
+
         Args:
             days (int): Number of days to look ahead for upcoming birthdays. Default is 7.
 
         Returns:
             str: String representation of upcoming birthdays within the specified days.
         """
+        self._build_indexes()
         WEEKDAYS = list(calendar.day_name)
         CURRENT_DATE = datetime.today().date()
+        last_date = CURRENT_DATE + timedelta(days=days)
         upcoming_birthdays = defaultdict(list)
-        for name, record in self.data.items():
-            if record.birthday:
-                bday = datetime.strptime(record.birthday.value, "%d.%m.%Y").date()
-                next_birthday = datetime(CURRENT_DATE.year, bday.month, bday.day).date()
-                if CURRENT_DATE <= next_birthday <= CURRENT_DATE + timedelta(days=days):
-                    upcoming_birthdays[next_birthday].append(record.name)
+        for year in range(CURRENT_DATE.year, last_date.year + 1):
+            start = (CURRENT_DATE.month, CURRENT_DATE.day)
+            if year > CURRENT_DATE.year:
+                start = (1, 1)
+            end = (
+                (last_date.month, last_date.day) if year == last_date.year else (12, 31)
+            )
+            leap = calendar.isleap(year)
+            if end == (2, 28) and not leap:
+                end = (2, 29)
+            for (month, day), record_id in metrics.counted(
+                self._birthdays.between(start, (end[0], end[1] + 1))
+            ):
+                if (month, day) == (2, 29) and not leap:
+                    day = 28
+                next_birthday = date(year, month, day)
+                upcoming_birthdays[next_birthday].append(self.data[record_id].name)
         if not upcoming_birthdays:
             print(f"{blue}No upcoming birthdays in the next {days} days.{reset}")
         else:
@@ -0,0 +1,357 @@
+from contextlib import redirect_stdout
+import io
+import json
+
+from src.error_handler import failed
+from src.handlers import *
+from src.handler_notebook import *
+from src.metrics import metrics, profile_call
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+# Commands that only read the address book and the notebook.
+READ_COMMANDS = frozenset(
+    {
+        "help",
+        "show-phone",
+        "show-birthday",
+        "next_birthdays",
+        "show-address",
+        "show-email",
+        "search",
+        "fuzzy-search",
+        "find-phone",
+        "query",
+        "show-contacts",
+        "export-contacts",
+        "nfind",
+        "note",
+        "stats",
+    }
+)
+
+
+def parse_input(user_input):
+    """
+    Parses user input and extracts the command and arguments.
+
+    Args:
+        user_input (str): The input string provided by the user.
+
+    Returns:
+        tuple: A tuple containing the command (lowercased) and a list of arguments.
+    """
+    if not user_input.strip():
+        return "", []
+    cmd, *args = user_input.split()
+    return cmd.strip().lower(), *args
+
+
+def run_command(command, args, contacts, read_line=input):
+    """
+    Runs one command on the address book and the notebook.
+
+    Its duration, the records it scanned and handler errors are recorded in
+    the metrics under the command name.
+
+    Args:
+        command (str): The command, lowercased.
+        args (list): The arguments of the command.
+        contacts (AddressBook): The address book.
+        read_line (callable, optional): Reads the answer to a prompt. Defaults to input.
+
+    Returns:
+        tuple: Whether the application keeps running, False after close, and
+            whether the command succeeded.
+    """
+    with metrics.command(
+        command if command in command_descriptions else "<invalid>"
+    ) as status:
+        running = dispatch(command, args, contacts, read_line)
+    return running, not status.failed
+
+
+def dispatch(command, args, contacts, read_line=input):
+    """
+    Runs one command without recording it; see run_command.
+    """
+    if command in "close":
+        return False
+
+    elif command == "help":
+        help_command()
+
+    elif command in [
+        "add-contact",
+        "change-phone",
+        "show-phone",
+        "add-birthday",
+        "show-birthday",
+        "next_birthdays",
+        "add-address",
+        "change-address",
+        "show-address",
+        "delete-address",
+        "add-email",
+        "change-email",
+        "show-email",
+        "delete-email",
+        "search",
+        "fuzzy-search",
+        "find-phone",
+        "query",
+        "dedupe",
+        "import-contacts",
+        "export-contacts",
+    ]:
+        response = globals()[command.replace("-", "_")](args, contacts)
+        print(response)
+
+    elif command == "show-contacts":
+        print(all_contacts(contacts))
+
+    elif command == "delete":
+        print(
+            contacts.delete_record(" ".join(args))
+            if args
+            else failed(f"{red}The command is bad. Give me a name{reset}\n")
+        )
+
+    elif command == "nadd":
+        note_text = " ".join(args)
+        if note_text:
+            tags = [
+                tag.strip()
+                for tag in read_line(
+                    f"{blue}Enter tags separated by commas (optional): {reset}"
+                ).split(",")
+                if tag.strip()
+            ]
+            add_note(note_text, tags)
+            print(f"{green}Note was successfully created.{reset}")
+        else:
+            print(
+                failed(
+                    f"{red}No text entered. Note was not created. Give me a text for note.{reset}\n"
+                )
+            )
+
+    elif command == "nfind":
+        match_all = "--all" in args
+        search_args = [arg for arg in args if arg not in ("--all", "--any")]
+        try:
+            limit = pop_option(search_args, "--top", NFIND_LIMIT)
+            since, until = pop_date_range(search_args)
+        except ValueError as error:
+            print(failed(str(error)))
+            return True
+        tags = [arg for arg in search_args if arg.startswith("#")]
+        search_text = " ".join(arg for arg in search_args if not arg.startswith("#"))
+        find_notes(
+            tags=tags,
+            search_text=search_text,
+            match_all=match_all,
+            limit=limit,
+            since=since,
+            until=until,
+        )
+
+    elif command == "nedit":
+        if not args:
+            print(failed(f"{red}Enter note ID(a positive integer).{reset}\n"))
+            return True
+
+        try:
+            note_id = int(args[0])
+
+            note = notebook.find_note_by_id(note_id)
+            if note is None:
+                print(failed(f"{red}There is no notates with id {note_id}.{reset}\n"))
+                return True
+
+        except:
+            print(
+                failed(f"{red}Invalid input. Give me id(a positive integer).{reset}\n")
+            )
+            return True
+
+        new_text = read_line(f"{blue}Enter new text for the note: {reset}")
+        tags = [
+            tag.strip()
+            for tag in read_line(
+                f"{blue}Enter tags separated by commas (optional): {reset}"
+            ).split(",")
+            if tag.strip()
+        ]
+        modify_note(note_id, new_text, tags)
+
+    elif command == "ndel":
+        if not args:
+            print(
+                failed(
+                    f"{red}No note ID provided. Please enter a note ID(a positive integer).{reset}\n"
+                )
+            )
+        else:
+            delete_note(*args)
+
+    elif command == "note":
+        if not args:
+            print(
+                failed(
+                    f"{red}No note ID provided. Please enter a note ID(a positive integer).{reset}\n"
+                )
+            )
+        else:
+            find_note_by_id(*args)
+
+    elif command == "stats":
+        if args and args[0] == "reset":
+            metrics.reset()
+            print(f"{green}Statistics were reset.{reset}")
+        elif args and args[0] == "json":
+            print(json.dumps(metrics.snapshot(), indent=4))
+        else:
+            print(metrics.report())
+
+    elif command == "profile":
+        memory = bool(args) and args[0] == "--memory"
+        if memory:
+            args = args[1:]
+        if not args:
+            print(failed(f"{red}Give me a command to profile.{reset}\n"))
+            return True
+        profiled, *profiled_args = args
+        (running, _), report = profile_call(
+            lambda: run_command(profiled.lower(), profiled_args, contacts, read_line),
+            memory,
+        )
+        print(report)
+        return running
+
+    elif not command:
+        print(failed(f"{red}No command.{reset}"))
+
+    else:
+        print(failed(f"{red}Invalid command.{reset}"))
+
+    return True
+
+
+def parse_batch_line(line, lines):
+    """
+    Parses one line of a batch script.
+
+    Args:
+        line (str): The stripped line, plain or a JSON object.
+        lines (iterator): The numbered lines that follow, used to answer
+            prompts of plain commands.
+
+    Returns:
+        tuple: The command, its arguments and the function that answers its prompts.
+
+    Raises:
+        ValueError: If a JSON line can't be parsed.
+        KeyError: If a JSON line has no command.
+        TypeError: If a JSON line is not an object with a string command.
+    """
+    if not line.startswith("{"):
+        command, *args = parse_input(line)
+        return command, args, lambda prompt: next(lines, (None, ""))[1].rstrip("\n")
+    entry = json.loads(line)
+    if not entry["command"].strip():
+        raise KeyError("command")
+    command, *args = parse_input(entry["command"])
+    answers = iter(entry.get("input", []))
+    return (
+        command,
+        args + [str(arg) for arg in entry.get("args", [])],
+        lambda prompt: str(next(answers, "")),
+    )
+
+
+def execute_line(line, contacts, lines=(), capture=redirect_stdout):
+    """
+    Parses and runs one line of a script with its output captured.
+
+    Args:
+        line (str): The stripped line, plain or a JSON object.
+        contacts (AddressBook): The address book.
+        lines (iterator, optional): The numbered lines that follow, used to
+            answer prompts of plain commands. Defaults to none.
+        capture (callable, optional): Returns a context that sends printed
+            output to the given buffer. Defaults to redirect_stdout.
+
+    Returns:
+        tuple: The command (None if the line can't be parsed), its output,
+            whether it succeeded and whether the application keeps running.
+    """
+    try:
+        command, args, read_line = parse_batch_line(line, iter(lines))
+    except (ValueError, KeyError, TypeError):
+        return None, f"{red}Line is not a valid command.{reset}\n", False, True
+    buffer = io.StringIO()
+    with capture(buffer):
+        running, succeeded = run_command(command, args, contacts, read_line)
+    return command, buffer.getvalue(), succeeded, running
+
+
+command_descriptions = {
+    "add-contact": "Add a new contact.",
+    "change-phone": "Change phone number for a contact.",
+    "show-phone": "Show phone number for a contact.",
+    "show-contacts": "Show all contacts.",
+    "add-birthday": "Add birthday for a contact.",
+    "show-birthday": "Show birthday for a contact.",
+    "next_birthdays": "Show upcoming birthdays.",
+    "add-address": "Add address for a contact.",
+    "change-address": "Change address for a contact.",
+    "show-address": "Show address for a contact.",
+    "delete": "Delete a contact.",
+    "delete-address": "Delete address for a contact.",
+    "search": "Search contacts by name. End with * for a prefix, page with --limit N --offset N.",
+    "fuzzy-search": "Search contacts by a misspelled name, closest first. Set --distance N edits per word, --limit N.",
+    "query": "Find contacts by conditions on their fields, e.g. domain = example.com and month = march."
+    " Add --explain to show the plan, page with --limit N --offset N.",
+    "dedupe": "Find contacts that are probably the same person and show how to merge them."
+    " Set --threshold X (0-1), --window N; --apply merges them.",
+    "find-phone": "Find contacts by phone number or its first digits, page with --limit N --offset N.",
+    "add-email": "Add email for a contact.",
+    "change-email": "Change email for a contact.",
+    "show-email": "Show email for a contact.",
+    "delete-email": "Delete email for a contact.",
+    "import-contacts": "Import contacts from a .csv or .jsonl file.",
+    "export-contacts": "Export contacts to a .csv or .jsonl file.",
+    "nadd": "Add a new note.",
+    "nfind": "Find notes by tag, text or date. Add --all to require every tag, --top N to show N notes,"
+    " --since/--until DATE or --last N[h] for notes of a date range, shown oldest first.",
+    "nedit": "Edit an existing note.",
+    "ndel": "Delete a note.",
+    "note": "Find a note by ID.",
+    "stats": "Show command latencies and storage I/O. Add reset to start over, json for JSON.",
+    "profile": "Run a command under cProfile, or tracemalloc with --memory, and show the report.",
+    "help": "Show available commands and their descriptions.",
+    "close": "Close the program.",
+}
+
+
+def help_command():
+    """
+    Displays a list of available commands and their descriptions.
+
+    Usage:
+        Call this function to print the available commands and their descriptions.
+
+    Example:
+        help_command()
+
+    """
+    print("Available commands:")
+    for command, description in command_descriptions.items():
+        print(f"{green}{(command + ':'):<15}{reset} {description}")
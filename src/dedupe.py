@@ -0,0 +1,286 @@
+from collections import defaultdict
+from itertools import chain, combinations
+
+from src.indexes import distance_from
+from src.metrics import metrics
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+DEDUPE_THRESHOLD = 0.8
+DEDUPE_WINDOW = 5
+# Blocks with more records than this are only compared within the window.
+DEDUPE_MAX_BLOCK = 50
+MERGED_FIELDS = ("phone", "email", "birthday", "address")
+
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(word):
+    """
+    Returns the American Soundex code of a word, e.g. "R163" for Robert and Rupert.
+
+    Args:
+        word (str): The word.
+
+    Returns:
+        str: A letter and three digits, or "" if the word has no Latin letters.
+    """
+    letters = [char for char in word.casefold() if "a" <= char <= "z"]
+    if not letters:
+        return ""
+    code = [letters[0].upper()]
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code.append(digit)
+            if len(code) == 4:
+                break
+        if char not in "hw":
+            previous = digit
+    return "".join(code).ljust(4, "0")
+
+
+def normalize_name(name):
+    """
+    Returns the words of a name casefolded and sorted, so "Smith John" equals "john smith".
+    """
+    return " ".join(sorted(name.casefold().split()))
+
+
+def normalize_email(email):
+    """
+    Returns an email casefolded and without a +tag, so "Ann+work@Mail.com" equals "ann@mail.com".
+    """
+    local, _, domain = email.casefold().partition("@")
+    return f"{local.partition('+')[0]}@{domain}"
+
+
+def blocking_keys(record):
+    """
+    Returns the keys under which a record is grouped with its possible duplicates.
+
+    Args:
+        record (Record): The record.
+
+    Returns:
+        list: Keys for the phone, the normalized email and the Soundex codes of the name.
+    """
+    keys = []
+    if record.phone:
+        keys.append(("phone", record.phone.value))
+    if record.email:
+        keys.append(("email", normalize_email(record.email.value)))
+    codes = sorted(filter(None, map(soundex, record.name.value.split())))
+    if codes:
+        keys.append(("name", " ".join(codes)))
+    return keys
+
+
+def score_pair(first, second):
+    """
+    Scores how likely two records are the same person, from 0 to 1.
+
+    The similarity of the names gives up to 0.6; they are compared with
+    their words sorted and, for a missed space, with the spaces removed. The same phone
+    and the same email add 0.4 each, and the same birthday 0.2. Different
+    birthdays take 0.5 off. So a shared phone with a slightly misspelled
+    name scores about 0.9, while the same name alone scores 0.6.
+
+    Args:
+        first (Record): One record.
+        second (Record): The other record.
+
+    Returns:
+        float: The score.
+    """
+    return _score(_features(first), _features(second))
+
+
+def _features(record):
+    """
+    Returns what a score compares: the normalized and the spaceless name,
+    the phone, the normalized email and the birthday of a record.
+    """
+    name = record.name.value
+    return (
+        normalize_name(name),
+        "".join(name.casefold().split()),
+        record.phone.value if record.phone else None,
+        normalize_email(record.email.value) if record.email else None,
+        record.birthday.date if record.birthday else None,
+    )
+
+
+def _score(first, second, threshold=0.0):
+    """
+    Scores two records from their features, or returns 0 as soon as the
+    score can't reach the threshold.
+    """
+    first_name, first_letters, first_phone, first_email, first_birthday = first
+    second_name, second_letters, second_phone, second_email, second_birthday = second
+    score = 0.0
+    if first_phone and first_phone == second_phone:
+        score += 0.4
+    if first_email and first_email == second_email:
+        score += 0.4
+    if first_birthday and second_birthday:
+        score += 0.2 if first_birthday == second_birthday else -0.5
+    longest = max(len(first_name), len(second_name)) or 1
+    if (
+        score + 0.6 * (1 - abs(len(first_name) - len(second_name)) / longest)
+        < threshold
+    ):
+        return 0.0
+    distance = min(
+        distance_from(first_name)(second_name),
+        distance_from(first_letters)(second_letters),
+    )
+    score += 0.6 * (1 - distance / longest)
+    return min(score, 1.0)
+
+
+def candidate_pairs(records, window=DEDUPE_WINDOW):
+    """
+    Yields the pairs of records worth scoring, each at most once.
+
+    Records that share a blocking key are paired within their block; a block
+    larger than DEDUPE_MAX_BLOCK is sorted by name and only neighbours within
+    the window are paired. The whole book is also sorted by normalized name
+    and every record is paired with the next window - 1 ones, which finds
+    typos that change the Soundex code.
+
+    Args:
+        records (list): The records.
+        window (int, optional): Size of the sliding window. Defaults to DEDUPE_WINDOW.
+
+    Yields:
+        tuple: Two records, the one with the lower id first.
+    """
+    blocks = defaultdict(list)
+    for record in records:
+        for key in blocking_keys(record):
+            blocks[key].append(record)
+    by_name = sorted(
+        records, key=lambda record: (normalize_name(record.name.value), record.id)
+    )
+    seen = set()
+
+    def pairs_in(block):
+        if len(block) <= DEDUPE_MAX_BLOCK:
+            return combinations(block, 2)
+        block = sorted(block, key=lambda record: normalize_name(record.name.value))
+        return windowed(block)
+
+    def windowed(ordered):
+        for position, record in enumerate(ordered):
+            for other in ordered[position + 1 : position + window]:
+                yield record, other
+
+    block_pairs = chain.from_iterable(map(pairs_in, blocks.values()))
+    for first, second in chain(block_pairs, windowed(by_name)):
+        if first.id > second.id:
+            first, second = second, first
+        pair = (first.id, second.id)
+        if pair not in seen:
+            seen.add(pair)
+            yield first, second
+
+
+def find_duplicates(records, threshold=DEDUPE_THRESHOLD, window=DEDUPE_WINDOW):
+    """
+    Groups the records that are probably the same person.
+
+    Only the candidate pairs are scored, so the work grows with the size of
+    the blocks rather than with the square of the book. Pairs scoring at
+    least the threshold are joined into groups, so A-B and B-C give A-B-C.
+
+    Args:
+        records (iterable): The records of the book.
+        threshold (float, optional): Lowest score of a duplicate pair. Defaults to DEDUPE_THRESHOLD.
+        window (int, optional): Size of the sliding window. Defaults to DEDUPE_WINDOW.
+
+    Returns:
+        list: Groups of two or more records, each sorted by id, ordered by their first id.
+    """
+    records = list(records)
+    parents = {}
+
+    def root(record_id):
+        path = []
+        while record_id in parents:
+            path.append(record_id)
+            record_id = parents[record_id]
+        for member in path:
+            parents[member] = record_id
+        return record_id
+
+    features = {record.id: _features(record) for record in records}
+    by_id = {}
+    scored = 0
+    for first, second in candidate_pairs(records, window):
+        scored += 1
+        if _score(features[first.id], features[second.id], threshold) >= threshold:
+            by_id[first.id], by_id[second.id] = first, second
+            first_root, second_root = root(first.id), root(second.id)
+            if first_root != second_root:
+                parents[max(first_root, second_root)] = min(first_root, second_root)
+    metrics.scanned(scored)
+    groups = defaultdict(list)
+    for record_id in sorted(by_id):
+        groups[root(record_id)].append(by_id[record_id])
+    return [groups[group_id] for group_id in sorted(groups)]
+
+
+def merge_plan(group):
+    """
+    Plans how to merge a group of duplicates into its oldest record.
+
+    The record with the lowest id is kept. Each of its missing fields is taken
+    from the first other record that has it; fields the kept record already
+    has stay as they are.
+
+    Args:
+        group (list): Records of the group, sorted by id.
+
+    Returns:
+        tuple: The kept record, a dictionary of the fields it takes with the
+            (value, id of the record it comes from), and the ids to delete.
+    """
+    kept, *others = group
+    taken = {}
+    for field in MERGED_FIELDS:
+        if getattr(kept, field):
+            continue
+        for other in others:
+            value = getattr(other, field)
+            if value:
+                taken[field] = (value, other.id)
+                break
+    return kept, taken, [other.id for other in others]
+
+
+def describe_plan(kept, taken, removed):
+    """
+    Returns the merge of a group as text for the dedupe command.
+    """
+    lines = [
+        f"{green}Keep {yellow}{kept.name.value}{green} (id {kept.id}), "
+        f"merge ids {', '.join(map(str, removed))}{reset}"
+    ]
+    for field, (value, source) in taken.items():
+        lines.append(f"  {blue}{field}{reset}: {value.value} (from id {source})")
+    return "\n".join(lines)
@@ -1,3 +1,7 @@
+import sys
+
+from src.metrics import metrics
+
 red = "\033[91m"
 reset = "\033[0m"
 
@@ -8,7 +12,8 @@ def input_error(func):
 
     This decorator catches common exceptions that may occur during the execution
     of the decorated function, such as ValueError, TypeError, and IndexError,
-    and returns a formatted error message.
+    and returns a formatted error message. Every caught error is recorded in
+    the metrics of the running command.
 
     Args:
         func (callable): The function to be decorated.
@@ -16,18 +21,39 @@ def input_error(func):
     Returns:
         callable: The decorated function.
     """
+
     def inner(*args, **kwargs):
         try:
             return func(*args, **kwargs)
         except ValueError as error:
-
+            metrics.error(func.__name__, error)
             return f"{red}{str(error)}{reset}"
         except TypeError as t_e:
-
+            metrics.error(func.__name__, t_e)
             return f"{red}{str(t_e)}{reset}"
-        except IndexError:
+        except IndexError as error:
+            metrics.error(func.__name__, error)
             return f"{red}The command is bad. Enter a command again.{reset}\n"
         except:
+            metrics.error(func.__name__, sys.exc_info()[1])
             return f"{red}Something is wrong. Enter a command again.{reset}\n"
 
     return inner
+
+
+def failed(message):
+    """
+    Marks the running command as failed and returns the message that says why.
+
+    Handlers use it for failures they report without raising, like a contact
+    that was not found, so batch mode, the server and the statistics see the
+    command as failed whatever the colour of its output.
+
+    Args:
+        message (str): The message for the user.
+
+    Returns:
+        str: The same message.
+    """
+    metrics.fail()
+    return message
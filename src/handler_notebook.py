@@ -1,10 +1,19 @@
 from src.class_notebook import Notebook
-from src.error_handler import input_error
-from datetime import datetime
+from src.error_handler import failed, input_error
+from datetime import datetime, timedelta
 
-blue, reset, green, red, yellow = "\033[94m", "\033[0m", "\033[92m", "\033[91m", "\033[93m"
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
 
 
+NFIND_LIMIT = 10
+NFIND_DATE_FORMATS = ("%d.%m.%Y", "%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S")
+
 notebook = Notebook()
 
 
@@ -20,29 +29,103 @@ def add_note(text, tags=None):
     notebook.add_note(text, tags)
 
 
-@input_error
-def find_notes(tags=[], search_text=""):
+def parse_note_date(value, option):
     """
-    Finds notes based on tags and/or text content.
+    Parses a date given to nfind as 01.01.2024, 2024-01-01 or 2024-01-01T09:30.
 
     Args:
-        tags (list, optional): List of tags to search for. Defaults to [].
-        search_text (str, optional): Text to search for within notes. Defaults to "".
+        value (str): The date.
+        option (str): The option it was given with, for the error message.
+
+    Returns:
+        tuple: The datetime and whether a time of day was given.
+
+    Raises:
+        ValueError: If the date has none of the formats.
+    """
+    for date_format in NFIND_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format), "T" in date_format
+        except ValueError:
+            pass
+    raise ValueError(
+        f"{red}Give me a date like 01.01.2024 or 2024-01-01T09:30 after {option}.{reset}\n"
+    )
+
+
+def pop_date_range(args):
     """
-    found_notes = notebook.notes
+    Removes --since DATE, --until DATE and --last N from the arguments.
+
+    --until takes the whole day unless a time is given. --last N means the
+    last N days; a value like 24h counts hours instead.
 
-    if len(tags):
-        cleaned_tags = [tag.replace("#", "") for tag in tags]
-        found_notes = notebook.find_notes(cleaned_tags) if tags else notebook.notes
+    Args:
+        args (list): Command arguments. The options and their values are removed in place.
 
-    if search_text:
-        found_notes = [note for note in found_notes if search_text in note.text]
+    Returns:
+        tuple: The earliest creation date, inclusive, and the latest, exclusive;
+            either is None if not given.
+
+    Raises:
+        ValueError: If a value is missing or malformed, or --last is given with --since.
+    """
+    since = until = None
+    for option in ("--since", "--until", "--last"):
+        if option not in args:
+            continue
+        position = args.index(option)
+        if position + 1 >= len(args):
+            raise ValueError(f"{red}Give me a value after {option}.{reset}\n")
+        value = args[position + 1]
+        del args[position : position + 2]
+        if option == "--since":
+            since = parse_note_date(value, option)[0]
+        elif option == "--until":
+            until, with_time = parse_note_date(value, option)
+            until += timedelta(seconds=1) if with_time else timedelta(days=1)
+        else:
+            if since is not None:
+                raise ValueError(f"{red}Use either --since or --last.{reset}\n")
+            unit = "hours" if value.endswith("h") else "days"
+            amount = value.rstrip("hd")
+            if not amount.isdigit():
+                raise ValueError(
+                    f"{red}Give me a number of days, or hours like 24h, after --last.{reset}\n"
+                )
+            since = datetime.today() - timedelta(**{unit: int(amount)})
+    return since, until
+
+
+@input_error
+def find_notes(
+    tags=[], search_text="", match_all=False, limit=NFIND_LIMIT, since=None, until=None
+):
+    """
+    Finds notes based on tags, text content and/or creation date and prints the best matches.
+
+    Args:
+        tags (list, optional): List of tags to search for. Defaults to [].
+        search_text (str, optional): Full-text query. Words, prefixes like 'bon*'
+            and "quoted phrases" are supported. Defaults to "".
+        match_all (bool, optional): Require all tags instead of any of them. Defaults to False.
+        limit (int, optional): Maximum number of notes to print. Defaults to NFIND_LIMIT.
+        since (datetime, optional): Earliest creation date, inclusive. Defaults to None.
+        until (datetime, optional): Latest creation date, exclusive. Defaults to None.
+    """
+    cleaned_tags = [tag.replace("#", "") for tag in tags]
+    found_notes = notebook.find_notes(
+        cleaned_tags, search_text, match_all, limit, since, until
+    )
 
     if not len(found_notes):
         print(f"{red}No notes were found matching the search query.{reset}\n")
         return
 
-    print(f"\n{green}Your search yielded {len(found_notes)} notes:{reset}\n")
+    if len(found_notes) == limit:
+        print(f"\n{green}Top {limit} notes for your search:{reset}\n")
+    else:
+        print(f"\n{green}Your search yielded {len(found_notes)} notes:{reset}\n")
 
     for note in found_notes:
         print_note(note)
@@ -58,15 +141,18 @@ def modify_note(note_id, new_text="", new_tags=None):
         new_text (str, optional): The new content of the note. Defaults to "".
         new_tags (list, optional): List of new tags for the note. Defaults to None.
     """
-    if new_text:
-        notebook.modify_note(note_id, new_text)
+    with notebook.transaction():
+        if new_text:
+            notebook.modify_note(note_id, new_text)
 
-    if len(new_tags):
-        notebook.modify_tags(note_id, new_tags)
+        if len(new_tags):
+            notebook.modify_tags(note_id, new_tags)
 
     if not new_text and not len(new_tags):
         print(
-            f"{red}The note was not modified as no replacement data was provided. Give me a new text for note {reset}\n"
+            failed(
+                f"{red}The note was not modified as no replacement data was provided. Give me a new text for note {reset}\n"
+            )
         )
     else:
         print(f"{green}The note has been successfully updated.{reset}")
@@ -81,14 +167,22 @@ def delete_note(note_id):
         note_id (int): The ID of the note to delete.
     """
     if not note_id:
-        print(f"{red}No note ID provided. Please enter a note ID.{reset}\n")
+        print(failed(f"{red}No note ID provided. Please enter a note ID.{reset}\n"))
         return
 
     try:
         note_id = int(note_id)
-        notebook.delete_note(note_id)
     except ValueError:
-        print(f"{red}Invalid note ID: {note_id}. Note ID must be an integer.{reset}\n")
+        print(
+            failed(
+                f"{red}Invalid note ID: {note_id}. Note ID must be an integer.{reset}\n"
+            )
+        )
+        return
+    if notebook.find_note_by_id(note_id) is None:
+        print(failed(f"{red}No notes found with ID {note_id}.{reset}\n"))
+        return
+    notebook.delete_note(note_id)
 
 
 @input_error
@@ -103,13 +197,18 @@ def find_note_by_id(note_id):
         note_id = int(note_id)
         note = notebook.find_note_by_id(note_id)
         if not note:
-            print(f"{red}No notes were found with id {note_id}{reset}\n")
+            print(failed(f"{red}No notes were found with id {note_id}{reset}\n"))
+            return
 
         print_note(note)
     except ValueError:
-        print(f"{red}Invalid note ID: {note_id}. Note ID must be an integer.{reset}\n")
+        print(
+            failed(
+                f"{red}Invalid note ID: {note_id}. Note ID must be an integer.{reset}\n"
+            )
+        )
     except IndexError:
-        print(f"{red}No notes were found with ID {note_id}.{reset}\n")
+        print(failed(f"{red}No notes were found with ID {note_id}.{reset}\n"))
 
 
 def print_note(note):
@@ -1,9 +1,59 @@
-from src.error_handler import input_error
+from src.error_handler import failed, input_error
 from src.classes import Record, AddressBook
+from src import transfer
+from src.dedupe import (
+    DEDUPE_THRESHOLD,
+    DEDUPE_WINDOW,
+    describe_plan,
+    find_duplicates,
+    merge_plan,
+)
+from src.query import parse_query, run_query
+from itertools import chain, islice
 import re
 
 
-blue, reset, green, red, yellow = "\033[94m", "\033[0m", "\033[92m", "\033[91m", "\033[93m"
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+SEARCH_LIMIT = 50
+
+
+def pop_option(args, option, default, minimum=1):
+    """
+    Removes an option with an integer value from the arguments.
+
+    Args:
+        args (list): Command arguments. The option and its value are removed in place.
+        option (str): Option name, e.g. '--limit'.
+        default (int): Value to use if the option is missing.
+        minimum (int, optional): Smallest accepted value. Defaults to 1, so a
+            limit of 0 can't be mistaken for no limit; offsets pass 0.
+
+    Returns:
+        int: The value of the option.
+
+    Raises:
+        ValueError: If the option has no integer value of at least minimum.
+    """
+    if option not in args:
+        return default
+    position = args.index(option)
+    try:
+        value = int(args[position + 1])
+    except (IndexError, ValueError):
+        value = minimum - 1
+    if value < minimum:
+        raise ValueError(
+            f"{red}Give me an integer of at least {minimum} after {option}.{reset}\n"
+        )
+    del args[position : position + 2]
+    return value
 
 
 @input_error
@@ -62,14 +112,14 @@ def change_phone(args, address_book):
     # if not bool(re.fullmatch(PHONE_MASK, phone)):
     #     raise TypeError
 
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
 
     if record:
         record.edit_phone(phone)
         address_book.add_record(record)
         return f"{green}Contact changed.{reset}"
     else:
-        return f"{red}There isn't a contact with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}There isn't a contact with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -96,7 +146,7 @@ def show_phone(args, address_book):
         else:
             return f"{red}Phone not set for {yellow}{name}.{reset}\n"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -140,13 +190,13 @@ def add_birthday(args, address_book):
             f"{red}The command is bad. Give me name and birthday in format DD.MM.YYYY.{reset}\n "
         )
 
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
     if record:
         record.add_birthday(birthday)
         address_book.add_record(record)
         return f"{green}Birthday added for {yellow}{name}.{reset}"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -169,11 +219,13 @@ def show_birthday(args, address_book):
     record = address_book.find(name)
     if record:
         if record.birthday:
-            return f"{green}Birthday of {yellow}{name}: {green}{record.birthday}.{reset}"
+            return (
+                f"{green}Birthday of {yellow}{name}: {green}{record.birthday}.{reset}"
+            )
         else:
             return f"{red}Birthday not set for {yellow}{name}.{reset}\n"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -216,13 +268,13 @@ def add_address(args, address_book):
     except:
         raise ValueError(f"{red}The command is bad. Give me name and address.{reset}\n")
 
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
     if record:
         record.add_address(address)
         address_book.add_record(record)
         return f"{green}Address added for {yellow}{name}.{reset}"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -244,14 +296,14 @@ def change_address(args, address_book):
             f"{red}The command is bad. Give me name, old address and new address.{reset}\n"
         )
 
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
 
     if record:
         record.edit_address(old_address, new_address)
         address_book.add_record(record)
         return f"{green}Address changed.{reset}"
     else:
-        return f"{red}There isn't a contact with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}There isn't a contact with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -278,7 +330,7 @@ def show_address(args, address_book):
         else:
             return f"{red}Address not set for {yellow}{name}.{reset}\n"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -299,7 +351,7 @@ def delete_address(args, address_book):
     except:
 
         raise ValueError(f"{red}The command is bad. Give me name.{reset}\n")
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
     if record:
 
         record.remove_address()
@@ -307,7 +359,7 @@ def delete_address(args, address_book):
 
         return f"{green}Address was deleted{reset}"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -327,13 +379,13 @@ def add_email(args, address_book):
     except:
         raise ValueError(f"{red}The command is bad. Give me name and email.{reset}\n")
 
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
     if record:
         record.add_email(email)
         address_book.add_record(record)
         return f"{green}Email added for {yellow}{name}.{reset}"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -355,14 +407,14 @@ def change_email(args, address_book):
             f"{red}The command is bad. Give me name, old email and new email.{reset}\n"
         )
 
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
 
     if record:
         record.edit_email(old_email, new_email)
         address_book.add_record(record)
         return f"{green}Email changed.{reset}"
     else:
-        return f"{red}There isn't a contact with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}There isn't a contact with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -385,11 +437,13 @@ def show_email(args, address_book):
     record = address_book.find(name)
     if record:
         if record.email:
-            return f"{green}Email of {yellow}{yellow}{name}{green}: {record.email}.{reset}"
+            return (
+                f"{green}Email of {yellow}{yellow}{name}{green}: {record.email}.{reset}"
+            )
         else:
             return f"{red}Email not set for {yellow}{name}.{reset}\n"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -410,7 +464,7 @@ def delete_email(args, address_book):
     except:
 
         raise ValueError(f"{red}The command is bad. Give me name.{reset}\n")
-    record = address_book.find(name)
+    record = address_book.find(name, for_update=True)
     if record:
 
         record.remove_email()
@@ -418,7 +472,7 @@ def delete_email(args, address_book):
 
         return f"{green}Email was deleted.{reset}"
     else:
-        return f"{red}No contact found with name {yellow}{name}.{reset}\n"
+        return failed(f"{red}No contact found with name {yellow}{name}.{reset}\n")
 
 
 @input_error
@@ -427,18 +481,238 @@ def search(args, address_book):
     Searches for contacts matching a query.
 
     Args:
-        args (list): A list containing the search query.
+        args (list): A list containing the search query and optional
+            '--limit N' (default SEARCH_LIMIT) and '--offset N' options.
         address_book (AddressBook): The address book to search in.
 
     Returns:
         str: String representation of matching contacts or error message if not found.
     """
-    found_records = address_book.search(" ".join(args))
-    if found_records is None:
+    args = list(args)
+    limit = pop_option(args, "--limit", SEARCH_LIMIT)
+    offset = pop_option(args, "--offset", 0, minimum=0)
+    found_records = address_book.search(" ".join(args), limit, offset)
+    first_record = next(found_records, None)
+    if first_record is None:
         return f"{red}No contacts found matching your search.{reset}\n"
     else:
         header()
-        return "\n".join(found_records)
+        return "\n".join(str(record) for record in chain([first_record], found_records))
+
+
+@input_error
+def fuzzy_search(args, address_book):
+    """
+    Searches for contacts whose name is a few typos away from the query.
+
+    Args:
+        args (list): A list containing the name and optional '--distance N'
+            (edits allowed per word) and '--limit N' (default SEARCH_LIMIT) options.
+        address_book (AddressBook): The address book to search in.
+
+    Returns:
+        str: String representation of matching contacts, closest first, or error message if not found.
+    """
+    args = list(args)
+    max_distance = pop_option(args, "--distance", None, minimum=0)
+    limit = pop_option(args, "--limit", SEARCH_LIMIT)
+    query = " ".join(args)
+    if not query:
+        raise ValueError(f"{red}The command is bad. Give me a name.{reset}\n")
+    matches = address_book.fuzzy_search(query, max_distance, limit)
+    if not matches:
+        return f"{red}No contacts found with a name close to {yellow}{query}.{reset}\n"
+    header()
+    return "\n".join(str(record) for _, record in matches)
+
+
+@input_error
+def query(args, address_book):
+    """
+    Finds the contacts that satisfy all conditions of a query.
+
+    Args:
+        args (list): The words of the query, e.g. 'domain = example.com and
+            month = march', with optional '--limit N' (default SEARCH_LIMIT),
+            '--offset N' and '--explain' to print the plan first.
+        address_book (AddressBook): The address book to query.
+
+    Returns:
+        str: String representation of matching contacts or error message if not found.
+    """
+    args = list(args)
+    limit = pop_option(args, "--limit", SEARCH_LIMIT)
+    offset = pop_option(args, "--offset", 0, minimum=0)
+    explain = "--explain" in args
+    conditions = parse_query(" ".join(arg for arg in args if arg != "--explain"))
+    found_records, steps = run_query(address_book, conditions)
+    if explain:
+        print("\n".join(f"{blue}{step}{reset}" for step in steps))
+    found_records = islice(found_records, offset, offset + limit)
+    first_record = next(found_records, None)
+    if first_record is None:
+        return f"{red}No contacts match the query.{reset}\n"
+    else:
+        header()
+        return "\n".join(str(record) for record in chain([first_record], found_records))
+
+
+@input_error
+def dedupe(args, address_book):
+    """
+    Finds groups of contacts that are probably the same person and plans their merge.
+
+    Each group is merged into its oldest contact, which takes the fields it
+    lacks from the others; the others are deleted. Nothing changes without
+    '--apply', and then all groups are merged in one transaction.
+
+    Args:
+        args (list): Optional '--threshold X' (lowest score of a duplicate pair
+            from 0 to 1, default DEDUPE_THRESHOLD), '--window N' (default
+            DEDUPE_WINDOW), '--limit N' (groups to show, default SEARCH_LIMIT)
+            and '--apply'.
+        address_book (AddressBook): The address book to clean up.
+
+    Returns:
+        str: The merge plan, or a message that there are no duplicates.
+    """
+    args = list(args)
+    apply = "--apply" in args
+    if apply:
+        args.remove("--apply")
+    window = pop_option(args, "--window", DEDUPE_WINDOW)
+    limit = pop_option(args, "--limit", SEARCH_LIMIT)
+    threshold = DEDUPE_THRESHOLD
+    if "--threshold" in args:
+        position = args.index("--threshold")
+        try:
+            threshold = float(args[position + 1])
+        except (IndexError, ValueError):
+            threshold = -1
+        if not 0 < threshold <= 1:
+            raise ValueError(
+                f"{red}Give me a number from 0 to 1 after --threshold.{reset}\n"
+            )
+        del args[position : position + 2]
+    if args:
+        raise ValueError(f"{red}Unknown arguments: {' '.join(args)}.{reset}\n")
+
+    groups = find_duplicates(address_book.data.values(), threshold, max(window, 2))
+    if not groups:
+        return f"{green}No duplicate contacts found.{reset}"
+    plans = [merge_plan(group) for group in groups]
+    lines = [
+        f"{blue}Found {len(groups)} groups of duplicates, "
+        f"{sum(len(group) for group in groups)} contacts:{reset}"
+    ]
+    lines.extend(describe_plan(*plan) for plan in plans[:limit])
+    if len(plans) > limit:
+        lines.append(f"{blue}... and {len(plans) - limit} more groups.{reset}")
+    if not apply:
+        lines.append(f"{yellow}Run dedupe --apply to merge them.{reset}")
+        return "\n".join(lines)
+
+    with address_book.transaction():
+        for kept, taken, removed in plans:
+            record = address_book.get_for_update(kept.id)
+            for field, (value, _) in taken.items():
+                setattr(record, field, value)
+            for record_id in removed:
+                address_book.remove_record(record_id)
+            address_book.add_record(record)
+    lines.append(
+        f"{green}Merged {sum(len(removed) for _, _, removed in plans)} contacts "
+        f"into {len(plans)}.{reset}"
+    )
+    return "\n".join(lines)
+
+
+@input_error
+def find_phone(args, address_book):
+    """
+    Finds the contacts with a phone number, or whose number starts with some digits.
+
+    Args:
+        args (list): A list containing the number or its first digits, which may be
+            split by spaces, dashes or brackets, and optional '--limit N'
+            (default SEARCH_LIMIT) and '--offset N' options.
+        address_book (AddressBook): The address book to search in.
+
+    Returns:
+        str: String representation of matching contacts or error message if not found.
+    """
+    args = list(args)
+    limit = pop_option(args, "--limit", SEARCH_LIMIT)
+    offset = pop_option(args, "--offset", 0, minimum=0)
+    digits = re.sub(r"[\s()\-.]", "", "".join(args))
+    found_records = address_book.find_by_phone(digits, limit, offset)
+    first_record = next(found_records, None)
+    if first_record is None:
+        return f"{red}No contacts found with a phone starting with {yellow}{digits}.{reset}\n"
+    else:
+        header()
+        return "\n".join(str(record) for record in chain([first_record], found_records))
+
+
+def report_progress(rows, seconds):
+    """
+    Prints how many rows were processed so far and the throughput.
+
+    Args:
+        rows (int): Rows processed so far.
+        seconds (float): Seconds since the start.
+    """
+    print(f"{blue}{rows} rows, {rows / (seconds or 1e-9):.0f} rows/s{reset}")
+
+
+@input_error
+def import_contacts(args, address_book):
+    """
+    Imports contacts from a CSV or JSON Lines file.
+
+    Args:
+        args (list): A list containing the path of a .csv or .jsonl file.
+        address_book (AddressBook): The address book to import into.
+
+    Returns:
+        str: Import summary with the first rejected rows, or error message.
+    """
+    if not args:
+        raise ValueError(f"{red}The command is bad. Give me a path to a file.{reset}\n")
+    try:
+        imported, rejected, errors, seconds = transfer.import_contacts(
+            address_book, " ".join(args), progress=report_progress
+        )
+    except OSError as error:
+        raise ValueError(f"{red}Can't read the file: {error.strerror}.{reset}\n")
+    lines = [f"{green}Imported {imported} contacts in {seconds:.2f}s.{reset}"]
+    if rejected:
+        lines.append(f"{red}Rejected {rejected} rows:{reset}")
+        lines.extend(f"  row {number}: {message}" for number, message in errors)
+    return "\n".join(lines)
+
+
+@input_error
+def export_contacts(args, address_book):
+    """
+    Exports all contacts to a CSV or JSON Lines file.
+
+    Args:
+        args (list): A list containing the path of a .csv or .jsonl file.
+        address_book (AddressBook): The address book to export.
+
+    Returns:
+        str: Export summary or error message.
+    """
+    if not args:
+        raise ValueError(f"{red}The command is bad. Give me a path to a file.{reset}\n")
+    try:
+        exported, seconds = transfer.export_contacts(
+            address_book, " ".join(args), progress=report_progress
+        )
+    except OSError as error:
+        raise ValueError(f"{red}Can't write the file: {error.strerror}.{reset}\n")
+    return f"{green}Exported {exported} contacts in {seconds:.2f}s.{reset}"
 
 
 def header():
@@ -0,0 +1,644 @@
+from bisect import bisect_left, insort
+import math
+
+from src.metrics import metrics
+
+
+class KeyIndex:
+    """
+    Maps a key computed from a record to the ids of all records with that key.
+
+    The index remembers the key of every record it holds, so a record that was
+    edited in place can be re-indexed without knowing its old value.
+
+    Args:
+        key_func (callable): Returns the key of a record, or None to leave it out.
+
+    Methods:
+        add(record): Indexes a record, replacing its previous key.
+        remove(record_id): Removes a record from the index.
+        get(key): Returns the ids of the records with the given key.
+    """
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self._ids = {}
+        self._keys = {}
+
+    def add(self, record):
+        """
+        Indexes a record, replacing its previous key.
+
+        Args:
+            record (Record): The record to index.
+        """
+        self.remove(record.id)
+        key = self.key_func(record)
+        if key is None:
+            return
+        self._keys[record.id] = key
+        self._ids.setdefault(key, set()).add(record.id)
+
+    def remove(self, record_id):
+        """
+        Removes a record from the index.
+
+        Args:
+            record_id (int): The id of the record.
+        """
+        key = self._keys.pop(record_id, None)
+        if key is None:
+            return
+        ids = self._ids[key]
+        ids.discard(record_id)
+        if not ids:
+            del self._ids[key]
+
+    def get(self, key):
+        """
+        Returns the ids of the records with the given key.
+
+        Args:
+            key: The key to look up.
+
+        Returns:
+            set: Ids of the matching records.
+        """
+        return set(self._ids.get(key, ()))
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = None
+
+
+class PrefixTrie:
+    """
+    Character trie over a string key of every record for prefix queries.
+
+    Args:
+        key_func (callable): Returns the key of a record, or None to leave it out.
+
+    Methods:
+        add(record): Indexes a record, replacing its previous key.
+        remove(record_id): Removes a record from the trie.
+        iter_prefix(prefix): Lazily yields the ids of records whose key starts with the prefix.
+    """
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self._root = _TrieNode()
+        self._keys = {}
+
+    def add(self, record):
+        """
+        Indexes a record, replacing its previous key.
+
+        Args:
+            record (Record): The record to index.
+        """
+        self.remove(record.id)
+        key = self.key_func(record)
+        if key is None:
+            return
+        node = self._root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+            node = child
+        if node.ids is None:
+            node.ids = set()
+        node.ids.add(record.id)
+        self._keys[record.id] = key
+
+    def remove(self, record_id):
+        """
+        Removes a record from the trie and prunes the branches left empty.
+
+        Args:
+            record_id (int): The id of the record.
+        """
+        key = self._keys.pop(record_id, None)
+        if key is None:
+            return
+        path = [self._root]
+        for char in key:
+            path.append(path[-1].children[char])
+        node = path[-1]
+        node.ids.discard(record_id)
+        if not node.ids:
+            node.ids = None
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.ids or node.children:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+
+    def iter_prefix(self, prefix):
+        """
+        Lazily yields the ids of records whose key starts with the prefix.
+
+        Keys are visited in alphabetical order, ids with the same key in id order.
+
+        Args:
+            prefix (str): The prefix to look up.
+
+        Yields:
+            int: Ids of the matching records.
+        """
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.ids:
+                yield from sorted(node.ids)
+            stack.extend(
+                node.children[char] for char in sorted(node.children, reverse=True)
+            )
+
+
+class NGramIndex:
+    """
+    Substring index over a string key of every record.
+
+    Every substring of up to three characters of a key is indexed, so short
+    queries are answered directly and longer ones by intersecting the
+    postings of their trigrams and checking the few candidates left.
+
+    Args:
+        key_func (callable): Returns the key of a record, or None to leave it out.
+
+    Methods:
+        add(record): Indexes a record, replacing its previous key.
+        remove(record_id): Removes a record from the index.
+        iter_substring(query): Lazily yields the ids of records whose key contains the query.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self._grams = {}
+        self._keys = {}
+
+    def add(self, record):
+        """
+        Indexes a record, replacing its previous key.
+
+        Args:
+            record (Record): The record to index.
+        """
+        self.remove(record.id)
+        key = self.key_func(record)
+        if key is None:
+            return
+        self._keys[record.id] = key
+        for gram in self._grams_of(key):
+            self._grams.setdefault(gram, set()).add(record.id)
+
+    def remove(self, record_id):
+        """
+        Removes a record from the index.
+
+        Args:
+            record_id (int): The id of the record.
+        """
+        key = self._keys.pop(record_id, None)
+        if key is None:
+            return
+        for gram in self._grams_of(key):
+            ids = self._grams[gram]
+            ids.discard(record_id)
+            if not ids:
+                del self._grams[gram]
+
+    def iter_substring(self, query):
+        """
+        Lazily yields the ids of records whose key contains the query, in id order.
+
+        Args:
+            query (str): The substring to look up.
+
+        Yields:
+            int: Ids of the matching records.
+        """
+        if len(query) <= self.GRAM_SIZE:
+            yield from sorted(self._grams.get(query, ()))
+            return
+        postings = []
+        for start in range(len(query) - self.GRAM_SIZE + 1):
+            ids = self._grams.get(query[start : start + self.GRAM_SIZE])
+            if not ids:
+                return
+            postings.append(ids)
+        postings.sort(key=len)
+        for record_id in sorted(postings[0].intersection(*postings[1:])):
+            if query in self._keys[record_id]:
+                yield record_id
+
+    def _grams_of(self, key):
+        """
+        Returns all distinct substrings of the key up to GRAM_SIZE characters long.
+        """
+        return {
+            key[start : start + size]
+            for size in range(1, self.GRAM_SIZE + 1)
+            for start in range(len(key) - size + 1)
+        }
+
+
+class RangeIndex:
+    """
+    Keeps the ids of records sorted by a key for range queries.
+
+    Keys are any values that sort in the wanted order, such as birthdays as
+    (month, day) or dates written as "%Y-%m-%d %H:%M:%S". Additions and
+    removals are collected and merged in before the next query; a few are
+    placed with a binary search, many with one sort, so loading a whole book
+    stays linear and a query costs O(log n + k).
+
+    Methods:
+        add(record_id, key): Indexes a record under a key, replacing the previous one.
+        remove(record_id): Removes a record from the index.
+        between(low, high): Returns the entries from one key up to another.
+        merge(): Applies the collected additions and removals.
+    """
+
+    SORT_THRESHOLD = 64
+
+    def __init__(self):
+        self._entries = []
+        self._pending = set()
+        self._removed = set()
+        self._keys = {}
+
+    def add(self, record_id, key):
+        """
+        Indexes a record under a key, replacing the previous one.
+
+        Args:
+            record_id (int): The id of the record.
+            key: The key of the record, or None to leave it out.
+        """
+        self.remove(record_id)
+        if key is None:
+            return
+        self._keys[record_id] = key
+        entry = (key, record_id)
+        if entry in self._removed:
+            self._removed.discard(entry)
+        else:
+            self._pending.add(entry)
+
+    def remove(self, record_id):
+        """
+        Removes a record from the index.
+
+        Args:
+            record_id (int): The id of the record.
+        """
+        key = self._keys.pop(record_id, None)
+        if key is None:
+            return
+        entry = (key, record_id)
+        if entry in self._pending:
+            self._pending.discard(entry)
+        else:
+            self._removed.add(entry)
+
+    def between(self, low=None, high=None):
+        """
+        Returns the entries with a key from low, inclusive, up to high, exclusive.
+
+        Args:
+            low (optional): First key. Defaults to None for no lower bound.
+            high (optional): Key after the last one. Defaults to None for no upper bound.
+
+        Returns:
+            list: Tuples (key, record_id) sorted by key and id.
+        """
+        self.merge()
+        first = 0 if low is None else bisect_left(self._entries, (low,))
+        last = (
+            len(self._entries) if high is None else bisect_left(self._entries, (high,))
+        )
+        return self._entries[first:last]
+
+    def merge(self):
+        """
+        Applies the removals and additions since the last query.
+        """
+        if self._removed:
+            removed = self._removed
+            if len(removed) < self.SORT_THRESHOLD:
+                for entry in removed:
+                    del self._entries[bisect_left(self._entries, entry)]
+            else:
+                self._entries = [
+                    entry for entry in self._entries if entry not in removed
+                ]
+            self._removed = set()
+        if self._pending:
+            if len(self._pending) < self.SORT_THRESHOLD:
+                for entry in self._pending:
+                    insort(self._entries, entry)
+            else:
+                self._entries.extend(self._pending)
+                self._entries.sort()
+            self._pending = set()
+
+
+def edit_distance(first, second):
+    """
+    Returns the Levenshtein distance between two strings.
+
+    Args:
+        first (str): One string.
+        second (str): The other string.
+
+    Returns:
+        int: The least number of inserted, deleted or replaced characters
+            that turns one string into the other.
+    """
+    return distance_from(first)(second)
+
+
+def alignment_distance(first, second):
+    """
+    Returns the optimal string alignment distance between two strings.
+
+    It is the Levenshtein distance where swapping two adjacent characters,
+    the most common typo, counts as one edit instead of two, as long as no
+    character is edited twice.
+
+    Args:
+        first (str): One string.
+        second (str): The other string.
+
+    Returns:
+        int: The least number of edits that turns one string into the other.
+    """
+    before, previous = None, list(range(len(second) + 1))
+    for row, char in enumerate(first, start=1):
+        current = [row]
+        for column, other in enumerate(second, start=1):
+            cost = min(
+                previous[column] + 1,
+                current[column - 1] + 1,
+                previous[column - 1] + (char != other),
+            )
+            if (
+                before is not None
+                and column > 1
+                and char == second[column - 2]
+                and first[row - 2] == other
+            ):
+                cost = min(cost, before[column - 2] + 1)
+            current.append(cost)
+        before, previous = previous, current
+    return previous[-1]
+
+
+def distance_from(word):
+    """
+    Returns a function that gives the Levenshtein distance from a word to another string.
+
+    The distance is computed with the bit-parallel algorithm of Myers and
+    Hyyrö: a column of the edit table is kept as bit vectors of the word,
+    so each character of the other string costs a few integer operations
+    instead of a pass over the word. The bit masks of the word are built
+    once and reused for every string it is compared with.
+
+    Args:
+        word (str): The word to measure from.
+
+    Returns:
+        callable: Takes a string and returns its distance to the word.
+    """
+    length = len(word)
+    if not length:
+        return len
+    masks = {}
+    for position, char in enumerate(word):
+        masks[char] = masks.get(char, 0) | (1 << position)
+    full = (1 << length) - 1
+    last = 1 << (length - 1)
+
+    def distance(other):
+        positive, negative, score = full, 0, length
+        for char in other:
+            equal = masks.get(char, 0)
+            vertical = equal | negative
+            horizontal = (((equal & positive) + positive) ^ positive) | equal
+            horizontal_positive = negative | ~(horizontal | positive)
+            horizontal_negative = positive & horizontal
+            if horizontal_positive & last:
+                score += 1
+            elif horizontal_negative & last:
+                score -= 1
+            horizontal_positive = (horizontal_positive << 1) | 1
+            horizontal_negative <<= 1
+            positive = (horizontal_negative | ~(vertical | horizontal_positive)) & full
+            negative = horizontal_positive & vertical & full
+        return score
+
+    return distance
+
+
+class _BKNode:
+    __slots__ = ("word", "ids", "children")
+
+    def __init__(self, word):
+        self.word = word
+        self.ids = set()
+        self.children = {}
+
+
+class FuzzyIndex:
+    """
+    Finds records whose key is a few typos away from a query, word by word.
+
+    The distinct words of all keys are kept in a BK-tree, where the children
+    of a word hang by their edit distance to it. By the triangle inequality,
+    a query only has to descend into the children whose distance is within
+    the allowed number of edits of its own distance to the word, so a lookup
+    visits a small part of the words.
+
+    The tree is searched by Levenshtein distance, which obeys the triangle
+    inequality, with twice the allowed edits, since every swap of neighbouring
+    letters costs two; the words found are then measured by
+    alignment_distance, so a swap counts as one typo (jhon finds john, and
+    two swaps are two typos). A word whose records are all removed stays in
+    the tree without ids until such words are half of the tree, which is
+    then rebuilt from the words in use.
+
+    Args:
+        key_func (callable): Returns the key of a record, or None to leave it out.
+
+    Methods:
+        add(record): Indexes a record, replacing its previous key.
+        remove(record_id): Removes a record from the index.
+        search(query, max_distance): Returns the records that match every word of the query.
+    """
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self._root = None
+        self._nodes = {}
+        self._keys = {}
+        self._unused = 0
+
+    def add(self, record):
+        """
+        Indexes a record, replacing its previous key.
+
+        Args:
+            record (Record): The record to index.
+        """
+        self.remove(record.id)
+        key = self.key_func(record)
+        if key is None:
+            return
+        words = tuple(set(key.split()))
+        self._keys[record.id] = words
+        for word in words:
+            node = self._nodes.get(word)
+            if node is None:
+                node = self._insert(word)
+            elif not node.ids:
+                self._unused -= 1
+            node.ids.add(record.id)
+
+    def remove(self, record_id):
+        """
+        Removes a record from the index.
+
+        Args:
+            record_id (int): The id of the record.
+        """
+        for word in self._keys.pop(record_id, ()):
+            node = self._nodes[word]
+            node.ids.discard(record_id)
+            if not node.ids:
+                self._unused += 1
+        if self._unused > len(self._nodes) // 2:
+            self._rebuild()
+
+    def search(self, query, max_distance=None):
+        """
+        Returns the records that have a word close to every word of the query.
+
+        The distance of a record is the sum of the distances from each query
+        word to its closest word in the key, where a swap of two neighbouring
+        letters counts as one edit.
+
+        Args:
+            query (str): Words to look up.
+            max_distance (int, optional): Edits allowed per word. Defaults to
+                one for words of three to five characters, two for longer
+                words and none for shorter ones.
+
+        Returns:
+            list: Tuples (distance, record_id) sorted by distance and id.
+        """
+        totals = None
+        for word in set(query.split()):
+            allowed = (
+                self.allowed_distance(word) if max_distance is None else max_distance
+            )
+            closest = {}
+            for distance, node in self._within(word, 2 * allowed):
+                if distance > 1:
+                    distance = alignment_distance(word, node.word)
+                if distance > allowed:
+                    continue
+                for record_id in node.ids:
+                    if distance < closest.get(record_id, math.inf):
+                        closest[record_id] = distance
+            if totals is None:
+                totals = closest
+            else:
+                totals = {
+                    record_id: totals[record_id] + distance
+                    for record_id, distance in closest.items()
+                    if record_id in totals
+                }
+            if not totals:
+                return []
+        return sorted(
+            (distance, record_id) for record_id, distance in (totals or {}).items()
+        )
+
+    @staticmethod
+    def allowed_distance(word):
+        """
+        Returns the edits allowed by default for a query word of its length.
+        """
+        if len(word) < 3:
+            return 0
+        return 1 if len(word) < 6 else 2
+
+    def _rebuild(self):
+        """
+        Builds the tree again from the words that still have records.
+        """
+        nodes = [node for node in self._nodes.values() if node.ids]
+        self._root = None
+        self._nodes = {}
+        self._unused = 0
+        for node in nodes:
+            self._insert(node.word).ids = node.ids
+
+    def _insert(self, word):
+        """
+        Adds a new word to the tree and returns its node.
+        """
+        node = self._nodes[word] = _BKNode(word)
+        if self._root is None:
+            self._root = node
+            return node
+        distance_to = distance_from(word)
+        parent = self._root
+        while True:
+            distance = distance_to(parent.word)
+            child = parent.children.get(distance)
+            if child is None:
+                parent.children[distance] = node
+                return node
+            parent = child
+
+    def _within(self, word, allowed):
+        """
+        Yields the nodes of the words at most allowed edits from the word, with their distance.
+        """
+        if self._root is None:
+            return
+        if allowed == 0:
+            node = self._nodes.get(word)
+            if node is not None:
+                metrics.scanned(1)
+                yield 0, node
+            return
+        distance_to = distance_from(word)
+        stack = [self._root]
+        visited = 0
+        try:
+            while stack:
+                node = stack.pop()
+                visited += 1
+                distance = distance_to(node.word)
+                if distance <= allowed:
+                    yield distance, node
+                for edge, child in node.children.items():
+                    if distance - allowed <= edge <= distance + allowed:
+                        stack.append(child)
+        finally:
+            metrics.scanned(visited)
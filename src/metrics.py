@@ -0,0 +1,409 @@
+import cProfile
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+import io
+import json
+import os
+import pstats
+import threading
+from time import perf_counter, time
+import tracemalloc
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+# Upper bounds of the latency histogram buckets in milliseconds; slower calls
+# go to an overflow bucket.
+LATENCY_BUCKETS_MS = (
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    25,
+    50,
+    100,
+    250,
+    500,
+    1000,
+    2500,
+    5000,
+    10000,
+)
+STATS_DUMP_INTERVAL = 60.0
+PROFILE_LINES = 20
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets.
+
+    Recording a value costs a bisect and two additions, and percentiles are
+    read from the bucket bounds, so they are exact to one bucket.
+
+    Methods:
+        add(seconds): Records a duration.
+        percentile(share): Returns the duration below which the share of calls fell.
+        to_dict(): Returns the summary of the histogram.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        milliseconds = seconds * 1000
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+
+    def percentile(self, share):
+        """
+        Returns the upper bound in milliseconds of the bucket that holds the share of calls.
+        """
+        if not self.count:
+            return 0.0
+        wanted = share * self.count
+        seen = 0
+        for number, count in enumerate(self.buckets):
+            seen += count
+            if seen >= wanted:
+                break
+        if number < len(LATENCY_BUCKETS_MS):
+            return min(LATENCY_BUCKETS_MS[number], self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.maximum,
+            "buckets_ms": {
+                str(bound): count
+                for bound, count in zip(LATENCY_BUCKETS_MS + ("inf",), self.buckets)
+                if count
+            },
+        }
+
+
+class _CommandState(threading.local):
+    """
+    Records scanned by the running command of a thread and whether a handler failed.
+    """
+
+    scanned = None
+    failed = False
+
+
+class CommandStatus:
+    """
+    Outcome of a command timed by Metrics.command, known once the command ends.
+
+    Attributes:
+        failed (bool): Whether a handler failed or reported a failure.
+    """
+
+    __slots__ = ("failed",)
+
+    def __init__(self):
+        self.failed = False
+
+
+class Metrics:
+    """
+    Counters and latency histograms of commands and storage I/O.
+
+    Commands run from several threads in the server, so shared state is only
+    changed under a lock. Records scanned and handler errors are first
+    collected per thread for the running command.
+
+    Methods:
+        command(name): Context that times a command and records its scans and errors.
+        fail(): Marks the running command as failed without an error.
+        scanned(count): Adds records examined by the running command.
+        counted(iterable): Yields the items, counting each as scanned.
+        error(handler, error): Records an error caught by input_error.
+        add(counter, amount): Adds to a counter such as bytes_written.
+        timed(name): Context that records the duration of a storage write.
+        snapshot(): Returns all metrics as a dictionary.
+        report(): Returns the metrics as a table for the stats command.
+        reset(): Drops everything recorded so far.
+        dump(path): Writes the snapshot to a JSON file.
+        start_dumping(path, interval): Dumps to the file periodically in the background.
+        stop_dumping(): Stops the periodic dump after a last one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = _CommandState()
+        self._dumper = None
+        self._stop_dump = threading.Event()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time()
+            self.commands = {}
+            self.scans = Counter()
+            self.command_errors = Counter()
+            self.errors = Counter()
+            self.counters = Counter()
+            self.writes = {}
+
+    @contextmanager
+    def command(self, name):
+        """
+        Times a command and records the records it scanned and whether a handler failed.
+
+        A command run by another one, like under profile, also counts for the outer one.
+
+        Args:
+            name (str): The command.
+
+        Yields:
+            CommandStatus: Tells whether the command failed once it ended.
+        """
+        outer_scanned = self._local.scanned
+        outer_failed = self._local.failed
+        self._local.scanned = 0
+        self._local.failed = False
+        status = CommandStatus()
+        start = perf_counter()
+        try:
+            yield status
+        finally:
+            elapsed = perf_counter() - start
+            scanned, failed = self._local.scanned, self._local.failed
+            status.failed = failed
+            with self._lock:
+                histogram = self.commands.get(name)
+                if histogram is None:
+                    histogram = self.commands[name] = Histogram()
+                histogram.add(elapsed)
+                self.scans[name] += scanned
+                if failed:
+                    self.command_errors[name] += 1
+            if outer_scanned is not None:
+                outer_scanned += scanned
+            self._local.scanned = outer_scanned
+            self._local.failed = outer_failed or failed
+
+    def scanned(self, count):
+        """
+        Adds records examined by the running command of this thread.
+
+        Args:
+            count (int): Number of records.
+        """
+        local = self._local
+        if local.scanned is not None:
+            local.scanned += count
+
+    def counted(self, iterable):
+        """
+        Yields the items of an iterable, counting each as a scanned record.
+
+        The count is added once the iterable is exhausted or dropped.
+        """
+        count = 0
+        try:
+            for item in iterable:
+                count += 1
+                yield item
+        finally:
+            self.scanned(count)
+
+    def fail(self):
+        """
+        Marks the running command as failed when it reports a failure without
+        an error, e.g. because a contact was not found.
+        """
+        self._local.failed = True
+
+    def error(self, handler, error):
+        """
+        Records an error that input_error turned into a message.
+
+        Args:
+            handler (str): Name of the handler.
+            error (Exception): The error.
+        """
+        self._local.failed = True
+        with self._lock:
+            self.errors[f"{handler}: {type(error).__name__}"] += 1
+
+    def add(self, counter, amount):
+        """
+        Adds to a counter.
+
+        Args:
+            counter (str): Name of the counter, e.g. bytes_read or bytes_written.
+            amount (int): The amount to add.
+        """
+        with self._lock:
+            self.counters[counter] += amount
+
+    @contextmanager
+    def timed(self, name):
+        """
+        Records the duration of a storage write.
+
+        Args:
+            name (str): The write, e.g. "notes.json save".
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self._lock:
+                histogram = self.writes.get(name)
+                if histogram is None:
+                    histogram = self.writes[name] = Histogram()
+                histogram.add(elapsed)
+
+    def snapshot(self):
+        """
+        Returns all metrics as a dictionary that can be dumped as JSON.
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "uptime_s": time() - self.started,
+                "commands": {
+                    name: dict(
+                        histogram.to_dict(),
+                        errors=self.command_errors[name],
+                        records_scanned=self.scans[name],
+                    )
+                    for name, histogram in sorted(self.commands.items())
+                },
+                "writes": {
+                    name: histogram.to_dict()
+                    for name, histogram in sorted(self.writes.items())
+                },
+                "counters": dict(self.counters),
+                "errors": dict(self.errors),
+            }
+
+    def report(self):
+        """
+        Returns the metrics as a table.
+        """
+        data = self.snapshot()
+        lines = [
+            f"{blue}Statistics of the last {data['uptime_s']:.0f} s:{reset}",
+            f"{'Command':<16}{'Calls':>8}{'Errors':>8}{'Mean ms':>10}{'p50 ms':>10}"
+            f"{'p99 ms':>10}{'Max ms':>10}{'Scan/call':>10}",
+        ]
+        for name, entry in data["commands"].items():
+            lines.append(
+                f"{green}{name:<16}{reset}{entry['count']:>8}{entry['errors']:>8}"
+                f"{entry['mean_ms']:>10.2f}{entry['p50_ms']:>10.2f}{entry['p99_ms']:>10.2f}"
+                f"{entry['max_ms']:>10.2f}{entry['records_scanned'] / entry['count']:>10.1f}"
+            )
+        if data["writes"]:
+            lines.append(
+                f"{'Storage write':<32}{'Count':>8}{'Mean ms':>10}{'Max ms':>10}"
+            )
+            for name, entry in data["writes"].items():
+                lines.append(
+                    f"{green}{name:<32}{reset}{entry['count']:>8}"
+                    f"{entry['mean_ms']:>10.2f}{entry['max_ms']:>10.2f}"
+                )
+        for counter, amount in sorted(data["counters"].items()):
+            lines.append(f"{counter}: {yellow}{amount}{reset}")
+        for handler, count in sorted(data["errors"].items()):
+            lines.append(f"{red}{handler}{reset}: {count}")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """
+        Writes the snapshot to a JSON file, replacing it atomically.
+
+        Args:
+            path (str): Path of the file.
+        """
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self.snapshot(), file, indent=4)
+        os.replace(temp_path, path)
+
+    def start_dumping(self, path, interval=STATS_DUMP_INTERVAL):
+        """
+        Dumps the metrics to a JSON file every interval seconds in a background thread.
+
+        Args:
+            path (str): Path of the file.
+            interval (float, optional): Seconds between dumps. Defaults to STATS_DUMP_INTERVAL.
+        """
+        self._stop_dump.clear()
+
+        def run():
+            while not self._stop_dump.wait(interval):
+                self.dump(path)
+            self.dump(path)
+
+        self._dumper = threading.Thread(target=run, name="stats-dump", daemon=True)
+        self._dumper.start()
+
+    def stop_dumping(self):
+        """
+        Stops the periodic dump after writing the file one last time.
+        """
+        if self._dumper is not None:
+            self._stop_dump.set()
+            self._dumper.join()
+            self._dumper = None
+
+
+def profile_call(function, memory=False):
+    """
+    Runs a function under cProfile, or under tracemalloc with memory set.
+
+    Args:
+        function (callable): The function to run, without arguments.
+        memory (bool, optional): Trace allocations instead of time. Defaults to False.
+
+    Returns:
+        tuple: The result of the function and the report.
+    """
+    if memory:
+        tracemalloc.start()
+        try:
+            result = function()
+            allocations = tracemalloc.take_snapshot().statistics("lineno")
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        lines = [f"{blue}Peak {peak} bytes, {current} bytes still allocated:{reset}"]
+        lines.extend(str(statistic) for statistic in allocations[:PROFILE_LINES])
+        return result, "\n".join(lines)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = function()
+    finally:
+        profiler.disable()
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(
+        PROFILE_LINES
+    )
+    return result, report.getvalue()
+
+
+metrics = Metrics()
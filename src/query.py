@@ -0,0 +1,268 @@
+import calendar
+from itertools import chain, islice
+import operator
+import re
+import shlex
+
+from src.classes import Birthday
+from src.metrics import metrics
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+# Candidates read from an index before the planner decides how to use it.
+PROBE_LIMIT = 1000
+
+CONDITION_PATTERN = re.compile(
+    r"(?:(not)\s+)?(\w+)\s*(!=|<=|>=|=|<|>|contains\b|starts\b|ends\b)\s*(.*)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# Values a condition can compare, read from a record; None if the record has none.
+QUERY_FIELDS = {
+    "id": lambda record: record.id,
+    "name": lambda record: record.name.value,
+    "phone": lambda record: record.phone.value if record.phone else None,
+    "email": lambda record: record.email.value if record.email else None,
+    "domain": lambda record: record.email.value.rpartition("@")[2]
+    if record.email
+    else None,
+    "address": lambda record: record.address.value if record.address else None,
+    "birthday": lambda record: record.birthday.date if record.birthday else None,
+    "day": lambda record: record.birthday.date.day if record.birthday else None,
+    "month": lambda record: record.birthday.date.month if record.birthday else None,
+    "year": lambda record: record.birthday.date.year if record.birthday else None,
+}
+NUMBER_FIELDS = ("id", "day", "month", "year")
+
+OPERATORS = {
+    "=": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "contains": lambda value, part: part in value,
+    "starts": lambda value, prefix: value.startswith(prefix),
+    "ends": lambda value, suffix: value.endswith(suffix),
+}
+TEXT_OPERATORS = ("contains", "starts", "ends")
+
+MONTHS = {
+    name.casefold(): number
+    for names in (calendar.month_name, calendar.month_abbr)
+    for number, name in enumerate(names)
+    if name
+}
+
+
+class Condition:
+    """
+    One comparison of a record field with a value.
+
+    Texts are compared ignoring case. A record without the field never
+    matches, unless the condition is negated.
+
+    Attributes:
+        field (str): Name of the field, one of QUERY_FIELDS.
+        operator (str): One of OPERATORS.
+        value: The value to compare with, parsed for the field.
+        negated (bool): Whether the condition starts with 'not'.
+
+    Methods:
+        matches(record): Tells whether a record satisfies the condition.
+    """
+
+    def __init__(self, field, operator, value, negated=False):
+        self.field = field
+        self.operator = operator
+        self.value = value
+        self.negated = negated
+        self._read = QUERY_FIELDS[field]
+        self._compare = OPERATORS[operator]
+
+    def matches(self, record):
+        """
+        Tells whether a record satisfies the condition.
+
+        Args:
+            record (Record): The record to check.
+
+        Returns:
+            bool: True if the record matches.
+        """
+        actual = self._read(record)
+        if actual is None:
+            return self.negated
+        if isinstance(actual, str):
+            actual = actual.casefold()
+        return self._compare(actual, self.value) != self.negated
+
+    def __str__(self):
+        value = (
+            self.value.strftime("%d.%m.%Y") if self.field == "birthday" else self.value
+        )
+        return f"{'not ' if self.negated else ''}{self.field} {self.operator} {value}"
+
+
+def parse_query(text):
+    """
+    Parses a query into conditions that all have to hold.
+
+    A query is conditions joined by 'and', each a field, an operator and a
+    value, optionally preceded by 'not', e.g.
+    'domain = example.com and month = march and address contains Kyiv'.
+    Values run up to the next 'and'; put them in double quotes to include
+    one. Apostrophes are plain characters, so name = O'Brien needs no quotes.
+
+    Args:
+        text (str): The query.
+
+    Returns:
+        list: The conditions.
+
+    Raises:
+        ValueError: If the query does not follow the grammar.
+    """
+    lexer = shlex.shlex(text, posix=True)
+    lexer.whitespace_split = True
+    lexer.quotes = '"'
+    try:
+        tokens = list(lexer)
+    except ValueError:
+        raise ValueError(f"{red}The query has an unclosed quote.{reset}\n")
+    groups = [[]]
+    for token in tokens:
+        if token.casefold() == "and":
+            groups.append([])
+        else:
+            groups[-1].append(token)
+    if not tokens:
+        raise ValueError(
+            f"{red}Give me a query like: domain = example.com and month = 3{reset}\n"
+        )
+    return [parse_condition(" ".join(group)) for group in groups]
+
+
+def parse_condition(text):
+    """
+    Parses one condition of a query.
+
+    Args:
+        text (str): The condition, e.g. 'birthday >= 01.01.1990'.
+
+    Returns:
+        Condition: The parsed condition.
+
+    Raises:
+        ValueError: If the field, the operator or the value is not valid.
+    """
+    match = CONDITION_PATTERN.fullmatch(text.strip())
+    if not match or not match.group(4).strip():
+        raise ValueError(
+            f"{red}Can't read the condition {yellow}{text or '(empty)'}{red}. "
+            f"Write it as: field operator value.{reset}\n"
+        )
+    negated, field, operator_name, value = match.groups()
+    field, operator_name, value = (
+        field.casefold(),
+        operator_name.casefold(),
+        value.strip(),
+    )
+    if field not in QUERY_FIELDS:
+        raise ValueError(
+            f"{red}Unknown field {yellow}{field}{red}. Use one of: {', '.join(QUERY_FIELDS)}.{reset}\n"
+        )
+    if operator_name in TEXT_OPERATORS and field not in (
+        "name",
+        "phone",
+        "email",
+        "domain",
+        "address",
+    ):
+        raise ValueError(
+            f"{red}{operator_name} only works with text fields, not {field}.{reset}\n"
+        )
+    return Condition(field, operator_name, parse_value(field, value), bool(negated))
+
+
+def parse_value(field, value):
+    """
+    Converts the value of a condition to the type of the field.
+
+    Raises:
+        ValueError: If the value does not fit the field.
+    """
+    if field == "birthday":
+        return Birthday.validate(value)
+    if field == "month" and value.casefold() in MONTHS:
+        return MONTHS[value.casefold()]
+    if field in NUMBER_FIELDS:
+        if not value.isdigit():
+            raise ValueError(f"{red}The value of {field} must be a number.{reset}\n")
+        return int(value)
+    return value.casefold()
+
+
+def run_query(book, conditions):
+    """
+    Plans a query and returns its matching records lazily.
+
+    Every condition that an index can answer is probed for up to
+    PROBE_LIMIT candidates. Conditions with fewer candidates are the most
+    selective: their id sets are intersected, smallest first. If every
+    index returned more, the candidates are streamed from one of them, and
+    with no usable index every record is scanned. Each candidate is then
+    checked against all conditions, so an index only ever narrows the search.
+
+    Args:
+        book (AddressBook): The address book to query.
+        conditions (list): Conditions that all have to hold.
+
+    Returns:
+        tuple: Lazy iterator over the matching records, in id order unless
+            they are streamed from an index, and the steps of the plan.
+    """
+    exact, streams = [], []
+    for condition in conditions:
+        if condition.negated:
+            continue
+        ids = book.candidate_ids(condition.field, condition.operator, condition.value)
+        if ids is None:
+            continue
+        head = list(islice(ids, PROBE_LIMIT + 1))
+        metrics.scanned(len(head))
+        if len(head) <= PROBE_LIMIT:
+            exact.append((condition, set(head)))
+        else:
+            streams.append((condition, head, ids))
+
+    if exact:
+        exact.sort(key=lambda entry: len(entry[1]))
+        candidate_ids = exact[0][1].intersection(*(ids for _, ids in exact[1:]))
+        steps = [
+            f"index {condition}: {len(ids)} candidates" for condition, ids in exact
+        ]
+        steps.append(f"intersection: {len(candidate_ids)} candidates")
+        candidates = iter(sorted(candidate_ids))
+    elif streams:
+        condition, head, rest = streams[0]
+        steps = [f"stream index {condition}: over {PROBE_LIMIT} candidates"]
+        candidates = chain(head, rest)
+    else:
+        steps = [f"scan all {len(book.data)} contacts"]
+        candidates = iter(list(book.data))
+    steps.append("check: " + " and ".join(str(condition) for condition in conditions))
+
+    def matching():
+        for record_id in metrics.counted(candidates):
+            record = book.data[record_id]
+            if all(condition.matches(record) for condition in conditions):
+                yield record
+
+    return matching(), steps
@@ -0,0 +1,414 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from functools import partial
+import io
+import json
+import os
+import signal
+import socket
+import stat
+import sys
+import threading
+
+from src.commands import READ_COMMANDS, execute_line, parse_batch_line
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+DEFAULT_ADDRESS = "neoneo.sock"
+FLUSH_INTERVAL = 1.0
+READ_WORKERS = 4
+LINE_LIMIT = 1024 * 1024
+
+
+def parse_address(address):
+    """
+    Splits a server address into a host and a port.
+
+    Args:
+        address (str): HOST:PORT for local TCP, anything else is the path of a
+            Unix domain socket.
+
+    Returns:
+        tuple: The host and the port, or the socket path and None.
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address, None
+
+
+def command_of(line):
+    """
+    Returns the command of a line, or None if it can't be parsed.
+    """
+    try:
+        return parse_batch_line(line, iter(()))[0]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class ReadWriteLock:
+    """
+    Asyncio lock that lets many readers or a single writer in.
+
+    A waiting writer keeps new readers out, so writes are not starved by a
+    steady stream of queries.
+
+    Methods:
+        read(): Context that holds the lock for reading.
+        write(): Context that holds the lock for writing.
+    """
+
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @asynccontextmanager
+    async def read(self):
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: not self._writing and not self._waiting_writers
+            )
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._condition:
+            self._waiting_writers += 1
+            await self._condition.wait_for(
+                lambda: not self._writing and not self._readers
+            )
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class ThreadOutput(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that gives every capturing thread its own buffer.
+
+    Handlers print their results, and several of them run at once in the
+    server, so contextlib.redirect_stdout, which swaps the stream for the
+    whole process, can't be used.
+
+    Args:
+        stream: Where output of threads that don't capture goes.
+
+    Methods:
+        capture(buffer): Context that sends the output of the current thread to the buffer.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        return (self.stream if buffer is None else buffer).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextmanager
+    def capture(self, buffer):
+        self._local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+
+class CommandServer:
+    """
+    Serves commands to many clients from one resident address book and notebook.
+
+    A client sends commands one per line, plain or as JSON objects like in
+    batch mode, and gets one JSON line back for each:
+    {"command": ..., "status": "ok" or "error", "output": ...}. The command
+    close ends the connection.
+
+    Read-only commands run in parallel in a thread pool, commands that change
+    data run alone. Changes are written behind: they are collected in a
+    transaction that is checkpointed every flush_interval seconds and
+    committed when the server stops. A change has been answered as done by
+    then, so a failed write is never rolled back: the changes stay in memory
+    and are written again by the next flush.
+
+    Args:
+        contacts (AddressBook): The address book.
+        notebook (Notebook): The notebook.
+        flush_interval (float, optional): Seconds between writes. Defaults to FLUSH_INTERVAL.
+        workers (int, optional): Threads that run commands. Defaults to READ_WORKERS.
+
+    Methods:
+        serve(address): Accepts clients until the process is interrupted.
+        execute(line): Runs one command line under the right lock.
+        stop(): Makes serve() return.
+    """
+
+    def __init__(
+        self, contacts, notebook, flush_interval=FLUSH_INTERVAL, workers=READ_WORKERS
+    ):
+        self.contacts = contacts
+        self.notebook = notebook
+        self.flush_interval = flush_interval
+        self.workers = workers
+        self._clients = set()
+        self._window = None
+        self._stale = False
+
+    async def serve(self, address=DEFAULT_ADDRESS):
+        """
+        Accepts clients until the process is interrupted or stop() is called.
+
+        Pending changes are written before it returns.
+
+        Args:
+            address (str, optional): Socket path or HOST:PORT. Defaults to DEFAULT_ADDRESS.
+        """
+        loop = asyncio.get_running_loop()
+        self._lock = ReadWriteLock()
+        self._stopping = asyncio.Event()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="command")
+        self._output = ThreadOutput(sys.stdout)
+        await loop.run_in_executor(self._executor, self._prepare_reads)
+
+        host, port = parse_address(address)
+        if port is None:
+            if os.path.exists(host) and stat.S_ISSOCK(os.stat(host).st_mode):
+                os.remove(host)
+            server = await asyncio.start_unix_server(
+                self._handle, host, limit=LINE_LIMIT
+            )
+        else:
+            server = await asyncio.start_server(
+                self._handle, host, port, limit=LINE_LIMIT
+            )
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        self._open_window()
+        flusher = asyncio.create_task(self._flush_periodically())
+        stdout, sys.stdout = sys.stdout, self._output
+        print(f"{blue}Serving on {address}.{reset}", file=sys.stderr)
+        try:
+            await self._stopping.wait()
+        finally:
+            self._stopping.set()
+            server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await flusher
+            async with self._lock.write():
+                await loop.run_in_executor(self._executor, self._close_window)
+            self._executor.shutdown()
+            sys.stdout = stdout
+            if port is None and os.path.exists(host):
+                os.remove(host)
+
+    def stop(self):
+        """
+        Makes serve() return after writing pending changes.
+        """
+        self._stopping.set()
+
+    async def execute(self, line):
+        """
+        Runs one command line, in parallel with other queries or alone if it changes data.
+
+        A change leaves the indexes with deferred updates, which are merged
+        before the next query rather than after every change, so a burst of
+        changes pays for one merge.
+
+        Args:
+            line (str): The stripped line, plain or a JSON object.
+
+        Returns:
+            tuple: The command, its output, whether it succeeded and whether
+                the connection stays open.
+        """
+        loop = asyncio.get_running_loop()
+        command = command_of(line)
+        run = partial(
+            self._run,
+            partial(execute_line, line, self.contacts, capture=self._output.capture),
+        )
+        if command in READ_COMMANDS:
+            while True:
+                if self._stale:
+                    async with self._lock.write():
+                        if self._stale:
+                            await loop.run_in_executor(
+                                self._executor, self._prepare_reads
+                            )
+                async with self._lock.read():
+                    if not self._stale:
+                        return await loop.run_in_executor(self._executor, run)
+        async with self._lock.write():
+            self._stale = True
+            return await loop.run_in_executor(self._executor, run)
+
+    async def _handle(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    break
+                if not line:
+                    break
+                line = line.decode("utf-8", "replace").strip()
+                if not line:
+                    continue
+                command, output, succeeded, running = await self.execute(line)
+                reply = {
+                    "command": command,
+                    "status": "ok" if succeeded else "error",
+                    "output": output,
+                }
+                writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+                await writer.drain()
+                if not running:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def _run(self, execute):
+        """
+        Runs a command in a worker thread and turns an unexpected error into a reply.
+        """
+        try:
+            return execute()
+        except Exception as error:
+            return None, f"{red}Command failed: {error}{reset}\n", False, True
+
+    def _prepare_reads(self):
+        """
+        Leaves the indexes ready to be read from several threads.
+        """
+        self.contacts.build_indexes()
+        self.notebook.build_indexes()
+        self._stale = False
+
+    def _open_window(self):
+        """
+        Starts collecting changes in a transaction on the address book and the notebook.
+        """
+        self._window = ExitStack()
+        self._window.enter_context(self.contacts.transaction())
+        self._window.enter_context(self.notebook.transaction())
+
+    def _flush(self):
+        """
+        Writes the collected changes and keeps collecting.
+
+        Returns:
+            bool: False if a write failed; its changes are kept for the next flush.
+        """
+        try:
+            self.contacts.checkpoint()
+            self.notebook.checkpoint()
+        except Exception as error:
+            print(f"{red}Could not save changes: {error}{reset}", file=sys.stderr)
+            return False
+        return True
+
+    def _close_window(self):
+        """
+        Writes the collected changes and ends the transactions.
+
+        If the last write fails the transactions are left open rather than
+        rolled back.
+        """
+        if self._flush():
+            self._window.close()
+
+    async def _flush_periodically(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                async with self._lock.write():
+                    await loop.run_in_executor(self._executor, self._flush)
+
+
+def run_client(address=DEFAULT_ADDRESS):
+    """
+    Sends commands from stdin to a running server and prints the replies.
+
+    Prompts for commands when stdin is a terminal. Commands that ask
+    questions (nadd, nedit) take their answers as a JSON line, e.g.
+    {"command": "nadd Buy milk", "input": ["home"]}.
+
+    Args:
+        address (str, optional): Socket path or HOST:PORT. Defaults to DEFAULT_ADDRESS.
+
+    Returns:
+        int: Number of failed commands.
+    """
+    host, port = parse_address(address)
+    if port is None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(host)
+    else:
+        connection = socket.create_connection((host, port))
+    interactive = sys.stdin.isatty()
+    failed = 0
+    with connection, connection.makefile(
+        "rw", encoding="utf-8", newline="\n"
+    ) as stream:
+        while True:
+            try:
+                line = (
+                    input(f"{blue}Enter a command: {reset}")
+                    if interactive
+                    else sys.stdin.readline()
+                )
+            except EOFError:
+                break
+            if not interactive and not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            stream.write(line + "\n")
+            stream.flush()
+            reply = stream.readline()
+            if not reply:
+                break
+            reply = json.loads(reply)
+            sys.stdout.write(reply["output"])
+            if reply["status"] != "ok":
+                failed += 1
+    return failed
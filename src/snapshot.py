@@ -0,0 +1,717 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+
+from src.metrics import metrics
+from src.storage import JournalStorage, JOURNAL_COMPACT_THRESHOLD
+
+
+MAGIC = b"NEO7SNP1"
+PREFIX = struct.Struct("<8sI")
+ID = struct.Struct("<q")
+SPAN = struct.Struct("<QI")
+POSITION_TYPE = "I"
+NONE_LENGTH = 0xFFFFFFFF
+LIST_SEPARATOR = "\x1f"
+FIELD_CACHE_BYTES = 16 * 1024 * 1024
+
+KEY_TRANSFORMS = {"": lambda value: value, "casefold": str.casefold}
+
+
+def write_snapshot(path, rows, fields, list_fields=(), sorted_fields=(), meta=None):
+    """
+    Writes records into a binary snapshot that SnapshotReader can map into memory.
+
+    The file holds a small JSON schema, a fixed-width table with the id and
+    the (offset, length) of every field of every record, one sorted
+    permutation of the table per sorted field and a heap with the UTF-8
+    field values. The table and the heap are streamed through temporary
+    files, so only the keys of the sorted fields are held in memory.
+
+    Args:
+        path (str): Path of the snapshot, replaced atomically.
+        rows (iterable): Record dictionaries in ascending id order.
+        fields (tuple): Names of the stored fields.
+        list_fields (tuple, optional): Fields whose values are lists of strings.
+        sorted_fields (tuple, optional): Fields to build sorted lookups for,
+            optionally with a transform such as "name:casefold". Missing
+            values sort as empty strings.
+        meta (dict, optional): Extra values stored in the schema.
+
+    Raises:
+        ValueError: If the ids are not in ascending order.
+    """
+    entry = struct.Struct(ID.format + SPAN.format[1:] * len(fields))
+    keys = {spec: [] for spec in sorted_fields}
+    count = heap_size = 0
+    last_id = None
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.TemporaryFile(dir=directory) as table, tempfile.TemporaryFile(
+        dir=directory
+    ) as heap:
+        for row in rows:
+            if last_id is not None and row["id"] <= last_id:
+                raise ValueError("Snapshot rows must be in ascending id order.")
+            last_id = row["id"]
+            values = [row["id"]]
+            for name in fields:
+                value = row.get(name)
+                if value is None:
+                    values += (0, NONE_LENGTH)
+                    continue
+                if name in list_fields:
+                    value = LIST_SEPARATOR.join(value)
+                data = value.encode("utf-8")
+                values += (heap_size, len(data))
+                heap.write(data)
+                heap_size += len(data)
+            table.write(entry.pack(*values))
+            for spec, spec_keys in keys.items():
+                name, _, transform = spec.partition(":")
+                spec_keys.append(
+                    (KEY_TRANSFORMS[transform](row.get(name) or ""), count)
+                )
+            count += 1
+
+        schema = json.dumps(
+            {
+                "count": count,
+                "fields": list(fields),
+                "list_fields": list(list_fields),
+                "sorted_fields": list(sorted_fields),
+                "meta": meta or {},
+            }
+        ).encode("utf-8")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(PREFIX.pack(MAGIC, len(schema)))
+            file.write(schema)
+            table.seek(0)
+            shutil.copyfileobj(table, file)
+            for spec in sorted_fields:
+                spec_keys = keys.pop(spec)
+                spec_keys.sort()
+                positions = array(
+                    POSITION_TYPE, (position for _, position in spec_keys)
+                )
+                if sys.byteorder == "big":
+                    positions.byteswap()
+                file.write(positions.tobytes())
+            heap.seek(0)
+            shutil.copyfileobj(heap, file)
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class SnapshotReader:
+    """
+    Reads records straight from a memory-mapped binary snapshot.
+
+    Opening a snapshot only parses its schema; records are decoded when they
+    are asked for, and lookups by id or by a sorted field are binary searches
+    over the mapped tables. Pages the operating system never touches are
+    never read from disk.
+
+    Args:
+        path (str): Path of a snapshot written by write_snapshot.
+
+    Attributes:
+        fields (list): Names of the stored fields.
+        sorted_fields (list): Sorted fields that find and iter_prefix can look up.
+        meta (dict): Extra values stored with the snapshot.
+
+    Methods:
+        id_at(position): Returns the id of the record at a table position.
+        position_of(record_id): Returns the table position of an id.
+        row(position, fields): Returns the record at a table position as a dictionary.
+        field(position, name): Returns one field of the record at a table position.
+        find(spec, value): Returns the ids of the records whose sorted field equals the value.
+        iter_prefix(spec, prefix): Lazily yields the records whose sorted field starts with a prefix.
+        ids(): Lazily yields all ids in ascending order.
+        iter_rows(fields): Lazily yields all records in ascending id order.
+        iter_field(name): Lazily yields one field of all records in ascending id order.
+        close(): Unmaps the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, schema_size = PREFIX.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a snapshot.")
+        schema = json.loads(self._map[PREFIX.size : PREFIX.size + schema_size])
+        self.fields = schema["fields"]
+        self.sorted_fields = schema["sorted_fields"]
+        self.meta = schema["meta"]
+        self._count = schema["count"]
+        self._list_fields = set(schema["list_fields"])
+        self._field_numbers = {name: number for number, name in enumerate(self.fields)}
+        self._entry = struct.Struct(ID.format + SPAN.format[1:] * len(self.fields))
+        self._table = PREFIX.size + schema_size
+        offset = self._table + self._count * self._entry.size
+        self._sorted = {}
+        position_size = array(POSITION_TYPE).itemsize
+        for spec in schema["sorted_fields"]:
+            self._sorted[spec] = offset
+            offset += self._count * position_size
+        self._position = struct.Struct("<" + POSITION_TYPE)
+        self._heap = offset
+
+    def __len__(self):
+        return self._count
+
+    def id_at(self, position):
+        """
+        Returns the id of the record at a table position.
+
+        Args:
+            position (int): Position in the id-ordered table.
+
+        Returns:
+            int: The id of the record.
+        """
+        return ID.unpack_from(self._map, self._table + position * self._entry.size)[0]
+
+    def position_of(self, record_id):
+        """
+        Returns the table position of an id.
+
+        Args:
+            record_id (int): The id to look up.
+
+        Returns:
+            int: The position, or None if the snapshot has no such record.
+        """
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.id_at(middle) < record_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self._count and self.id_at(low) == record_id:
+            return low
+        return None
+
+    def row(self, position, fields=None):
+        """
+        Returns the record at a table position as a dictionary.
+
+        Args:
+            position (int): Position in the id-ordered table.
+            fields (tuple, optional): Fields to decode. Defaults to all, the
+                others are left out.
+
+        Returns:
+            dict: The id and the fields of the record.
+        """
+        values = self._entry.unpack_from(
+            self._map, self._table + position * self._entry.size
+        )
+        row = {"id": values[0]}
+        size = self._entry.size
+        for name in fields or self.fields:
+            number = 1 + 2 * self._field_numbers[name]
+            row[name] = self._decode(name, values[number], values[number + 1])
+            if values[number + 1] != NONE_LENGTH:
+                size += values[number + 1]
+        metrics.add("bytes_read", size)
+        return row
+
+    def field(self, position, name):
+        """
+        Returns one field of the record at a table position.
+
+        Args:
+            position (int): Position in the id-ordered table.
+            name (str): Name of the field.
+
+        Returns:
+            The field value, or None if it is not set.
+        """
+        offset = (
+            self._table
+            + position * self._entry.size
+            + ID.size
+            + self._field_numbers[name] * SPAN.size
+        )
+        return self._decode(name, *SPAN.unpack_from(self._map, offset))
+
+    def find(self, spec, value):
+        """
+        Returns the ids of the records whose sorted field equals the value.
+
+        Args:
+            spec (str): A sorted field as given to write_snapshot, e.g. "name:casefold".
+            value (str): The value to look up, before the transform.
+
+        Returns:
+            list: Ids of the matching records in ascending order.
+        """
+        keys, key_of, position_at = self._sorted_keys(spec)
+        key = key_of(value)
+        ids = []
+        for index in range(bisect_left(keys, key), self._count):
+            if keys[index] != key:
+                break
+            ids.append(self.id_at(position_at(index)))
+        return ids
+
+    def iter_prefix(self, spec, prefix):
+        """
+        Lazily yields the records whose sorted field starts with a prefix.
+
+        Args:
+            spec (str): A sorted field as given to write_snapshot.
+            prefix (str): The prefix to look up, before the transform.
+
+        Yields:
+            tuple: The key and the id of each matching record, in key order.
+        """
+        keys, key_of, position_at = self._sorted_keys(spec)
+        prefix = key_of(prefix)
+        for index in range(bisect_left(keys, prefix), self._count):
+            key = keys[index]
+            if not key.startswith(prefix):
+                return
+            yield key, self.id_at(position_at(index))
+
+    def _sorted_keys(self, spec):
+        """
+        Returns the keys of a sorted field as a sequence for bisect, the
+        transform of the field and the function from key index to position.
+        """
+        name, _, transform = spec.partition(":")
+        key_of = KEY_TRANSFORMS[transform]
+        offset = self._sorted[spec]
+        position_at = lambda index: self._position.unpack_from(
+            self._map, offset + index * self._position.size
+        )[0]
+        keys = _MappedKeys(
+            lambda index: key_of(self.field(position_at(index), name) or ""),
+            self._count,
+        )
+        return keys, key_of, position_at
+
+    def ids(self):
+        """
+        Lazily yields all ids in ascending order.
+
+        Yields:
+            int: Ids of the stored records.
+        """
+        for position in range(self._count):
+            yield self.id_at(position)
+
+    def iter_rows(self, fields=None):
+        """
+        Lazily yields all records in ascending id order.
+
+        Args:
+            fields (tuple, optional): Fields to decode. Defaults to all.
+
+        Yields:
+            dict: The id and the fields of each record.
+        """
+        for position in range(self._count):
+            yield self.row(position, fields)
+
+    def iter_field(self, name):
+        """
+        Lazily yields one field of all records in ascending id order.
+
+        Args:
+            name (str): Name of the field.
+
+        Yields:
+            tuple: The id and the field value of each record.
+        """
+        for position in range(self._count):
+            yield self.id_at(position), self.field(position, name)
+
+    def close(self):
+        """
+        Unmaps the file.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def _decode(self, name, offset, length):
+        if length == NONE_LENGTH:
+            return None
+        start = self._heap + offset
+        value = self._map[start : start + length].decode("utf-8")
+        if name in self._list_fields:
+            return value.split(LIST_SEPARATOR) if value else []
+        return value
+
+
+class _MappedKeys:
+    """
+    Sequence view over sorted keys that are decoded on access, for bisect.
+    """
+
+    def __init__(self, key_at, count):
+        self._key_at = key_at
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return self._key_at(index)
+
+
+def merge_rows(reader, changes):
+    """
+    Lazily yields the snapshot rows with changes applied, in ascending id order.
+
+    Args:
+        reader (SnapshotReader): The snapshot, or None if there is none.
+        changes (dict): New record dictionaries by id, None for deleted ids.
+
+    Yields:
+        dict: Record dictionaries.
+    """
+    pending = sorted(changes)
+    index = 0
+    for position in range(len(reader) if reader else 0):
+        record_id = reader.id_at(position)
+        while index < len(pending) and pending[index] < record_id:
+            if changes[pending[index]] is not None:
+                yield changes[pending[index]]
+            index += 1
+        if index < len(pending) and pending[index] == record_id:
+            if changes[record_id] is not None:
+                yield changes[record_id]
+            index += 1
+            continue
+        yield reader.row(position)
+    for record_id in pending[index:]:
+        if changes[record_id] is not None:
+            yield changes[record_id]
+
+
+class LazyRecords(MutableMapping):
+    """
+    Mapping of ids to objects that are built from a snapshot only when accessed.
+
+    Objects read from the snapshot are not kept, so memory only grows with
+    the objects stored back since the snapshot was opened. Those shadow
+    their snapshot rows, and deletions hide them.
+
+    The reader may also be any object with the lookups of SnapshotReader,
+    such as the SQLiteReader of an SQLite storage.
+
+    Args:
+        reader (SnapshotReader): The snapshot to serve records from.
+        factory (callable): Builds an object from a record dictionary.
+        fields (tuple, optional): Fields the factory needs. Defaults to all.
+
+    Methods:
+        unchanged(ids): Filters snapshot ids down to those not changed or deleted since.
+        is_changed(key): Tells whether an object was stored since the snapshot was opened.
+        snapshot_values(): Lazily builds the objects whose snapshot rows are still current.
+        snapshot_field(name): Lazily yields one field of the snapshot rows that are still current.
+    """
+
+    def __init__(self, reader, factory, fields=None):
+        self.reader = reader
+        self.factory = factory
+        self.fields = fields
+        self._changed = {}
+        self._added = {}
+        self._shadowed = set()
+        self._count = len(reader)
+
+    def __getitem__(self, key):
+        if key in self._changed:
+            return self._changed[key]
+        if key in self._shadowed:
+            raise KeyError(key)
+        position = self.reader.position_of(key)
+        if position is None:
+            raise KeyError(key)
+        return self.factory(self.reader.row(position, self.fields))
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self._count += 1
+        if key not in self._added and key not in self._shadowed:
+            if self.reader.position_of(key) is None:
+                self._added[key] = None
+            else:
+                self._shadowed.add(key)
+        self._changed[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._count -= 1
+        self._changed.pop(key, None)
+        if key in self._added:
+            del self._added[key]
+        else:
+            self._shadowed.add(key)
+
+    def __contains__(self, key):
+        if key in self._changed:
+            return True
+        return key not in self._shadowed and self.reader.position_of(key) is not None
+
+    def __iter__(self):
+        for key in self.reader.ids():
+            if key not in self._shadowed or key in self._changed:
+                yield key
+        yield from list(self._added)
+
+    def __len__(self):
+        return self._count
+
+    def unchanged(self, ids):
+        """
+        Filters snapshot ids down to those not changed or deleted since.
+
+        Args:
+            ids (iterable): Ids found in the snapshot.
+
+        Returns:
+            set: The ids whose snapshot rows are still current.
+        """
+        return {key for key in ids if key not in self._shadowed}
+
+    def is_changed(self, key):
+        """
+        Tells whether an object was stored since the snapshot was opened.
+
+        Args:
+            key: The id of the object.
+
+        Returns:
+            bool: True if the object lives in memory.
+        """
+        return key in self._changed
+
+    def snapshot_values(self):
+        """
+        Lazily builds the objects whose snapshot rows are still current.
+
+        Yields:
+            Objects built by the factory, in id order.
+        """
+        for row in self.reader.iter_rows(self.fields):
+            if row["id"] not in self._shadowed:
+                yield self.factory(row)
+
+    def snapshot_field(self, name):
+        """
+        Lazily yields one field of the snapshot rows that are still current.
+
+        Only that field is decoded, so e.g. tags can be indexed without
+        reading any note text.
+
+        Args:
+            name (str): Name of the field.
+
+        Yields:
+            tuple: The id and the field value, in id order.
+        """
+        for key, value in self.reader.iter_field(name):
+            if key not in self._shadowed:
+                yield key, value
+
+
+class FieldCache:
+    """
+    LRU cache of one large field of snapshot records, bounded by memory.
+
+    Values are decoded from the snapshot on a miss and the least recently
+    used ones are dropped once their total size passes the budget. Lookups
+    may come from several threads.
+
+    Args:
+        reader (SnapshotReader): The snapshot to read values from.
+        name (str): Name of the field.
+        budget (int, optional): Memory in bytes the cached values may take.
+            Defaults to FIELD_CACHE_BYTES.
+
+    Methods:
+        get(key): Returns the field of a record, reading it on a miss.
+    """
+
+    def __init__(self, reader, name, budget=FIELD_CACHE_BYTES):
+        self.reader = reader
+        self.name = name
+        self.budget = budget
+        self._values = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        """
+        Returns the field of a record, reading it from the snapshot on a miss.
+
+        Args:
+            key (int): Id of the record.
+
+        Returns:
+            The field value, or None if it is not set.
+
+        Raises:
+            KeyError: If the snapshot has no record with the id.
+        """
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                metrics.add(f"{self.name}_cache_hits", 1)
+                return self._values[key]
+        position = self.reader.position_of(key)
+        if position is None:
+            raise KeyError(key)
+        value = self.reader.field(position, self.name)
+        metrics.add(f"{self.name}_cache_misses", 1)
+        size = sys.getsizeof(value)
+        if size > self.budget:
+            return value
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = value
+                self._size += size
+                while self._size > self.budget:
+                    _, dropped = self._values.popitem(last=False)
+                    self._size -= sys.getsizeof(dropped)
+        return value
+
+
+class SnapshotStorage(JournalStorage):
+    """
+    Stores records as a memory-mapped binary snapshot plus an append-only journal.
+
+    Changes go to the journal exactly like in JournalStorage, and compaction
+    streams the old snapshot and the journal into a new one. The owner opens
+    the snapshot with open_snapshot() and reads records from it on demand, so
+    startup does not depend on the number of records.
+
+    Args:
+        snapshot_path (str): Path of the binary snapshot.
+        fields (tuple): Names of the stored fields.
+        list_fields (tuple, optional): Fields whose values are lists of strings.
+        sorted_fields (tuple, optional): Fields to build sorted lookups for.
+        seed_path (str, optional): JSON snapshot to convert when there is no
+            binary one yet.
+        compact_threshold (int, optional): Journal size that triggers compaction.
+
+    Methods:
+        open_snapshot(): Maps the snapshot and returns it with the journaled changes.
+    """
+
+    lazy = True
+
+    def __init__(
+        self,
+        snapshot_path,
+        fields,
+        list_fields=(),
+        sorted_fields=(),
+        seed_path=None,
+        compact_threshold=JOURNAL_COMPACT_THRESHOLD,
+    ):
+        super().__init__(snapshot_path, compact_threshold=compact_threshold)
+        self.fields = tuple(fields)
+        self.list_fields = tuple(list_fields)
+        self.sorted_fields = tuple(sorted_fields)
+        self.seed_path = seed_path
+
+    def open_snapshot(self):
+        """
+        Maps the snapshot and returns it with the changes journaled since.
+
+        A JSON snapshot given as seed_path is converted on first use.
+
+        Returns:
+            tuple: A SnapshotReader and a dictionary of changed records by id,
+                with None for deleted ids.
+
+        Raises:
+            FileNotFoundError: If there is neither a snapshot nor a journal.
+        """
+        if not self._exists() and self.seed_path and os.path.exists(self.seed_path):
+            seed = JournalStorage(self.seed_path)
+            records = seed.load()
+            self._seen(seed.last_id())
+            self._write_snapshot(records)
+        if not self._exists():
+            raise FileNotFoundError(self.snapshot_path)
+        if not os.path.exists(self.snapshot_path):
+            self._write_snapshot([])
+        reader = SnapshotReader(self.snapshot_path)
+        self._seen_snapshot(reader)
+        changes = {}
+        self._replay_journals(changes, tombstones=True)
+        return reader, changes
+
+    def _compact(self):
+        with metrics.timed(f"{self._name} compact"):
+            changes = {}
+            self._replay(self._rotated_path, changes, tombstones=True)
+            reader = None
+            if os.path.exists(self.snapshot_path):
+                reader = SnapshotReader(self.snapshot_path)
+                self._seen_snapshot(reader)
+            try:
+                self._write_rows(merge_rows(reader, changes))
+            finally:
+                if reader:
+                    reader.close()
+            os.remove(self._rotated_path)
+
+    def _seen_snapshot(self, reader):
+        """
+        Takes the highest id over from the meta and the last record of a snapshot.
+        """
+        self._seen(reader.meta.get("last_id", 0))
+        if len(reader):
+            self._seen(reader.id_at(len(reader) - 1))
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        reader = SnapshotReader(self.snapshot_path)
+        try:
+            self._seen_snapshot(reader)
+            return {row["id"]: row for row in map(reader.row, range(len(reader)))}
+        finally:
+            reader.close()
+
+    def _write_snapshot(self, records):
+        for data in records:
+            self._seen(data["id"])
+        self._write_rows(sorted(records, key=lambda data: data["id"]))
+
+    def _write_rows(self, rows):
+        write_snapshot(
+            self.snapshot_path,
+            rows,
+            self.fields,
+            self.list_fields,
+            self.sorted_fields,
+            meta={"last_id": self._last_id},
+        )
+        metrics.add("bytes_written", os.path.getsize(self.snapshot_path))
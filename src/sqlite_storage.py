@@ -0,0 +1,521 @@
+from abc import ABC, abstractmethod
+import os
+import sqlite3
+import sys
+import threading
+
+from src.metrics import metrics
+from src.snapshot import KEY_TRANSFORMS
+from src.storage import JournalStorage, StorageBackend
+
+
+DATABASE_FILE_PATH = "neoneo.db"
+READ_BATCH_ROWS = 1000
+
+
+class SQLiteStorage(StorageBackend, ABC):
+    """
+    Base class of the storages that keep records in an SQLite database.
+
+    The database runs in WAL mode, and every change is one short transaction
+    that only touches the affected rows. All statements are constant SQL
+    with parameters, so sqlite3 prepares each of them once and reuses it
+    from its statement cache. Commits are not synced one by one; sync()
+    checkpoints the log into the database file, which syncs both.
+
+    The storage is lazy: the owner opens it with open_snapshot() and reads
+    records through an SQLiteReader, whose lookups are answered by the
+    secondary indexes of the tables instead of loading every row.
+
+    The highest id of every table is kept in the meta table when records are
+    deleted, so ids are not reused. A table that was never written is filled
+    once from the JSON file given as seed_path.
+
+    Subclasses set SCHEMA, FIELDS and SORTED and implement _write and _select.
+
+    Args:
+        path (str, optional): Path of the database file.
+        seed_path (str, optional): JSON file to import into a new table.
+
+    Attributes:
+        path (str): Path of the database file.
+        seed_path (str): JSON file to import into a new table, or None.
+
+    Methods:
+        open_snapshot(): Opens a reader on the table and returns it with no pending changes.
+    """
+
+    lazy = True
+    SCHEMA = ""
+    TABLE = ""
+    FIELDS = ()
+    SORTED = {}
+    META_SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path=DATABASE_FILE_PATH, seed_path=None):
+        self.path = path
+        self.seed_path = seed_path
+        self._connection = None
+        self._readers = []
+        self._name = f"{os.path.basename(path)}:{self.TABLE}"
+
+    @property
+    def connection(self):
+        """
+        Opens the database on first use, creates the schema and imports the seed.
+        """
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(self.META_SCHEMA + self.SCHEMA)
+            self._seed()
+        return self._connection
+
+    def load(self):
+        records = self._select(self.connection)
+        metrics.add("rows_read", len(records))
+        return records
+
+    def open_snapshot(self):
+        """
+        Opens a reader on the table and returns it with no pending changes.
+
+        Every change is written to the table right away, so there is nothing
+        to replay on top of it.
+
+        Returns:
+            tuple: An SQLiteReader and an empty dictionary of changed records.
+        """
+        reader = SQLiteReader(self)
+        self._readers.append(reader)
+        return reader, {}
+
+    def put(self, data):
+        with self.connection:
+            self._write(data)
+        metrics.add("rows_written", 1)
+
+    def put_many(self, records):
+        with self.connection:
+            for data in records:
+                self._write(data)
+        metrics.add("rows_written", len(records))
+
+    def delete(self, key):
+        with self.connection:
+            self._remember_id(key)
+            self.connection.execute(f"DELETE FROM {self.TABLE} WHERE id = ?", (key,))
+        metrics.add("rows_written", 1)
+
+    def apply(self, changes):
+        with metrics.timed(f"{self._name} apply"), self.connection:
+            for key, data in changes:
+                if data is None:
+                    self._remember_id(key)
+                    self.connection.execute(
+                        f"DELETE FROM {self.TABLE} WHERE id = ?", (key,)
+                    )
+                else:
+                    self._write(data)
+        metrics.add("rows_written", len(changes))
+
+    def save(self, records):
+        with metrics.timed(f"{self._name} save"), self.connection:
+            self._remember_id(
+                self.connection.execute(f"SELECT max(id) FROM {self.TABLE}").fetchone()[
+                    0
+                ]
+            )
+            self.connection.execute(f"DELETE FROM {self.TABLE}")
+            for data in records:
+                self._write(data)
+        metrics.add("rows_written", len(records))
+
+    def last_id(self):
+        row = self.connection.execute(
+            f"SELECT max(coalesce((SELECT last_id FROM meta WHERE name = ?), 0),"
+            f" coalesce((SELECT max(id) FROM {self.TABLE}), 0))",
+            (self.TABLE,),
+        ).fetchone()
+        return row[0]
+
+    def sync(self):
+        """
+        Checkpoints the log into the database file, syncing both to disk.
+
+        Raises:
+            sqlite3.OperationalError: If a reader kept the checkpoint from finishing.
+        """
+        with metrics.timed(f"{self._name} sync"):
+            busy, _, _ = self.connection.execute(
+                "PRAGMA wal_checkpoint(FULL)"
+            ).fetchone()
+        if busy:
+            raise sqlite3.OperationalError(f"{self.path} is busy, not synced.")
+
+    def close(self):
+        for reader in self._readers:
+            reader.close()
+        self._readers = []
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _seed(self):
+        """
+        Imports the seed file into the table if nothing was ever written to it.
+
+        The meta table then holds the highest id of the table, so the seed is
+        imported only once, even if every record is deleted afterwards.
+        """
+        if not self.seed_path or not os.path.exists(self.seed_path):
+            return
+        (written,) = self._connection.execute(
+            "SELECT EXISTS (SELECT 1 FROM meta WHERE name = ?)"
+            f" OR EXISTS (SELECT 1 FROM {self.TABLE})",
+            (self.TABLE,),
+        ).fetchone()
+        if written:
+            return
+        seed = JournalStorage(self.seed_path)
+        records = seed.load()
+        with metrics.timed(f"{self._name} seed"), self._connection:
+            for data in records:
+                self._write(data)
+            self._remember_id(seed.last_id())
+        metrics.add("rows_written", len(records))
+
+    def _remember_id(self, key):
+        """
+        Raises the highest id of the table kept in the meta table to key.
+        """
+        if key is None:
+            return
+        self.connection.execute(
+            "INSERT INTO meta (name, last_id) VALUES (?, ?)"
+            " ON CONFLICT (name) DO UPDATE SET last_id = max(last_id, excluded.last_id)",
+            (self.TABLE, key),
+        )
+
+    @abstractmethod
+    def _write(self, data):
+        """
+        Inserts or replaces one record inside the running transaction.
+        """
+
+    @abstractmethod
+    def _select(self, connection, condition="1", params=(), fields=None, limit=-1):
+        """
+        Returns the records matching a condition as dictionaries, ordered by id.
+
+        Args:
+            connection (sqlite3.Connection): Connection to read with.
+            condition (str, optional): SQL condition on the table. Defaults to all rows.
+            params (tuple, optional): Parameters of the condition.
+            fields (tuple, optional): Fields to read. Defaults to FIELDS.
+            limit (int, optional): Most rows to return, -1 for all.
+        """
+
+
+class SQLiteReader:
+    """
+    Reads records of an SQLite storage with the lookups of SnapshotReader.
+
+    Positions are the ids themselves. find and iter_prefix run on the
+    secondary index of the field, and full scans are read in batches of
+    READ_BATCH_ROWS rows, so no statement is left open between calls.
+
+    The reader serves the rows with ids up to the highest one when it was
+    opened. Records added later are held in memory by their owner, which
+    also hides changed and deleted ones, so a row is never served twice.
+
+    Args:
+        storage (SQLiteStorage): The storage to read from.
+
+    Attributes:
+        fields (tuple): Names of the stored fields.
+        sorted_fields (tuple): Fields that find and iter_prefix can look up.
+        meta (dict): Extra values, the highest id as "last_id".
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.fields = storage.FIELDS
+        self.sorted_fields = tuple(storage.SORTED)
+        self.meta = {"last_id": storage.last_id()}
+        self._connection = sqlite3.connect(storage.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        (self._count,) = self._query(
+            f"SELECT count(*) FROM {storage.TABLE} WHERE id <= ?",
+            (self.meta["last_id"],),
+        )[0]
+
+    def __len__(self):
+        return self._count
+
+    def position_of(self, record_id):
+        """
+        Returns the id if the reader serves a record with it, else None.
+        """
+        rows = self._query(
+            f"SELECT id FROM {self._storage.TABLE} WHERE id = ? AND id <= ?",
+            (record_id, self.meta["last_id"]),
+        )
+        return rows[0][0] if rows else None
+
+    def row(self, position, fields=None):
+        """
+        Returns the record with an id as a dictionary, or None if there is none.
+        """
+        rows = self._select(
+            "id = ? AND id <= ?", (position, self.meta["last_id"]), fields
+        )
+        metrics.add("rows_read", len(rows))
+        return rows[0] if rows else None
+
+    def field(self, position, name):
+        """
+        Returns one field of the record with an id.
+        """
+        row = self.row(position, (name,))
+        return row and row[name]
+
+    def find(self, spec, value):
+        """
+        Returns the ids of the records whose sorted field equals the value.
+
+        Args:
+            spec (str): A key of SORTED, e.g. "name:casefold".
+            value (str): The value to look up, before the transform.
+
+        Returns:
+            list: Ids of the matching records in ascending order.
+        """
+        table, column, key = self._storage.SORTED[spec]
+        key_of = KEY_TRANSFORMS[spec.partition(":")[2]]
+        rows = self._query(
+            f"SELECT {key} FROM {table} WHERE {column} = ? AND {key} <= ?"
+            f" ORDER BY {key}",
+            (key_of(value), self.meta["last_id"]),
+        )
+        metrics.add("rows_read", len(rows))
+        return [record_id for (record_id,) in rows]
+
+    def iter_prefix(self, spec, prefix):
+        """
+        Lazily yields the records whose sorted field starts with a prefix.
+
+        Args:
+            spec (str): A key of SORTED.
+            prefix (str): The prefix to look up, before the transform.
+
+        Yields:
+            tuple: The key and the id of each matching record, in key order.
+        """
+        table, column, key = self._storage.SORTED[spec]
+        prefix = KEY_TRANSFORMS[spec.partition(":")[2]](prefix)
+        end = prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else chr(sys.maxunicode)
+        start = (prefix, -1)
+        while True:
+            rows = self._query(
+                f"SELECT {column}, {key} FROM {table}"
+                f" WHERE ({column}, {key}) > (?, ?) AND {column} < ? AND {key} <= ?"
+                f" ORDER BY {column}, {key} LIMIT ?",
+                (*start, end, self.meta["last_id"], READ_BATCH_ROWS),
+            )
+            metrics.add("rows_read", len(rows))
+            yield from rows
+            if len(rows) < READ_BATCH_ROWS:
+                return
+            start = rows[-1]
+
+    def ids(self):
+        """
+        Lazily yields all ids in ascending order.
+        """
+        for row in self.iter_rows(()):
+            yield row["id"]
+
+    def iter_rows(self, fields=None):
+        """
+        Lazily yields all records in ascending id order.
+
+        Args:
+            fields (tuple, optional): Fields to read. Defaults to all.
+
+        Yields:
+            dict: The id and the fields of each record.
+        """
+        last = 0
+        while True:
+            rows = self._select(
+                "id > ? AND id <= ?",
+                (last, self.meta["last_id"]),
+                fields,
+                READ_BATCH_ROWS,
+            )
+            metrics.add("rows_read", len(rows))
+            yield from rows
+            if len(rows) < READ_BATCH_ROWS:
+                return
+            last = rows[-1]["id"]
+
+    def iter_field(self, name):
+        """
+        Lazily yields one field of all records in ascending id order.
+
+        Yields:
+            tuple: The id and the field value of each record.
+        """
+        for row in self.iter_rows((name,)):
+            yield row["id"], row[name]
+
+    def close(self):
+        """
+        Closes the connection of the reader.
+        """
+        self._connection.close()
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def _select(self, condition, params, fields=None, limit=-1):
+        with self._lock:
+            return self._storage._select(
+                self._connection, condition, params, fields, limit
+            )
+
+
+class SQLiteContactStorage(SQLiteStorage):
+    """
+    Keeps address book records in the contacts table.
+
+    The name is also stored casefolded, for lookups that ignore case, and
+    the birthday as month and day columns, so that the index on them can
+    answer calendar queries.
+    """
+
+    TABLE = "contacts"
+    FIELDS = ("name", "phone", "birthday", "email", "address")
+    SORTED = {
+        "name": ("contacts", "name", "id"),
+        "name:casefold": ("contacts", "folded_name", "id"),
+        "phone": ("contacts", "phone", "id"),
+        "email": ("contacts", "email", "id"),
+    }
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS contacts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            phone TEXT,
+            birthday TEXT,
+            email TEXT,
+            address TEXT,
+            folded_name TEXT NOT NULL,
+            birthday_month INTEGER,
+            birthday_day INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS contacts_name ON contacts (name);
+        CREATE INDEX IF NOT EXISTS contacts_folded_name ON contacts (folded_name);
+        CREATE INDEX IF NOT EXISTS contacts_phone ON contacts (phone);
+        CREATE INDEX IF NOT EXISTS contacts_email ON contacts (email);
+        CREATE INDEX IF NOT EXISTS contacts_birthday
+            ON contacts (birthday_month, birthday_day);
+    """
+
+    def _write(self, data):
+        day = month = None
+        if data.get("birthday"):
+            day, month = (int(part) for part in data["birthday"].split(".")[:2])
+        self.connection.execute(
+            "INSERT OR REPLACE INTO contacts (id, name, phone, birthday, email, address,"
+            " folded_name, birthday_month, birthday_day)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                data["id"],
+                data["name"],
+                data.get("phone"),
+                data.get("birthday"),
+                data.get("email"),
+                data.get("address"),
+                data["name"].casefold(),
+                month,
+                day,
+            ),
+        )
+
+    def _select(self, connection, condition="1", params=(), fields=None, limit=-1):
+        names = ("id",) + tuple(fields if fields is not None else self.FIELDS)
+        rows = connection.execute(
+            f"SELECT {', '.join(names)} FROM contacts WHERE {condition}"
+            " ORDER BY id LIMIT ?",
+            (*params, limit),
+        )
+        return [dict(zip(names, row)) for row in rows]
+
+
+class SQLiteNoteStorage(SQLiteStorage):
+    """
+    Keeps notes in the notes table and their tags in the note_tags table.
+    """
+
+    TABLE = "notes"
+    FIELDS = ("text", "tags", "creation_date")
+    SORTED = {"tags": ("note_tags", "tag", "note_id")}
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER PRIMARY KEY,
+            text TEXT NOT NULL,
+            creation_date TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS note_tags (
+            note_id INTEGER NOT NULL REFERENCES notes (id) ON DELETE CASCADE,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (note_id, tag)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS note_tags_tag ON note_tags (tag, note_id);
+        CREATE INDEX IF NOT EXISTS notes_creation_date ON notes (creation_date);
+    """
+
+    def _write(self, data):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO notes (id, text, creation_date) VALUES (?, ?, ?)",
+            (data["id"], data["text"], data["creation_date"]),
+        )
+        self.connection.execute(
+            "DELETE FROM note_tags WHERE note_id = ?", (data["id"],)
+        )
+        self.connection.executemany(
+            "INSERT INTO note_tags (note_id, tag) VALUES (?, ?)",
+            [(data["id"], tag) for tag in data["tags"]],
+        )
+
+    def _select(self, connection, condition="1", params=(), fields=None, limit=-1):
+        fields = tuple(fields if fields is not None else self.FIELDS)
+        names = ("id",) + tuple(name for name in fields if name != "tags")
+        rows = [
+            dict(zip(names, row))
+            for row in connection.execute(
+                f"SELECT {', '.join(names)} FROM notes WHERE {condition}"
+                " ORDER BY id LIMIT ?",
+                (*params, limit),
+            )
+        ]
+        if "tags" in fields and rows:
+            tags = {}
+            for note_id, tag in connection.execute(
+                "SELECT note_id, tag FROM note_tags WHERE note_id BETWEEN ? AND ?",
+                (rows[0]["id"], rows[-1]["id"]),
+            ):
+                tags.setdefault(note_id, []).append(tag)
+            for row in rows:
+                row["tags"] = tags.get(row["id"], [])
+        return rows
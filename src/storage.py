@@ -0,0 +1,553 @@
+import json
+import os
+import sys
+import threading
+from time import monotonic
+
+from src.metrics import metrics
+
+
+red, reset = "\033[91m", "\033[0m"
+
+JOURNAL_COMPACT_THRESHOLD = 1024 * 1024
+AUTOSAVE_DELAY = 0.5
+
+
+class StorageBackend:
+    """
+    Interface of the storages behind AddressBook and Notebook.
+
+    A storage keeps record dictionaries (as produced by Record.record_to_dict
+    and Note.to_dict) identified by their "id". The owner holds the records in
+    memory and reports every change, so a storage only writes what changed.
+
+    Attributes:
+        lazy (bool): Whether the storage can serve records straight from a
+            snapshot through open_snapshot() instead of load().
+
+    Methods:
+        load(): Returns all stored records.
+        put(data): Stores a new or changed record.
+        put_many(records): Stores many new or changed records at once.
+        delete(key): Deletes a record.
+        apply(changes): Stores and deletes many records as one atomic change.
+        save(records): Replaces everything stored with the given records.
+        last_id(): Returns the highest id ever stored, deleted records included.
+        sync(): Forces the written changes to disk.
+        close(): Flushes pending changes and releases the storage.
+    """
+
+    lazy = False
+
+    def load(self):
+        """
+        Returns all stored records.
+
+        Returns:
+            list: Record dictionaries.
+
+        Raises:
+            FileNotFoundError: If nothing was stored yet.
+        """
+        raise NotImplementedError
+
+    def put(self, data):
+        """
+        Stores a new or changed record.
+
+        Args:
+            data (dict): The full record.
+        """
+        raise NotImplementedError
+
+    def put_many(self, records):
+        """
+        Stores many new or changed records at once.
+
+        Args:
+            records (list): The full records.
+        """
+        for data in records:
+            self.put(data)
+
+    def delete(self, key):
+        """
+        Deletes a record.
+
+        Args:
+            key: The key of the record.
+        """
+        raise NotImplementedError
+
+    def apply(self, changes):
+        """
+        Stores and deletes many records as one atomic change.
+
+        Args:
+            changes (list): Pairs of a key and the full record, or None to delete it.
+        """
+        for key, data in changes:
+            if data is None:
+                self.delete(key)
+            else:
+                self.put(data)
+
+    def save(self, records):
+        """
+        Replaces everything stored with the given records.
+
+        Args:
+            records (list): All record dictionaries.
+        """
+        raise NotImplementedError
+
+    def last_id(self):
+        """
+        Returns the highest id ever stored, deleted records included.
+
+        Owners start numbering new records after it, so an id is never
+        handed out twice, not even after its record was deleted.
+
+        Returns:
+            int: The id, or 0 if nothing was stored yet.
+        """
+        return 0
+
+    def sync(self):
+        """
+        Forces the written changes to disk, so they survive a power loss.
+        """
+
+    def close(self):
+        """
+        Flushes pending changes and releases the storage.
+        """
+
+
+class JournalStorage(StorageBackend):
+    """
+    Stores a collection of records as a JSON snapshot plus an append-only journal.
+
+    Every change is appended to the journal as one compact JSON line, so a
+    single edit costs O(size of the record) instead of rewriting the whole
+    document. Once the journal grows past the threshold it is rotated and
+    merged into the snapshot by a background thread. On startup the snapshot
+    is replayed together with any journal files that are left.
+
+    The highest id ever stored is kept in a small JSON file next to the
+    snapshot, since deleted ids are gone from the snapshot itself.
+
+    Attributes:
+        snapshot_path (str): Path of the JSON snapshot.
+        journal_path (str): Path of the live journal.
+        meta_path (str): Path of the file with the highest id.
+        key (str): Name of the field that identifies a record.
+        compact_threshold (int): Journal size in bytes that triggers compaction.
+
+    Methods:
+        load(): Returns all records from the snapshot and the journal.
+        put(data): Appends a new or changed record to the journal.
+        put_many(records): Appends many records to the journal in one write.
+        delete(key): Appends a deletion to the journal.
+        apply(changes): Appends many changes to the journal as one batch line.
+        save(records): Writes a full snapshot and drops the journal.
+        last_id(): Returns the highest id ever stored.
+        compact(): Starts merging the journal into the snapshot in the background.
+        sync(): Fsyncs the journal.
+        close(): Flushes the journal and waits for a running compaction.
+    """
+
+    def __init__(
+        self, snapshot_path, key="id", compact_threshold=JOURNAL_COMPACT_THRESHOLD
+    ):
+        self.snapshot_path = snapshot_path
+        self.journal_path = f"{snapshot_path}.journal"
+        self.meta_path = f"{snapshot_path}.meta"
+        self.key = key
+        self.compact_threshold = compact_threshold
+        self._rotated_path = f"{snapshot_path}.journal.old"
+        self._name = os.path.basename(snapshot_path)
+        self._journal = None
+        self._compactor = None
+        self._last_id = 0
+
+    def load(self):
+        """
+        Returns all records from the snapshot with both journals replayed on top.
+
+        Returns:
+            list: Record dictionaries in snapshot order.
+
+        Raises:
+            FileNotFoundError: If there is neither a snapshot nor a journal.
+        """
+        if not self._exists():
+            raise FileNotFoundError(self.snapshot_path)
+
+        self._read_meta()
+        records = self._read_snapshot()
+        self._replay_journals(records)
+        return list(records.values())
+
+    def put(self, data):
+        """
+        Appends a new or changed record to the journal.
+
+        Args:
+            data (dict): The full record.
+        """
+        self._seen(data[self.key])
+        self._append({"op": "put", "data": data})
+
+    def put_many(self, records):
+        """
+        Appends many new or changed records to the journal in one write.
+
+        Args:
+            records (list): The full records.
+        """
+        for data in records:
+            self._seen(data[self.key])
+        self._append(*({"op": "put", "data": data} for data in records))
+
+    def delete(self, key):
+        """
+        Appends the deletion of a record to the journal.
+
+        Args:
+            key: The key of the deleted record.
+        """
+        self._seen(key)
+        self._append({"op": "delete", "key": key})
+
+    def apply(self, changes):
+        """
+        Appends many changes to the journal as a single batch line.
+
+        A batch torn by a crash is dropped as a whole on replay, so either
+        all of its changes survive or none.
+
+        Args:
+            changes (list): Pairs of a key and the full record, or None to delete it.
+        """
+        for key, _ in changes:
+            self._seen(key)
+        with metrics.timed(f"{self._name} apply"):
+            self._append(
+                {
+                    "op": "batch",
+                    "entries": [
+                        {"op": "delete", "key": key}
+                        if data is None
+                        else {"op": "put", "data": data}
+                        for key, data in changes
+                    ],
+                }
+            )
+
+    def save(self, records):
+        """
+        Writes a full snapshot and drops the journal.
+
+        Args:
+            records (list): All record dictionaries.
+        """
+        with metrics.timed(f"{self._name} save"):
+            self.close()
+            self._write_snapshot(records)
+            for path in (self._rotated_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def last_id(self):
+        """
+        Returns the highest id ever stored, deleted records included.
+
+        It is known once the storage was loaded or written.
+
+        Returns:
+            int: The id, or 0 if nothing was stored yet.
+        """
+        return self._last_id
+
+    def compact(self):
+        """
+        Rotates the journal and merges it into the snapshot in a background thread.
+
+        Does nothing if a compaction is already running.
+        """
+        if self._compactor and self._compactor.is_alive():
+            return
+        if not os.path.exists(self._rotated_path):
+            if not os.path.exists(self.journal_path):
+                return
+            self.sync()
+            self._close_journal()
+            os.replace(self.journal_path, self._rotated_path)
+        self._compactor = threading.Thread(
+            target=self._compact, name="journal-compactor"
+        )
+        self._compactor.start()
+
+    def sync(self):
+        """
+        Fsyncs the journal, so the appended changes survive a power loss.
+        """
+        if self._journal is not None:
+            os.fsync(self._journal.fileno())
+
+    def close(self):
+        """
+        Flushes and closes the journal and waits for a running compaction.
+        """
+        self._close_journal()
+        if self._compactor:
+            self._compactor.join()
+            self._compactor = None
+
+    def _append(self, *entries):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        text = "".join(
+            json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries
+        )
+        self._journal.write(text)
+        self._journal.flush()
+        metrics.add("bytes_written", len(text.encode("utf-8")))
+        if self._journal.tell() > self.compact_threshold:
+            self.compact()
+
+    def _seen(self, key):
+        if key > self._last_id:
+            self._last_id = key
+
+    def _read_meta(self):
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as file:
+                self._seen(json.load(file)["last_id"])
+
+    def _write_meta(self):
+        temp_path = f"{self.meta_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"last_id": self._last_id}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.meta_path)
+
+    def _exists(self):
+        return any(
+            os.path.exists(path)
+            for path in (self.snapshot_path, self._rotated_path, self.journal_path)
+        )
+
+    def _replay_journals(self, records, tombstones=False):
+        """
+        Replays the rotated and the live journal and cuts a torn tail off the live one.
+        """
+        self._replay(self._rotated_path, records, tombstones)
+        valid_size = self._replay(self.journal_path, records, tombstones)
+        if os.path.exists(self.journal_path):
+            if valid_size < os.path.getsize(self.journal_path):
+                with open(self.journal_path, "r+b") as journal:
+                    journal.truncate(valid_size)
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _compact(self):
+        with metrics.timed(f"{self._name} compact"):
+            records = self._read_snapshot()
+            self._replay(self._rotated_path, records)
+            self._write_snapshot(list(records.values()))
+            os.remove(self._rotated_path)
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return {}
+        metrics.add("bytes_read", os.path.getsize(self.snapshot_path))
+        with open(self.snapshot_path, "r", encoding="utf-8") as file:
+            records = {data[self.key]: data for data in json.load(file)}
+        if records:
+            self._seen(max(records))
+        return records
+
+    def _write_snapshot(self, records):
+        for data in records:
+            self._seen(data[self.key])
+        self._write_meta()
+        temp_path = f"{self.snapshot_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(records, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        metrics.add("bytes_written", os.path.getsize(temp_path))
+        os.replace(temp_path, self.snapshot_path)
+
+    def _replay(self, path, records, tombstones=False):
+        """
+        Applies journal entries to the records and returns the size of the valid part.
+
+        A torn line left by a crash ends the replay. With tombstones, deleted
+        keys are kept with a None value instead of being removed.
+        """
+        if not os.path.exists(path):
+            return 0
+        valid_size = 0
+        with open(path, "rb") as journal:
+            for line in journal:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                for change in entry.get("entries", (entry,)):
+                    if change["op"] == "put":
+                        key = change["data"][self.key]
+                        records[key] = change["data"]
+                    elif tombstones:
+                        key = change["key"]
+                        records[key] = None
+                    else:
+                        key = change["key"]
+                        records.pop(key, None)
+                    self._seen(key)
+                valid_size += len(line)
+        metrics.add("bytes_read", valid_size)
+        return valid_size
+
+
+class WriteBehindStorage(StorageBackend):
+    """
+    Writes the changes to another storage from a background thread.
+
+    put, delete and apply only note the change in memory and wake the
+    writer, so a command returns without touching the disk. The writer waits
+    for the delay after the first pending change, then writes all changes
+    collected in the meantime as one apply() of the wrapped storage and syncs
+    it to disk. A record changed several times in a burst is written once,
+    and since a batch is atomic a crash loses at most the last delay of
+    changes without leaving a half-written transaction behind.
+
+    Args:
+        storage (StorageBackend): The storage to write to.
+        delay (float, optional): Seconds changes are collected before they are
+            written. Defaults to AUTOSAVE_DELAY.
+
+    Methods:
+        flush(): Writes the pending changes now.
+        close(): Writes the pending changes, stops the writer and closes the storage.
+    """
+
+    def __init__(self, storage, delay=AUTOSAVE_DELAY):
+        self.storage = storage
+        self.delay = delay
+        self.lazy = storage.lazy
+        self.key = getattr(storage, "key", "id")
+        self._pending = {}
+        self._last_id = 0
+        self._changed = threading.Condition()
+        self._writing = threading.Lock()
+        self._writer = None
+        self._stopping = False
+
+    def load(self):
+        return self.storage.load()
+
+    def open_snapshot(self):
+        return self.storage.open_snapshot()
+
+    def put(self, data):
+        self._note([(data[self.key], data)])
+
+    def put_many(self, records):
+        self._note([(data[self.key], data) for data in records])
+
+    def delete(self, key):
+        self._note([(key, None)])
+
+    def apply(self, changes):
+        self._note(changes)
+
+    def save(self, records):
+        """
+        Drops the pending changes and replaces everything stored right away.
+        """
+        with self._writing:
+            with self._changed:
+                self._pending = {}
+            self.storage.save(records)
+
+    def last_id(self):
+        return max(self.storage.last_id(), self._last_id)
+
+    def sync(self):
+        self.flush()
+
+    def flush(self):
+        """
+        Writes the pending changes as one batch and syncs the storage.
+
+        Changes that could not be written stay pending and are retried.
+        """
+        with self._writing:
+            with self._changed:
+                changes, self._pending = self._pending, {}
+            if not changes:
+                return
+            try:
+                with metrics.timed("autosave"):
+                    self.storage.apply(list(changes.items()))
+                    self.storage.sync()
+            except BaseException:
+                with self._changed:
+                    changes.update(self._pending)
+                    self._pending = changes
+                raise
+
+    def close(self):
+        """
+        Writes the pending changes, stops the writer and closes the storage.
+        """
+        if self._writer is not None:
+            with self._changed:
+                self._stopping = True
+                self._changed.notify()
+            self._writer.join()
+            self._writer = None
+            self._stopping = False
+        self.flush()
+        self.storage.close()
+
+    def _note(self, changes):
+        with self._changed:
+            for key, data in changes:
+                self._pending[key] = data
+                if key > self._last_id:
+                    self._last_id = key
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_behind, name="autosave", daemon=True
+                )
+                self._writer.start()
+            self._changed.notify()
+
+    def _write_behind(self):
+        """
+        Writes the pending changes once per delay until the storage is closed.
+        """
+        while True:
+            with self._changed:
+                while not self._pending and not self._stopping:
+                    self._changed.wait()
+                deadline = monotonic() + self.delay
+                while not self._stopping and monotonic() < deadline:
+                    self._changed.wait(deadline - monotonic())
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception as error:
+                print(f"{red}Could not save changes: {error}{reset}", file=sys.stderr)
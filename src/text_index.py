@@ -0,0 +1,235 @@
+from bisect import bisect_left
+import heapq
+import math
+import re
+import unicodedata
+
+from src.metrics import metrics
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+QUERY_PATTERN = re.compile(r'"([^"]*)"?|(\S+)')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """
+    Splits a text into normalized terms.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        list: Case-folded NFKC-normalized terms in text order.
+    """
+    return TOKEN_PATTERN.findall(unicodedata.normalize("NFKC", text).casefold())
+
+
+def parse_query(query):
+    """
+    Parses a search query into terms, prefixes and phrases.
+
+    A word ending with '*' is a prefix, words in double quotes are a phrase.
+
+    Args:
+        query (str): The query typed by the user.
+
+    Returns:
+        list: Tuples (kind, terms) where kind is "term", "prefix" or "phrase".
+    """
+    parts = []
+    for phrase, word in QUERY_PATTERN.findall(query):
+        if phrase:
+            terms = tokenize(phrase)
+            if len(terms) > 1:
+                parts.append(("phrase", terms))
+            elif terms:
+                parts.append(("term", terms))
+        elif word.endswith("*"):
+            parts.extend(("prefix", [term]) for term in tokenize(word[:-1]))
+        else:
+            parts.extend(("term", [term]) for term in tokenize(word))
+    return parts
+
+
+class TextIndex:
+    """
+    Full-text inverted index with positional postings and BM25 ranking.
+
+    Every part of a query must match a document: plain terms, prefixes
+    ("bon*") and phrases ('"james bond"'). Matching documents are ranked with
+    BM25.
+
+    Methods:
+        add(doc_id, text): Indexes the text of a document.
+        remove(doc_id, text): Removes a document indexed with the given text.
+        search(query, limit, candidates): Returns the best matching document ids.
+        merge(): Sorts the terms added since into the vocabulary.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._terms = []
+        self._new_terms = []
+        self._lengths = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, doc_id, text):
+        """
+        Indexes the text of a document.
+
+        Args:
+            doc_id (int): The id of the document.
+            text (str): The text of the document.
+        """
+        terms = tokenize(text)
+        for position, term in enumerate(terms):
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._new_terms.append(term)
+            postings.setdefault(doc_id, []).append(position)
+        self._lengths[doc_id] = len(terms)
+        self._total_length += len(terms)
+
+    def remove(self, doc_id, text):
+        """
+        Removes a document from the index.
+
+        Args:
+            doc_id (int): The id of the document.
+            text (str): The text the document was indexed with.
+        """
+        if doc_id not in self._lengths:
+            return
+        self.merge()
+        for term in set(tokenize(text)):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+                del self._terms[bisect_left(self._terms, term)]
+        self._total_length -= self._lengths.pop(doc_id)
+
+    def search(self, query, limit=None, candidates=None):
+        """
+        Returns the ids of the best matching documents.
+
+        Args:
+            query (str): The search query.
+            limit (int, optional): Maximum number of ids to return. Defaults to all.
+            candidates (set, optional): Only consider these document ids.
+
+        Returns:
+            list: Document ids ordered by descending BM25 score.
+        """
+        scores = None
+        for kind, terms in parse_query(query):
+            if kind == "phrase":
+                part_scores = self._phrase_scores(terms)
+            elif kind == "prefix":
+                part_scores = self._prefix_scores(terms[0])
+            else:
+                part_scores = self._term_scores(terms[0])
+            if scores is None:
+                scores = part_scores
+            else:
+                scores = {
+                    doc_id: score + part_scores[doc_id]
+                    for doc_id, score in scores.items()
+                    if doc_id in part_scores
+                }
+            if not scores:
+                return []
+        if scores is None:
+            return []
+        if candidates is not None:
+            scores = {
+                doc_id: score
+                for doc_id, score in scores.items()
+                if doc_id in candidates
+            }
+        ranked = heapq.nlargest(
+            limit or len(scores),
+            scores.items(),
+            key=lambda item: (item[1], -item[0]),
+        )
+        return [doc_id for doc_id, _ in ranked]
+
+    def _term_scores(self, term):
+        """
+        Returns the BM25 score of a term in every document that contains it.
+        """
+        postings = self._postings.get(term)
+        if not postings:
+            return {}
+        metrics.scanned(len(postings))
+        documents = len(self._lengths)
+        average_length = self._total_length / documents or 1
+        idf = math.log(1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5))
+        scores = {}
+        for doc_id, positions in postings.items():
+            frequency = len(positions)
+            norm = 1 - BM25_B + BM25_B * self._lengths[doc_id] / average_length
+            scores[doc_id] = (
+                idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * norm)
+            )
+        return scores
+
+    def _prefix_scores(self, prefix):
+        """
+        Returns the summed scores of all indexed terms starting with the prefix.
+        """
+        scores = {}
+        self.merge()
+        start = bisect_left(self._terms, prefix)
+        for term in self._terms[start:]:
+            if not term.startswith(prefix):
+                break
+            for doc_id, score in self._term_scores(term).items():
+                scores[doc_id] = scores.get(doc_id, 0) + score
+        return scores
+
+    def _phrase_scores(self, terms):
+        """
+        Returns the summed term scores of the documents containing the exact phrase.
+        """
+        postings = [self._postings.get(term) for term in terms]
+        if not all(postings):
+            return {}
+        doc_ids = set(min(postings, key=len))
+        for term_postings in postings:
+            doc_ids.intersection_update(term_postings)
+        matches = set()
+        for doc_id in doc_ids:
+            following = [set(term_postings[doc_id]) for term_postings in postings[1:]]
+            for position in postings[0][doc_id]:
+                if all(
+                    position + offset in positions
+                    for offset, positions in enumerate(following, start=1)
+                ):
+                    matches.add(doc_id)
+                    break
+        scores = dict.fromkeys(matches, 0)
+        for term in terms:
+            for doc_id, score in self._term_scores(term).items():
+                if doc_id in scores:
+                    scores[doc_id] += score
+        return scores
+
+    def merge(self):
+        """
+        Sorts terms added since the last prefix query into the vocabulary.
+
+        Merging in batches keeps bulk indexing linear instead of inserting
+        every new term into the sorted list.
+        """
+        if self._new_terms:
+            self._terms.extend(self._new_terms)
+            self._terms.sort()
+            self._new_terms = []
@@ -0,0 +1,190 @@
+import csv
+import json
+import os
+from itertools import islice
+from time import perf_counter
+
+from src.classes import Record, validate_records
+
+blue, reset, green, red, yellow = (
+    "\033[94m",
+    "\033[0m",
+    "\033[92m",
+    "\033[91m",
+    "\033[93m",
+)
+
+CONTACT_FIELDS = ("id", "name", "phone", "birthday", "email", "address")
+TEXT_FIELDS = ("name", "phone", "birthday", "email", "address")
+CHUNK_SIZE = 10000
+MAX_REPORTED_ERRORS = 10
+
+
+def file_format(path):
+    """
+    Picks the file format from the extension of the path.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        str: "csv" or "jsonl".
+
+    Raises:
+        ValueError: If the extension is not supported.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    raise ValueError(f"{red}Use a .csv or .jsonl file.{reset}\n")
+
+
+def read_rows(file, file_format):
+    """
+    Lazily reads contact rows from an open CSV or JSON Lines file.
+
+    Empty CSV cells become None and ids become integers.
+
+    Args:
+        file: The open file.
+        file_format (str): "csv" or "jsonl".
+
+    Yields:
+        tuple: Row number and the row as a dictionary, or None if it can't be parsed.
+    """
+    if file_format == "csv":
+        for number, row in enumerate(csv.DictReader(file), start=1):
+            yield number, {field: row.get(field) or None for field in CONTACT_FIELDS}
+        return
+    for number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def not_text(row):
+    """
+    Returns the first field of a row that holds something other than text, or None.
+
+    CSV values are always text, but a JSON Lines row may hold numbers or lists.
+    """
+    for field in TEXT_FIELDS:
+        value = row.get(field)
+        if value is not None and not isinstance(value, str):
+            return field
+    return None
+
+
+def import_contacts(address_book, path, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Streams contacts from a CSV or JSON Lines file into the address book.
+
+    Rows are read, validated and committed in chunks, so memory does not grow
+    with the size of the file. Inside a transaction every chunk is a
+    checkpoint, so the transaction does not keep the imported records
+    either. A row with an id replaces the contact with that id, a row
+    without one becomes a new contact.
+
+    Args:
+        address_book (AddressBook): The address book to import into.
+        path (str): Path of a .csv or .jsonl file.
+        chunk_size (int, optional): Rows per chunk. Defaults to CHUNK_SIZE.
+        progress (callable, optional): Called after each chunk with the number
+            of rows read so far and the elapsed seconds.
+
+    Returns:
+        tuple: Number of imported rows, number of rejected rows, up to
+            MAX_REPORTED_ERRORS (row number, message) pairs and elapsed seconds.
+    """
+    start = perf_counter()
+    imported = rejected = 0
+    errors = []
+
+    def reject(number, message):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append((number, message))
+
+    with open(path, "r", encoding="utf-8", newline="") as file:
+        rows = read_rows(file, file_format(path))
+        read = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            read += len(chunk)
+            parsed = []
+            chunk_errors = []
+            for number, row in chunk:
+                wrong_field = not_text(row) if row is not None else None
+                if row is None:
+                    chunk_errors.append((number, "Row is not a valid record."))
+                elif not row.get("name"):
+                    chunk_errors.append((number, "Name is required."))
+                elif wrong_field:
+                    chunk_errors.append(
+                        (number, f"{wrong_field.capitalize()} must be text.")
+                    )
+                else:
+                    try:
+                        if row.get("id") is not None:
+                            row["id"] = int(row["id"])
+                    except (TypeError, ValueError):
+                        chunk_errors.append((number, "Id must be an integer."))
+                    else:
+                        parsed.append((number, row))
+            invalid = validate_records([row for _, row in parsed])
+            records = []
+            for position, (number, row) in enumerate(parsed):
+                if position in invalid:
+                    message = " ".join(invalid[position].values()).strip()
+                    chunk_errors.append((number, message))
+                else:
+                    records.append(Record.record_from_dict(row))
+            for number, message in sorted(chunk_errors):
+                reject(number, message)
+            address_book.add_records(records)
+            address_book.checkpoint()
+            imported += len(records)
+            if progress:
+                progress(read, perf_counter() - start)
+    return imported, rejected, errors, perf_counter() - start
+
+
+def export_contacts(address_book, path, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Streams all contacts into a CSV or JSON Lines file one record at a time.
+
+    Args:
+        address_book (AddressBook): The address book to export.
+        path (str): Path of a .csv or .jsonl file.
+        chunk_size (int, optional): Rows between progress reports. Defaults to CHUNK_SIZE.
+        progress (callable, optional): Called every chunk_size rows with the number
+            of rows written so far and the elapsed seconds.
+
+    Returns:
+        tuple: Number of exported rows and elapsed seconds.
+    """
+    start = perf_counter()
+    written_format = file_format(path)
+    written = 0
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        if written_format == "csv":
+            writer = csv.DictWriter(file, fieldnames=CONTACT_FIELDS)
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            write = lambda row: file.write(json.dumps(row) + "\n")
+        for record in address_book.values():
+            write(record.record_to_dict())
+            written += 1
+            if progress and written % chunk_size == 0:
+                progress(written, perf_counter() - start)
+    return written, perf_counter() - start
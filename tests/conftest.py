@@ -0,0 +1,32 @@
+import pytest
+
+from src.class_notebook import Note
+from src.classes import AddressBook, Record
+from src.storage import JournalStorage
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """
+    Runs every test in its own directory with fresh id counters.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Record, "_last_id", 0)
+    monkeypatch.setattr(Note, "_last_id", 0)
+    return tmp_path
+
+
+@pytest.fixture
+def book():
+    """
+    An address book on a journal storage with three contacts.
+    """
+    address_book = AddressBook(JournalStorage("book.json"))
+    for record in (
+        Record("Ann Lee", "0501112233", "01.03.1990", email="ann@example.com"),
+        Record("Bob Stone", "0502223344", "15.03.1985"),
+        Record("Cid Moss", "0671234567", email="cid@mail.com"),
+    ):
+        address_book.add_record(record)
+    yield address_book
+    address_book.close()
@@ -0,0 +1,54 @@
+import pytest
+
+import main
+from src import handler_notebook
+from src.class_notebook import Notebook
+from src.classes import Record
+from src.commands import execute_line
+from src.storage import JournalStorage
+
+
+@pytest.fixture
+def notebook(monkeypatch):
+    notebook = Notebook(JournalStorage("notes.json"))
+    monkeypatch.setattr(handler_notebook, "notebook", notebook)
+    monkeypatch.setattr(main, "notebook", notebook)
+    return notebook
+
+
+def test_batch_runs_plain_and_json_lines(book, notebook, capsys):
+    with open("script.txt", "w", encoding="utf-8") as script:
+        script.write(
+            "# contacts\n"
+            "add-contact Dan 0630000000\n"
+            '{"command": "nadd", "args": ["Buy", "milk"], "input": ["home"]}\n'
+            "\n"
+            "show-phone Nobody\n"
+            "nope\n"
+            "{broken\n"
+        )
+
+    assert main.run_batch("script.txt", book, checkpoint=2) == 3
+    assert book.find("Dan").phone.value == "0630000000"
+    assert [note.text for note in notebook.find_notes(["home"])] == ["Buy milk"]
+    assert "Ran 5 commands (3 failed)" in capsys.readouterr().err
+
+
+def test_commands_report_their_status(book, notebook):
+    command, output, succeeded, running = execute_line("show-phone Ann Lee", book)
+    assert (command, succeeded, running) == ("show-phone", False, True)
+    assert "No contact found" in output
+    assert execute_line("search zzz", book)[2]
+    assert execute_line('{"command": "search", "args": ["ann"]}', book)[2]
+    assert not execute_line("nope", book)[2]
+    assert execute_line("{broken", book)[:3:2] == (None, False)
+    assert execute_line("close", book)[3] is False
+
+
+def test_deleting_an_ambiguous_name_fails(book):
+    book.add_record(Record("Bob Stone", "0509998877"))
+
+    command, output, succeeded, _ = execute_line("delete Bob Stone", book)
+    assert (command, succeeded) == ("delete", False)
+    assert len(book.find_all("Bob Stone")) == 2
+    assert execute_line("delete Cid Moss", book)[2]
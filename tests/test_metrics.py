@@ -0,0 +1,48 @@
+from contextlib import redirect_stdout
+import io
+
+import pytest
+
+from src.commands import run_command
+from src.metrics import Histogram, metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def run(command, args, book):
+    with redirect_stdout(io.StringIO()):
+        run_command(command, args, book)
+
+
+def test_commands_are_counted_with_their_scans_and_errors(book):
+    run("search", ["e"], book)
+    run("search", ["e"], book)
+    run("add-birthday", ["Ann Lee", "31.02.1990"], book)
+    run("nope", [], book)
+
+    commands = metrics.snapshot()["commands"]
+    assert commands["search"]["count"] == 2
+    assert commands["search"]["records_scanned"] == 4
+    assert commands["search"]["errors"] == 0
+    assert commands["add-birthday"]["errors"] == 1
+    assert commands["<invalid>"]["count"] == 1
+    assert "search" in metrics.report()
+
+
+def test_histogram_percentiles_are_bucket_bounds():
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.add(0.0002)
+    histogram.add(0.02)
+
+    summary = histogram.to_dict()
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == 0.25
+    assert summary["p99_ms"] == 0.25
+    assert histogram.percentile(1.0) == 20.0
+    assert Histogram().to_dict()["p50_ms"] == 0.0
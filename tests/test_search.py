@@ -0,0 +1,265 @@
+from datetime import datetime
+
+import pytest
+
+from src import classes
+from src.class_notebook import Notebook
+from src.classes import Record
+from src.dedupe import find_duplicates, merge_plan
+from src.handler_notebook import pop_date_range
+from src.handlers import pop_option
+from src.indexes import RangeIndex, alignment_distance
+from src.query import parse_query, run_query
+from src.storage import JournalStorage
+
+
+def names(records):
+    return [record.name.value for record in records]
+
+
+def freeze_today(monkeypatch, year, month, day):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def today(cls):
+            return cls(year, month, day, 12, 0)
+
+    monkeypatch.setattr(classes, "datetime", FrozenDatetime)
+
+
+def test_find_and_delete_by_name(book):
+    assert book.find("Bob Stone").phone.value == "0502223344"
+    assert book.find("bob stone") is None
+    book.add_record(Record("Bob Stone", "0509998877"))
+    with pytest.raises(ValueError):
+        book.find("Bob Stone")
+    book.delete_record("Bob Stone")
+    assert len(book.find_all("Bob Stone")) == 2
+
+    book.delete_record("cid moss")
+    assert book.find("Cid Moss") is None
+    assert book.find("Ann Lee").id == 1
+
+
+def test_search_by_prefix_and_substring(book):
+    book.add_record(Record("Anna Bell"))
+    assert names(book.search("an*")) == ["Ann Lee", "Anna Bell"]
+    assert names(book.search("ON")) == ["Bob Stone"]
+    assert names(book.search("e")) == ["Ann Lee", "Bob Stone", "Anna Bell"]
+    assert names(book.search("e", limit=1, offset=1)) == ["Bob Stone"]
+    assert names(book.search("stone lee")) == []
+
+    book.delete_record("Ann Lee")
+    assert names(book.search("an*")) == ["Anna Bell"]
+
+
+def test_pop_option_checks_the_minimum():
+    args = ["ann", "--limit", "5", "--offset", "0"]
+    assert pop_option(args, "--limit", 50) == 5
+    assert pop_option(args, "--offset", 0, minimum=0) == 0
+    assert args == ["ann"]
+    with pytest.raises(ValueError):
+        pop_option(["--limit", "0"], "--limit", 50)
+    with pytest.raises(ValueError):
+        pop_option(["--limit"], "--limit", 50)
+
+
+def test_next_birthdays_cross_new_year_and_feb_29(book, monkeypatch):
+    book.add_record(Record("Eve Fox", birthday="31.12.1991"))
+    book.add_record(Record("Leap Day", birthday="29.02.2000"))
+    book.add_record(Record("New Year", birthday="01.01.1980"))
+
+    freeze_today(monkeypatch, 2022, 12, 30)
+    upcoming = book.next_birthdays(60)
+    assert "Eve Fox" in upcoming and "(31.12.2022)" in upcoming
+    assert "New Year" in upcoming and "(01.01.2023)" in upcoming
+    assert "Leap Day" in upcoming and "(28.02.2023)" in upcoming
+    assert "Ann Lee" not in upcoming and "Bob Stone" not in upcoming
+
+    freeze_today(monkeypatch, 2023, 12, 30)
+    assert "(29.02.2024)" in book.next_birthdays(61)
+    assert "Leap Day" not in book.next_birthdays(59)
+
+
+def test_next_birthdays_follow_changed_birthdays(book, monkeypatch):
+    freeze_today(monkeypatch, 2024, 3, 1)
+    assert "Ann Lee" in book.next_birthdays(7)
+
+    ann = book.find("Ann Lee")
+    ann.add_birthday("20.03.1990")
+    book.add_record(ann)
+    upcoming = book.next_birthdays(20)
+    assert "Ann Lee (20.03.2024)" in upcoming.replace(classes.yellow, "").replace(
+        classes.reset, ""
+    )
+    assert book.next_birthdays(7) is None
+
+    book.delete_record("Bob Stone")
+    assert "Bob Stone" not in book.next_birthdays(20)
+
+
+def test_notes_in_a_date_range():
+    notebook = Notebook(JournalStorage("notes.json"))
+    for day in (1, 10, 20):
+        notebook.add_note(f"Note of the {day}th", ["day"])
+        notebook.notes[-1].creation_date = datetime(2024, 1, day, 9, 0)
+        notebook.modify_note(notebook.notes[-1].id, f"Note of the {day}th")
+
+    found = notebook.find_notes(since=datetime(2024, 1, 5), until=datetime(2024, 1, 20))
+    assert [note.text for note in found] == ["Note of the 10th"]
+    found = notebook.find_notes(since=datetime(2024, 1, 1), limit=2)
+    assert [note.id for note in found] == [2, 3]
+    found = notebook.find_notes(["day"], "20th", until=datetime(2024, 1, 20, 9, 0, 1))
+    assert [note.id for note in found] == [3]
+
+    notebook.delete_note(2)
+    found = notebook.find_notes(until=datetime(2024, 2, 1))
+    assert [note.id for note in found] == [1, 3]
+
+
+def test_nfind_date_options():
+    args = ["milk", "--since", "01.01.2024", "--until", "2024-01-31"]
+    assert pop_date_range(args) == (datetime(2024, 1, 1), datetime(2024, 2, 1))
+    assert args == ["milk"]
+
+    since, until = pop_date_range(["--last", "24h"])
+    assert until is None
+    assert abs((datetime.today() - since).total_seconds() - 24 * 3600) < 60
+    with pytest.raises(ValueError):
+        pop_date_range(["--since", "31.02.2024"])
+    with pytest.raises(ValueError):
+        pop_date_range(["--since", "01.01.2024", "--last", "3"])
+
+
+def test_phone_lookup_by_number_and_prefix(book):
+    assert names(book.find_by_phone("0502223344")) == ["Bob Stone"]
+    assert names(book.find_by_phone("050")) == ["Ann Lee", "Bob Stone"]
+    assert names(book.find_by_phone("050", limit=1, offset=1)) == ["Bob Stone"]
+    assert names(book.find_by_phone("09")) == []
+    with pytest.raises(ValueError):
+        book.find_by_phone("05a")
+
+
+def test_phone_lookup_follows_changes(book):
+    bob = book.find("Bob Stone")
+    bob.edit_phone("0931112233")
+    book.add_record(bob)
+    book.delete_record("Ann Lee")
+    book.add_record(Record("Dan Roe", "0500000001"))
+
+    assert names(book.find_by_phone("050")) == ["Dan Roe"]
+    assert names(book.find_by_phone("0931112233")) == ["Bob Stone"]
+    assert names(book.find_by_phone("0502223344")) == []
+
+
+def test_fuzzy_search_finds_misspelled_names(book):
+    book.add_record(Record("Johnathan Smith"))
+    book.add_record(Record("John Smith"))
+
+    found = [
+        (distance, record.name.value)
+        for distance, record in book.fuzzy_search("jon smth")
+    ]
+    assert found == [(2, "John Smith")]
+    found = [
+        (distance, record.name.value) for distance, record in book.fuzzy_search("smith")
+    ]
+    assert found == [(0, "Johnathan Smith"), (0, "John Smith")]
+    assert book.fuzzy_search("smith", limit=1)[0][1].name.value == "Johnathan Smith"
+    assert book.fuzzy_search("jon smth", max_distance=0) == []
+    assert book.fuzzy_search("ann") != []
+
+    book.delete_record("John Smith")
+    assert book.fuzzy_search("jon smth") == []
+
+
+def test_fuzzy_search_counts_a_swap_as_one_typo(book):
+    book.add_record(Record("John Smith"))
+    assert alignment_distance("jhon", "john") == 1
+    assert [
+        (distance, record.name.value)
+        for distance, record in book.fuzzy_search("jhon smith")
+    ] == [(1, "John Smith")]
+
+
+def test_fuzzy_search_finds_two_swaps_within_two_typos(book):
+    book.add_record(Record("Johnathan Smith"))
+    assert alignment_distance("ojhnatahn", "johnathan") == 2
+
+    found = book.fuzzy_search("ojhnatahn")
+    assert [(distance, record.name.value) for distance, record in found] == [
+        (2, "Johnathan Smith")
+    ]
+    assert book.fuzzy_search("ojhnatahn", max_distance=1) == []
+
+
+def test_query_intersects_indexes_and_checks_every_condition(book):
+    records, steps = run_query(book, parse_query("month = march and day >= 10"))
+    assert names(records) == ["Bob Stone"]
+    assert steps[0].startswith("index")
+
+    records, steps = run_query(book, parse_query("domain = example.com"))
+    assert names(records) == ["Ann Lee"]
+    assert steps[0].startswith("scan")
+
+
+def test_query_operators_and_negation(book):
+    query = parse_query('phone starts 050 and not name = "ann lee"')
+    assert names(run_query(book, query)[0]) == ["Bob Stone"]
+    assert names(run_query(book, parse_query("year < 1990"))[0]) == ["Bob Stone"]
+    assert names(run_query(book, parse_query("email ends mail.com"))[0]) == ["Cid Moss"]
+    with pytest.raises(ValueError):
+        parse_query("colour = red")
+    with pytest.raises(ValueError):
+        parse_query("month = smarch")
+
+
+def test_query_answers_days_from_the_index_and_takes_apostrophes(book):
+    records, steps = run_query(book, parse_query("day = 15"))
+    assert names(records) == ["Bob Stone"]
+    assert steps[0].startswith("index")
+
+    book.add_record(Record("Sean O'Brien"))
+    records, _ = run_query(book, parse_query("name = sean o'brien"))
+    assert names(records) == ["Sean O'Brien"]
+
+
+def test_dedupe_groups_and_merges_into_the_oldest_record():
+    records = [
+        Record("John Smith", "0501112233"),
+        Record("Jon Smith", "0501112233", email="john@example.com"),
+        Record("Mary Jones", "0679998877"),
+    ]
+
+    groups = find_duplicates(records)
+    assert [[record.id for record in group] for group in groups] == [[1, 2]]
+    kept, taken, removed = merge_plan(groups[0])
+    assert kept.id == 1
+    assert taken["email"][0].value == "john@example.com"
+    assert removed == [2]
+
+
+def test_dedupe_ignores_email_case_and_separates_different_birthdays():
+    records = [
+        Record("Anna Smith", email="anna@example.com"),
+        Record("A. Smith", email="Anna@Example.com"),
+        Record("Peter Pan", "0501112233", "01.01.1990"),
+        Record("Peter Pan", "0501112233", "02.02.1991"),
+    ]
+
+    groups = find_duplicates(records)
+    assert [[record.id for record in group] for group in groups] == [[1, 2]]
+    assert find_duplicates(records, threshold=0.5)[-1][0].id == 3
+
+
+def test_range_index_merges_few_and_many_changes():
+    index = RangeIndex()
+    for record_id in range(1, 101):
+        index.add(record_id, (3, record_id % 28 + 1))
+    assert len(index.between((3, 1), (4, 1))) == 100
+
+    index.add(28, (5, 15))
+    index.remove(56)
+    index.add(7, None)
+    assert index.between((3, 1), (3, 2)) == [((3, 1), 84)]
+    assert index.between((5, 15)) == [((5, 15), 28)]
+    assert len(index.between(high=(3, 9))) == 28
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+
+from src import handler_notebook
+from src.class_notebook import Notebook
+from src.classes import AddressBook, Record
+from src.server import CommandServer
+from src.storage import JournalStorage
+
+
+async def talk(server, lines):
+    task = asyncio.create_task(server.serve("neoneo.sock"))
+    for _ in range(500):
+        try:
+            reader, writer = await asyncio.open_unix_connection("neoneo.sock")
+            break
+        except OSError:
+            await asyncio.sleep(0.01)
+    replies = []
+    for line in lines:
+        writer.write((line + "\n").encode("utf-8"))
+        await writer.drain()
+        replies.append(json.loads(await reader.readline()))
+    writer.close()
+    server.stop()
+    await task
+    return replies
+
+
+class FailingOnceStorage(JournalStorage):
+    def __init__(self, path):
+        super().__init__(path)
+        self.failures = 1
+
+    def apply(self, changes):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().apply(changes)
+
+
+def reload():
+    address_book = AddressBook(JournalStorage("book.json"))
+    address_book.load_contacts_from_file()
+    return address_book
+
+
+def test_server_answers_clients_and_writes_on_stop(book, monkeypatch):
+    notebook = Notebook(JournalStorage("notes.json"))
+    monkeypatch.setattr(handler_notebook, "notebook", notebook)
+    server = CommandServer(book, notebook, flush_interval=60)
+
+    replies = asyncio.run(
+        talk(
+            server,
+            [
+                "add-contact Dan 0630000000",
+                "show-phone Dan",
+                '{"command": "nadd", "args": ["Buy", "milk"], "input": ["home"]}',
+                "nope",
+            ],
+        )
+    )
+    assert [reply["command"] for reply in replies] == [
+        "add-contact",
+        "show-phone",
+        "nadd",
+        "nope",
+    ]
+    assert [reply["status"] for reply in replies] == ["ok", "ok", "ok", "error"]
+    assert "0630000000" in replies[1]["output"]
+    assert reload().find("Dan").phone.value == "0630000000"
+    assert len(notebook.find_notes(["home"])) == 1
+
+
+def test_failed_flush_keeps_the_changes_for_the_next_one(capsys):
+    book = AddressBook(FailingOnceStorage("book.json"))
+    notebook = Notebook(JournalStorage("notes.json"))
+    server = CommandServer(book, notebook)
+    server._open_window()
+    book.add_record(Record("Dan Roe", "0630000000"))
+    notebook.add_note("Buy milk")
+
+    assert not server._flush()
+    assert "disk full" in capsys.readouterr().err
+    assert book.find("Dan Roe") is not None
+    assert not os.path.exists("book.json.journal")
+
+    assert server._flush()
+    assert reload().find("Dan Roe").phone.value == "0630000000"
+    server._close_window()
+    assert len(notebook.notes) == 1
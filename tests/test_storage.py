@@ -0,0 +1,238 @@
+import json
+import os
+import time
+
+import pytest
+
+from src.class_notebook import Notebook
+from src.classes import CONTACT_SNAPSHOT_FIELDS, AddressBook, Record
+from src.snapshot import SnapshotStorage
+from src.sqlite_storage import SQLiteContactStorage, SQLiteNoteStorage
+from src.storage import JournalStorage, WriteBehindStorage
+
+
+def contact(record_id, name="Ann", phone=None):
+    return {
+        "id": record_id,
+        "name": name,
+        "phone": phone,
+        "birthday": None,
+        "email": None,
+        "address": None,
+    }
+
+
+def by_id(records):
+    return {data["id"]: data for data in records}
+
+
+def journal_text(path="book.json.journal"):
+    if not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as journal:
+        return journal.read()
+
+
+def test_journal_replays_puts_and_deletes():
+    storage = JournalStorage("book.json")
+    for record_id in (1, 2, 3):
+        storage.put(contact(record_id))
+    storage.put(contact(1, "Ann Lee"))
+    storage.delete(2)
+    storage.close()
+
+    records = by_id(JournalStorage("book.json").load())
+    assert sorted(records) == [1, 3]
+    assert records[1]["name"] == "Ann Lee"
+
+
+def test_journal_replays_batches():
+    storage = JournalStorage("book.json")
+    storage.put_many([contact(1), contact(2), contact(3)])
+    storage.apply([(1, contact(1, "Ann Lee")), (3, None), (4, contact(4))])
+    storage.close()
+
+    records = by_id(JournalStorage("book.json").load())
+    assert sorted(records) == [1, 2, 4]
+    assert records[1]["name"] == "Ann Lee"
+
+
+def test_journal_drops_a_torn_tail():
+    storage = JournalStorage("book.json")
+    storage.put(contact(1))
+    storage.close()
+    with open("book.json.journal", "a", encoding="utf-8") as journal:
+        journal.write('{"op":"put","data":{"id":2')
+
+    reloaded = JournalStorage("book.json")
+    assert [data["id"] for data in reloaded.load()] == [1]
+    with open("book.json.journal", "rb") as journal:
+        assert journal.read().endswith(b"\n")
+
+
+def test_missing_storage_raises_file_not_found():
+    with pytest.raises(FileNotFoundError):
+        JournalStorage("book.json").load()
+
+
+def test_compaction_merges_the_journal_into_the_snapshot():
+    storage = JournalStorage("book.json", compact_threshold=200)
+    for record_id in range(1, 11):
+        storage.put(contact(record_id))
+    storage.delete(5)
+    storage.close()
+
+    assert not os.path.exists("book.json.journal.old")
+    with open("book.json", encoding="utf-8") as file:
+        assert json.load(file)
+    records = by_id(JournalStorage("book.json").load())
+    assert sorted(records) == [1, 2, 3, 4, 6, 7, 8, 9, 10]
+
+
+def test_sqlite_storage_writes_the_changed_rows():
+    storage = SQLiteContactStorage("book.db")
+    storage.put_many([contact(1), contact(2, phone="0501112233")])
+    storage.put(contact(1, "Ann Lee"))
+    storage.delete(2)
+    storage.close()
+
+    reopened = SQLiteContactStorage("book.db")
+    assert reopened.load() == [contact(1, "Ann Lee")]
+    reopened.close()
+
+
+def test_snapshot_storage_serves_journaled_changes_and_compacts():
+    fields = CONTACT_SNAPSHOT_FIELDS
+    storage = SnapshotStorage("book.snap", fields, sorted_fields=("name",))
+    storage.save([contact(1, "Ann"), contact(2, "Bob")])
+    storage.put(contact(2, "Bobby"))
+    storage.put(contact(3, "Cid"))
+    storage.delete(1)
+    storage.close()
+
+    reader, changes = SnapshotStorage("book.snap", fields).open_snapshot()
+    assert changes == {2: contact(2, "Bobby"), 3: contact(3, "Cid"), 1: None}
+    assert len(reader) == 2
+    assert reader.find("name", "Bob") == [2]
+
+    storage = SnapshotStorage("book.snap", fields)
+    storage.open_snapshot()
+    storage.compact()
+    storage.close()
+    reader, changes = SnapshotStorage("book.snap", fields).open_snapshot()
+    assert changes == {}
+    assert [reader.id_at(position) for position in range(len(reader))] == [2, 3]
+
+
+def test_snapshot_storage_is_seeded_from_the_json_file():
+    seed = JournalStorage("book.json")
+    seed.save([contact(1, "Ann"), contact(2, "Bob")])
+
+    storage = SnapshotStorage(
+        "book.snap", CONTACT_SNAPSHOT_FIELDS, seed_path="book.json"
+    )
+    reader, changes = storage.open_snapshot()
+    assert changes == {}
+    assert reader.row(reader.position_of(2)) == contact(2, "Bob")
+    storage.close()
+
+
+def test_last_id_survives_deletion_and_save():
+    storage = JournalStorage("book.json")
+    storage.put_many([contact(1), contact(2), contact(3)])
+    storage.delete(3)
+    storage.save([contact(1), contact(2)])
+
+    reloaded = JournalStorage("book.json")
+    reloaded.load()
+    assert reloaded.last_id() == 3
+    assert not os.path.exists("book.json.journal")
+
+
+def test_sqlite_storage_keeps_the_last_id():
+    storage = SQLiteContactStorage("book.db")
+    storage.put_many([contact(1), contact(2)])
+    storage.delete(2)
+    storage.close()
+
+    reopened = SQLiteContactStorage("book.db")
+    assert reopened.last_id() == 2
+    reopened.close()
+
+
+def test_sqlite_storage_is_seeded_once_and_answers_lookups_in_sql():
+    JournalStorage("book.json").save(
+        [contact(1, "Ann Lee", "0501112233"), contact(3, "Bob Stone", "0672223344")]
+    )
+    book = AddressBook(SQLiteContactStorage("book.db", seed_path="book.json"))
+    assert book.load_contacts_from_file()[0] == 2
+    assert [record.id for record in book.find_all("ann lee", ignore_case=True)] == [1]
+    assert [record.id for record in book.find_by_phone("067")] == [3]
+    assert not book._indexed
+
+    book.add_record(Record("Cid Moss", "0673334455"))
+    book.delete_record("Ann Lee")
+    assert [record.id for record in book.find_by_phone("067")] == [3, 4]
+    book.storage.sync()
+    book.close()
+
+    reopened = SQLiteContactStorage("book.db", seed_path="book.json")
+    assert [data["name"] for data in reopened.load()] == ["Bob Stone", "Cid Moss"]
+    assert reopened.last_id() == 4
+    reopened.close()
+
+
+def test_sqlite_notes_are_found_by_tag_in_sql():
+    storage = SQLiteNoteStorage("notes.db")
+    storage.put_many(
+        [
+            {
+                "id": 1,
+                "text": "Milk",
+                "tags": ["home"],
+                "creation_date": "2024-01-01 09:00:00",
+            },
+            {
+                "id": 2,
+                "text": "Call",
+                "tags": ["home", "work"],
+                "creation_date": "2024-01-02 09:00:00",
+            },
+        ]
+    )
+    notebook = Notebook(storage)
+    notebook.load_from_file()
+    notebook.modify_note(1, "Bread")
+    notebook.add_note("Report", ["work"])
+
+    assert [note.id for note in notebook.find_notes(["work"])] == [2, 3]
+    assert [note.id for note in notebook.find_notes(["home"])] == [1, 2]
+    assert not notebook._tags_indexed
+    notebook.close()
+
+
+def test_write_behind_coalesces_changes_and_flushes_on_close():
+    inner = JournalStorage("book.json")
+    storage = WriteBehindStorage(inner, delay=60)
+    for name in ("A", "B", "C"):
+        storage.put(contact(1, name))
+    storage.put(contact(2))
+    storage.delete(2)
+    assert storage.last_id() == 2
+    assert not os.path.exists("book.json.journal")
+    storage.close()
+
+    assert len(journal_text().splitlines()) == 1
+    records = by_id(JournalStorage("book.json").load())
+    assert list(records) == [1]
+    assert records[1]["name"] == "C"
+
+
+def test_write_behind_writes_in_the_background():
+    storage = WriteBehindStorage(JournalStorage("book.json"), delay=0.01)
+    storage.put(contact(1))
+    deadline = time.monotonic() + 5
+    while not journal_text().endswith("\n") and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [data["id"] for data in JournalStorage("book.json").load()] == [1]
+    storage.close()
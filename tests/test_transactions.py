@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+from src import handlers
+from src.class_notebook import Notebook
+from src.classes import AddressBook, Record
+from src.storage import JournalStorage
+from src.transfer import import_contacts
+
+
+def journal_lines(path="book.json.journal"):
+    with open(path, encoding="utf-8") as journal:
+        return [json.loads(line) for line in journal]
+
+
+def reload(path="book.json"):
+    address_book = AddressBook(JournalStorage(path))
+    address_book.load_contacts_from_file()
+    return address_book
+
+
+def test_transaction_writes_one_batch(book):
+    before = len(journal_lines())
+    with book.transaction():
+        handlers.change_phone(["Ann Lee", "0509999999"], book)
+        handlers.add_email(["Bob Stone", "bob@example.com"], book)
+        book.delete_record("Cid Moss")
+
+    lines = journal_lines()
+    assert len(lines) == before + 1
+    assert lines[-1]["op"] == "batch"
+    assert len(lines[-1]["entries"]) == 3
+    reloaded = reload()
+    assert reloaded.find("Ann Lee").phone.value == "0509999999"
+    assert reloaded.find("Bob Stone").email.value == "bob@example.com"
+    assert reloaded.find("Cid Moss") is None
+
+
+def test_rollback_restores_edited_added_and_deleted_records(book):
+    before = len(journal_lines())
+    with pytest.raises(RuntimeError):
+        with book.transaction():
+            handlers.change_phone(["Ann Lee", "0509999999"], book)
+            book.add_record(Record("Dan Roe", "0630000000"))
+            book.delete_record("Bob Stone")
+            raise RuntimeError
+
+    assert book.find("Ann Lee").phone.value == "0501112233"
+    assert book.find("Dan Roe") is None
+    assert book.find("Bob Stone").phone.value == "0502223344"
+    assert len(journal_lines()) == before
+
+
+def test_notebook_rollback():
+    notebook = Notebook(JournalStorage("notes.json"))
+    notebook.add_note("Buy milk", ["home"])
+    notebook.add_note("Call Bob", ["work"])
+    with pytest.raises(RuntimeError):
+        with notebook.transaction():
+            notebook.modify_note(1, "Buy bread")
+            notebook.delete_note(2)
+            raise RuntimeError
+    assert notebook.find_note_by_id(1).text == "Buy milk"
+    assert notebook.find_note_by_id(2) is not None
+    assert [note.id for note in notebook.find_notes(["home"])] == [1]
+
+
+def test_notebook_never_reuses_a_note_id():
+    notebook = Notebook(JournalStorage("notes.json"))
+    notebook.add_note("Buy milk")
+    notebook.add_note("Call Bob")
+    notebook.delete_note(2)
+    notebook.close()
+
+    reloaded = Notebook(JournalStorage("notes.json"))
+    reloaded.load_from_file()
+    reloaded.add_note("New")
+    assert [note.id for note in reloaded.notes] == [1, 3]
+
+
+def test_reads_inside_a_transaction_copy_nothing(book):
+    with book.transaction():
+        list(book.search(""))
+        list(book.find_by_phone("0"))
+        book.find("Ann Lee")
+        assert book._before == {}
+        book.find("Ann Lee", for_update=True)
+        assert list(book._before) == [1]
+
+
+def test_loading_keeps_ids_and_the_id_counter(book):
+    book.delete_record("Cid Moss")
+    book.close()
+    Record._last_id = 0
+
+    reloaded = reload()
+    list(reloaded.search(""))
+    assert sorted(reloaded.data) == [1, 2]
+    assert Record("Dan Roe").id == 4
+
+
+def test_checkpoint_writes_and_keeps_the_transaction_open(book):
+    with book.transaction():
+        book.add_record(Record("Dan Roe", "0630000000"))
+        book.checkpoint()
+        assert book._before == {} and book._dirty == set()
+        assert reload().find("Dan Roe") is not None
+        book.add_record(Record("Eve Fox"))
+    assert reload().find("Eve Fox") is not None
+
+
+def test_import_inside_a_transaction_is_checkpointed(book):
+    with open("rows.jsonl", "w", encoding="utf-8") as file:
+        for number in range(25):
+            file.write(json.dumps({"name": f"Row {number}"}) + "\n")
+
+    with book.transaction():
+        imported, rejected, _, _ = import_contacts(book, "rows.jsonl", chunk_size=10)
+        assert len(book._dirty) == 0
+    assert (imported, rejected) == (25, 0)
+    assert len(reload().data) == 28
+
+
+def test_loading_rejects_corrupt_stored_values(book):
+    book.close()
+    with open("book.json.journal", "a", encoding="utf-8") as journal:
+        journal.write(
+            json.dumps(
+                {"op": "put", "data": {"id": 2, "name": "Bob", "phone": "12345"}}
+            )
+            + "\n"
+        )
+
+    with pytest.raises(ValueError):
+        reload()
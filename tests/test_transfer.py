@@ -0,0 +1,75 @@
+import json
+
+from src import handlers
+from src.classes import AddressBook, Record
+from src.storage import JournalStorage
+from src.transfer import export_contacts, import_contacts
+
+
+def write_lines(path, rows):
+    with open(path, "w", encoding="utf-8") as file:
+        for row in rows:
+            file.write(json.dumps(row) + "\n")
+
+
+def test_export_and_import_round_trip(book):
+    for path in ("contacts.csv", "contacts.jsonl"):
+        exported, _ = export_contacts(book, path)
+        assert exported == 3
+
+        copy = AddressBook(JournalStorage(f"{path}.json"))
+        imported, rejected, errors, _ = import_contacts(copy, path, chunk_size=2)
+        assert (imported, rejected, errors) == (3, 0, [])
+        assert [record.record_to_dict() for record in copy.values()] == [
+            record.record_to_dict() for record in book.values()
+        ]
+        copy.close()
+
+
+def test_import_rejects_bad_rows_and_replaces_by_id(book):
+    write_lines(
+        "rows.jsonl",
+        [
+            {"name": "Dan Roe", "phone": "0630000000"},
+            {"phone": "0631111111"},
+            {"name": "Eve Fox", "phone": "12345"},
+            {"name": "Eve Fox", "birthday": "31.02.1990"},
+            {"id": 2, "name": "Bob Stone", "phone": "0939999999"},
+        ],
+    )
+    with open("rows.jsonl", "a", encoding="utf-8") as file:
+        file.write("not json\n")
+
+    imported, rejected, errors, _ = import_contacts(book, "rows.jsonl")
+    assert (imported, rejected) == (2, 4)
+    assert [number for number, _ in errors] == [2, 3, 4, 6]
+    assert errors[0][1] == "Name is required."
+    assert book.find("Dan Roe") is not None
+    assert book.find("Bob Stone").phone.value == "0939999999"
+    assert len(book.find_all("Bob Stone")) == 1
+    assert book.find("Eve Fox") is None
+
+
+def test_import_rejects_fields_that_are_not_text(book):
+    write_lines("rows.jsonl", [{"name": "Dan Roe", "phone": 630000000}])
+
+    imported, rejected, errors, _ = import_contacts(book, "rows.jsonl")
+    assert (imported, rejected) == (0, 1)
+    assert errors == [(1, "Phone must be text.")]
+
+
+def test_export_command_checks_its_path(book):
+    assert "Give me a path" in handlers.export_contacts([], book)
+    assert "Can't write the file" in handlers.export_contacts(["no/such/dir.csv"], book)
+    assert "Use a .csv or .jsonl file" in handlers.export_contacts(["out.txt"], book)
+    assert "Exported 3 contacts" in handlers.export_contacts(["out.csv"], book)
+
+
+def test_contacts_without_a_phone_are_exported_and_shown(book):
+    book.add_record(Record("Dan Roe", email="dan@example.com"))
+    export_contacts(book, "contacts.jsonl")
+    with open("contacts.jsonl", encoding="utf-8") as file:
+        rows = [json.loads(line) for line in file]
+    assert rows[-1]["phone"] is None
+
+    assert "Dan Roe" in str(book.find("Dan Roe"))